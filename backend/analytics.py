@@ -0,0 +1,395 @@
+# backend/analytics.py
+"""Columnar export of predictions and appointments for population-level reports.
+
+``export`` streams rows out of SQLite in id order, ``chunk_size`` at a time,
+into NumPy ``.npz`` part files partitioned by month and disease:
+
+    exports/predictions/month=2026-10/disease=heart/part-0000000001-0000050000.npz
+
+A state file records the last exported id, so later runs read only new rows.
+Predictions never change once written. Appointments do (pending -> approved or
+rejected), so their export resumes from the oldest appointment that was still
+pending last time and rewrites the parts from there on.
+
+The report helpers read only the exported files, never the live database.
+
+Run from backend/:  python analytics.py export [--full] | report [--by disease week ...] | doctors
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'medical_app.db')
+EXPORT_DIR = os.path.join(BASE_DIR, 'exports')
+STATE_FILE = '_state.json'
+CHUNK_SIZE = 50_000
+# Appointment statuses that a doctor can still change
+OPEN_STATUSES = ['pending']
+
+PART_PATTERN = re.compile(r'part-(\d+)-(\d+)\.npz$')
+
+
+# ---------------- ROW CONVERSION ----------------
+def _dates(values, unit):
+    # CURRENT_TIMESTAMP text ('2026-10-17 09:30:00') parses directly as datetime64
+    try:
+        return np.array(values, dtype=f'datetime64[{unit}]')
+    except ValueError:
+        pass
+    # Free-text dates (appointments booked by doctor name) become NaT instead of aborting the export
+    dates = np.full(len(values), np.datetime64('NaT', unit))
+    for i, value in enumerate(values):
+        try:
+            dates[i] = np.datetime64(value, unit)
+        except ValueError:
+            pass
+    print(f"⚠️ {int(np.isnat(dates).sum())} of {len(values)} dates could not be parsed; exported as NaT")
+    return dates
+
+
+def _prediction_columns(rows):
+    ids, users, diseases, results, confidence, dates, schema_ids, payloads = zip(*rows)
+    columns = {
+        'id': np.array(ids, dtype=np.int64),
+        'user_id': np.array(users, dtype=np.int64),
+        'disease': np.array(diseases, dtype=str),
+        'positive': np.array(results, dtype=str) == 'Positive',
+        'confidence': np.array([np.nan if c is None else c for c in confidence], dtype=np.float32),
+        'date': _dates(dates, 's'),
+        'input_schema_id': np.array([0 if s is None else s for s in schema_ids], dtype=np.int64),
+    }
+    return columns, payloads
+
+
+def _appointment_columns(rows):
+    ids, users, doctors, names, statuses, dates, diseases, results = zip(*rows)
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'user_id': np.array(users, dtype=np.int64),
+        'doctor_id': np.array(doctors, dtype=np.int64),
+        'doctor_name': np.array(names, dtype=str),
+        'status': np.array(statuses, dtype=str),
+        'date': _dates(dates, 'D'),
+        'disease': np.array(diseases, dtype=str),
+        # Result of the prediction the booking came from: 1, 0, or -1 when there is none
+        'positive': np.array([-1 if r is None else r for r in results], dtype=np.int8),
+    }, None
+
+
+EXPORTS = {
+    'predictions': {
+        'query': '''
+            SELECT id, user_id, LOWER(disease_type), prediction_result, confidence, prediction_date,
+                   input_schema_id, input_data
+            FROM predictions WHERE id >= ? ORDER BY id LIMIT ?
+        ''',
+        'columns': _prediction_columns,
+        'mutable': False,
+    },
+    'appointments': {
+        'query': '''
+            SELECT a.id, a.user_id, COALESCE(a.doctor_id, 0), a.doctor_name, COALESCE(a.status, 'pending'),
+                   a.appointment_date, COALESCE(LOWER(p.disease_type), 'none'),
+                   p.prediction_result = 'Positive'
+            FROM appointments a LEFT JOIN predictions p ON p.id = a.prediction_id
+            WHERE a.id >= ? ORDER BY a.id LIMIT ?
+        ''',
+        'columns': _appointment_columns,
+        'mutable': True,
+    },
+}
+
+
+# ---------------- PART FILES ----------------
+def _parts(table_dir):
+    """``[(path, first_id, last_id), ...]`` for every part file of a table."""
+    parts = []
+    for path in glob.glob(os.path.join(table_dir, 'month=*', 'disease=*', 'part-*.npz')):
+        match = PART_PATTERN.search(path)
+        if match:
+            parts.append((path, int(match.group(1)), int(match.group(2))))
+    return parts
+
+
+def _save_npz(path, arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def _features(payloads, schema_ids, schemas):
+    """Packed input rows as one (n, k) float32 matrix, when the part shares one column set."""
+    schema_id = int(schema_ids[0])
+    if schema_id not in schemas or (schema_ids != schema_id).any():
+        return {}
+    columns = schemas[schema_id]
+    matrix = np.frombuffer(b''.join(payloads), dtype='<f4').reshape(len(payloads), len(columns))
+    return {'features': matrix, 'feature_columns': np.array(columns, dtype=str)}
+
+
+def _write_partitions(table_dir, columns, payloads, schemas):
+    """Split one chunk by (month, disease) and write a part file for each group."""
+    months = columns['date'].astype('datetime64[M]').astype(str)
+    keys = np.char.add(np.char.add(months, '/'), columns['disease'])
+    groups, inverse = np.unique(keys, return_inverse=True)
+    written = 0
+    for g, key in enumerate(groups):
+        month, disease = key.split('/', 1)
+        rows = np.flatnonzero(inverse == g)
+        arrays = {name: values[rows] for name, values in columns.items() if name != 'disease'}
+        if 'input_schema_id' in arrays:
+            arrays.update(_features([payloads[i] for i in rows], arrays['input_schema_id'], schemas))
+        ids = arrays['id']
+        path = os.path.join(table_dir, f'month={month}', f'disease={disease}',
+                            f'part-{ids[0]:010d}-{ids[-1]:010d}.npz')
+        _save_npz(path, arrays)
+        written += 1
+    return written
+
+
+# ---------------- EXPORT ----------------
+def _load_state(export_dir):
+    try:
+        with open(os.path.join(export_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(export_dir, state):
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _input_schemas(conn):
+    try:
+        rows = conn.execute('SELECT id, columns FROM input_schemas').fetchall()
+    except sqlite3.OperationalError:
+        return {}  # database from before the column dictionary existed
+    return {schema_id: json.loads(columns) for schema_id, columns in rows}
+
+
+def _export_table(conn, spec, table_dir, table_state, chunk_size, schemas):
+    start = table_state.get('reopen_from') or table_state.get('last_id', 0) + 1
+
+    # Parts holding ids from ``start`` on are rewritten whole, which can pull
+    # ``start`` back to their first id (and so on, since chunks interleave ids).
+    parts = _parts(table_dir)
+    while True:
+        first = min([start] + [lo for _, lo, hi in parts if hi >= start])
+        if first == start:
+            break
+        start = first
+    for path, _, hi in parts:
+        if hi >= start:
+            os.remove(path)
+
+    exported, files, reopen_from = 0, 0, None
+    while True:
+        rows = conn.execute(spec['query'], (start, chunk_size)).fetchall()
+        if not rows:
+            break
+        columns, payloads = spec['columns'](rows)
+        files += _write_partitions(table_dir, columns, payloads, schemas)
+        if spec['mutable'] and reopen_from is None:
+            still_open = columns['id'][np.isin(columns['status'], OPEN_STATUSES)]
+            if len(still_open):
+                reopen_from = int(still_open[0])
+        start = int(columns['id'][-1]) + 1
+        exported += len(rows)
+
+    table_state['last_id'] = start - 1
+    table_state['reopen_from'] = reopen_from
+    return exported, files
+
+
+def export(db_path=DB_PATH, export_dir=EXPORT_DIR, chunk_size=CHUNK_SIZE, full=False):
+    """Export new rows of every table; ``full`` discards previous exports first.
+
+    Returns ``{table: (rows exported, part files written)}``.
+    """
+    if full:
+        for table in EXPORTS:
+            shutil.rmtree(os.path.join(export_dir, table), ignore_errors=True)
+    state = {} if full else _load_state(export_dir)
+
+    # Read-only, and each chunk is its own short query, so the app keeps writing meanwhile
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        schemas = _input_schemas(conn)
+        summary = {}
+        for table, spec in EXPORTS.items():
+            summary[table] = _export_table(conn, spec, os.path.join(export_dir, table),
+                                           state.setdefault(table, {}), chunk_size, schemas)
+            _save_state(export_dir, state)
+    finally:
+        conn.close()
+    return summary
+
+
+# ---------------- LOADING ----------------
+def load(table, export_dir=EXPORT_DIR, columns=None, months=None, diseases=None):
+    """Concatenate a table's exported parts into ``{column: array}``.
+
+    ``months`` ('2026-10', ...) and ``diseases`` select partitions without opening
+    the other files; ``columns`` limits which arrays are read from each part.
+    """
+    arrays = {}
+    for path, _, _ in sorted(_parts(os.path.join(export_dir, table)), key=lambda p: p[1]):
+        month, disease = (segment.split('=', 1)[1] for segment in path.split(os.sep)[-3:-1])
+        if (months and month not in months) or (diseases and disease not in diseases):
+            continue
+        with np.load(path) as part:
+            # The feature matrix is per-disease; load_features reads it
+            names = [name for name in (columns or part.files)
+                     if name in part.files and not name.startswith('feature')]
+            for name in names:
+                arrays.setdefault(name, []).append(part[name])
+            n = len(part['id'])
+        arrays.setdefault('disease', []).append(np.full(n, disease))
+    if not arrays:
+        return {}
+    return {name: np.concatenate(chunks) for name, chunks in arrays.items()}
+
+
+def load_features(disease, export_dir=EXPORT_DIR):
+    """``(ids, matrix, columns)`` of the exported input rows for one disease."""
+    ids, matrices, feature_columns = [], [], None
+    for path, _, _ in sorted(_parts(os.path.join(export_dir, 'predictions')), key=lambda p: p[1]):
+        if os.sep + f'disease={disease}' + os.sep not in path:
+            continue
+        with np.load(path) as part:
+            if 'features' not in part.files:
+                continue
+            columns = part['feature_columns'].tolist()
+            if feature_columns is None:
+                feature_columns = columns
+            elif columns != feature_columns:
+                continue  # rows saved under an older feature set
+            ids.append(part['id'])
+            matrices.append(part['features'])
+    if not ids:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), []
+    return np.concatenate(ids), np.concatenate(matrices), feature_columns
+
+
+# ---------------- AGGREGATION ----------------
+def week_start(dates):
+    """Monday of each date's ISO week (1970-01-01 was a Thursday)."""
+    days = dates.astype('datetime64[D]')
+    monday = (days.astype(np.int64) - (days.astype(np.int64) + 3) % 7).astype('datetime64[D]')
+    return np.where(np.isnat(days), days, monday)
+
+
+def _group_keys(columns, by):
+    keys = {
+        'disease': lambda: columns['disease'],
+        'month': lambda: columns['date'].astype('datetime64[M]').astype(str),
+        'week': lambda: week_start(columns['date']).astype(str),
+        'doctor': lambda: columns['doctor_name'],
+    }
+    parts = [keys[name]() for name in by]
+    combined = parts[0].astype(str)
+    for part in parts[1:]:
+        combined = np.char.add(np.char.add(combined, '\x1f'), part.astype(str))
+    return combined
+
+
+def group_counts(columns, by, flags):
+    """Row count and per-flag sums for every distinct ``by`` key, without a Python loop over rows.
+
+    ``flags`` maps an output name to a boolean/0-1 array aligned with ``columns``.
+    Returns a list of dicts sorted by key.
+    """
+    if not columns:
+        return []
+    labels, inverse = np.unique(_group_keys(columns, by), return_inverse=True)
+    total = np.bincount(inverse, minlength=len(labels))
+    sums = {name: np.bincount(inverse, weights=np.asarray(values, dtype=np.float64), minlength=len(labels))
+            for name, values in flags.items()}
+    return [{**dict(zip(by, label.split('\x1f'))), 'total': int(total[i]),
+             **{name: int(values[i]) for name, values in sums.items()}}
+            for i, label in enumerate(labels)]
+
+
+def positive_rates(by=('disease',), export_dir=EXPORT_DIR, **filters):
+    """Prediction count and positive rate per disease / month / week (any combination)."""
+    columns = load('predictions', export_dir, columns=['id', 'date', 'positive'], **filters)
+    rows = group_counts(columns, list(by), {'positive': columns.get('positive', [])})
+    for row in rows:
+        row['positive_rate'] = round(row['positive'] / row['total'], 4)
+    return rows
+
+
+def doctor_report(export_dir=EXPORT_DIR, **filters):
+    """Appointments per doctor by status, and the positive rate of the predictions behind them."""
+    columns = load('appointments', export_dir, columns=['id', 'date', 'doctor_name', 'status', 'positive'],
+                   **filters)
+    if not columns:
+        return []
+    status, positive = columns['status'], columns['positive']
+    rows = group_counts(columns, ['doctor'], {
+        'pending': status == 'pending',
+        'approved': status == 'approved',
+        'rejected': status == 'rejected',
+        'with_prediction': positive >= 0,
+        'positive': positive == 1,
+    })
+    for row in rows:
+        linked = row.pop('with_prediction')
+        row['positive_rate'] = round(row['positive'] / linked, 4) if linked else None
+    return rows
+
+
+# ---------------- CLI ----------------
+def _print_rows(rows):
+    if not rows:
+        print("(no exported rows)")
+        return
+    headers = list(rows[0])
+    widths = [max(len(h), *(len(str(r[h])) for r in rows)) for h in headers]
+    print('  '.join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export predictions/appointments and report from the exports.")
+    parser.add_argument('command', choices=['export', 'report', 'doctors'])
+    parser.add_argument('--db', default=DB_PATH, help="SQLite database to export from")
+    parser.add_argument('--out', default=EXPORT_DIR, help="export directory")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--full', action='store_true', help="discard previous exports and start over")
+    parser.add_argument('--by', nargs='+', choices=['disease', 'month', 'week'], default=['disease'])
+    parser.add_argument('--month', nargs='+', dest='months', help="only these months (YYYY-MM)")
+    parser.add_argument('--disease', nargs='+', dest='diseases', help="only these diseases")
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        start = time.perf_counter()
+        summary = export(args.db, args.out, args.chunk_size, full=args.full)
+        for table, (rows, files) in summary.items():
+            print(f"📦 {table}: {rows} rows -> {files} part files")
+        print(f"✅ Export finished in {time.perf_counter() - start:.1f}s ({args.out})")
+    elif args.command == 'report':
+        _print_rows(positive_rates(args.by, args.out, months=args.months, diseases=args.diseases))
+    else:
+        _print_rows(doctor_report(args.out, months=args.months, diseases=args.diseases))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,28 +1,32 @@
 # backend/app.py
 import os
-import joblib
+import csv
+import io
 import traceback
-from datetime import datetime, timedelta
-from functools import wraps
+from datetime import date, datetime, timedelta
 import bcrypt
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
-import jwt
 
-from database import Database
+from auth import generate_token, token_required, token_cache
+from cache import TTLCache, etag_for
+from database import Database, SlotTakenError, encode_cursor
 from email_service import EmailService
+from email_outbox import EmailOutbox
+from password_hasher import HashingQueueFull
+from inference import InputError, ModelRegistry
 
 
 # =====================================================
 # CONFIGURATION
 # =====================================================
-JWT_SECRET = os.environ.get('JWT_SECRET', 'replace-this-secret-with-env-var')
-JWT_ALGORITHM = 'HS256'
-JWT_EXP_DELTA_HOURS = int(os.environ.get('JWT_EXP_DELTA_HOURS', 24))
-
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.join(BASE_DIR, '../frontend')
 MODELS_DIR = os.path.join(BASE_DIR, 'models')
+MODEL_ENGINE = os.environ.get('MODEL_ENGINE', 'sklearn')   # 'sklearn' or 'compiled'
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 5))   # seconds, 0 disables hot reload
+EMAIL_OUTBOX_WORKER = os.environ.get('EMAIL_OUTBOX_WORKER', '1') != '0'
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 300))
 
 app = Flask(__name__, static_folder=FRONTEND_DIR, static_url_path='')
 CORS(app)
@@ -30,129 +34,99 @@ CORS(app)
  
 db = Database()
 email_service = EmailService()
+# Emails are written to the outbox table and sent by a background thread,
+# so SMTP latency and outages never hold up a request. With
+# EMAIL_OUTBOX_WORKER=0 run `python email_outbox.py` as the sender instead.
+email_outbox = EmailOutbox(db, email_service)
+email_service.outbox = email_outbox
+if EMAIL_OUTBOX_WORKER:
+    email_outbox.start()
 
 # =====================================================
-# LOAD MACHINE LEARNING MODELS
+# RESPONSE CACHE
 # =====================================================
-models = {}
-def load_models():
-    global models
-    for disease in ['diabetes', 'heart', 'liver', 'kidney']:
-        path = os.path.join(MODELS_DIR, f'{disease}_model.pkl')
-        if os.path.exists(path):
-            obj = joblib.load(path)
-            
-            if hasattr(obj, 'predict'):
-                models[disease] = {'model': obj, 'scaler': None, 'feature_columns': None}
-            elif isinstance(obj, dict):
-                 
-                models[disease] = {
-                    'model': obj.get('model') or obj.get('estimator') or obj.get('clf'),
-                    'scaler': obj.get('scaler'),
-                    'feature_columns': obj.get('feature_columns') or obj.get('features') or obj.get('columns')
-                }
-            else:
-                app.logger.warning(f"Unsupported model file format for {disease}")
-                continue
-            app.logger.info(f"✅ Loaded model: {disease}")
-        else:
-            app.logger.warning(f"⚠️ Model not found for: {disease}")
-
-load_models()
+# Serialized body of the doctor roster, dropped when the database reports a
+# write to the doctors table. Invalidation only reaches the worker process that
+# made the write, so other workers can serve the old roster for up to the TTL.
+# Per-user responses (profile, dashboard) are therefore not cached across
+# requests: they are rebuilt every time and only the ETag/304 saves bandwidth.
+doctors_cache = TTLCache('doctors', ttl=RESPONSE_CACHE_TTL, max_size=1)
+response_caches = [doctors_cache]
+
+def invalidate_response_caches(table, key):
+    if table == 'doctors':
+        doctors_cache.clear()
+
+db.add_invalidation_hook(invalidate_response_caches)
+
+def render_json(data):
+    body = app.json.dumps(data).encode('utf-8')
+    return body, etag_for(body)
+
+def etag_response(body, etag, private=False):
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    if private:
+        response.headers['Vary'] = 'Authorization'
+    return response.make_conditional(request)
+
+def conditional_json(data, private=False):
+    """JSON response with an ETag of the body; answers 304 on If-None-Match."""
+    return etag_response(*render_json(data), private=private)
+
+def cached_json(cache, key, build):
+    """Like conditional_json, with the rendered body kept in ``cache``."""
+    return etag_response(*cache.get_or_load(key, lambda: render_json(build())))
 
 # =====================================================
-# JWT HELPERS
+# LOAD MACHINE LEARNING MODELS
 # =====================================================
-def generate_token(user_id, username, role='patient', expires_hours=JWT_EXP_DELTA_HOURS):
-    payload = {
-        'user_id': user_id,
-        'username': username,
-        'role': role,
-        'exp': datetime.utcnow() + timedelta(hours=expires_hours),
-        'iat': datetime.utcnow()
-    }
-    token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
-    return token   
-
-def verify_token(token):
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return {'error': 'Token expired'}
-    except jwt.InvalidTokenError:
-        return {'error': 'Invalid token'}
-
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        auth = request.headers.get('Authorization', '')
-        if not auth:
-            return jsonify({'error': 'Authorization header missing'}), 401
-
-        parts = auth.split()
-        if len(parts) != 2 or parts[0].lower() != 'bearer':
-            return jsonify({'error': 'Invalid token format'}), 401
-
-        token = parts[1]
-        try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token'}), 401
-
-         
-        request.user_id = payload.get('user_id')
-        request.username = payload.get('username')
-        request.role = payload.get('role', 'patient')
-        request.doctor_id = payload.get('doctor_id')
-
-         
-        return f(*args, **kwargs)
-    return decorated
-
-
+# Loaded on first use and reloaded when a bundle file in MODELS_DIR changes
+models = ModelRegistry(MODELS_DIR, engine=MODEL_ENGINE, watch_interval=MODEL_WATCH_INTERVAL)
 
 # =====================================================
 # AUTHENTICATION ROUTES
 # =====================================================
+@app.errorhandler(HashingQueueFull)
+def hashing_busy(e):
+    response = jsonify({'success': False, 'error': 'Too many login attempts right now, please retry shortly'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+
 @app.route('/api/register', methods=['POST'])
 def register_patient():
-    try:
-        data = request.json or {}
-        for field in ['username', 'email', 'password', 'full_name']:
-            if field not in data:
-                return jsonify({'error': f'Missing field: {field}'}), 400
-
-        user_id = db.create_user(
-            username=data['username'],
-            email=data['email'],
-            password=data['password'],
-            full_name=data['full_name'],
-            phone=data.get('phone'),
-            gender=data.get('gender')
-        )
-        if not user_id:
-            return jsonify({'error': 'Username or email already exists'}), 400
-
-        return jsonify({'success': True, 'message': 'Registration successful'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    # No catch-all here: HashingQueueFull must reach hashing_busy for its 429
+    data = request.json or {}
+    for field in ['username', 'email', 'password', 'full_name']:
+        if field not in data:
+            return jsonify({'error': f'Missing field: {field}'}), 400
+
+    user_id = db.create_user(
+        username=data['username'],
+        email=data['email'],
+        password=data['password'],
+        full_name=data['full_name'],
+        phone=data.get('phone'),
+        gender=data.get('gender')
+    )
+    if not user_id:
+        return jsonify({'error': 'Username or email already exists'}), 400
+
+    return jsonify({'success': True, 'message': 'Registration successful'})
 
  
 @app.route('/api/login', methods=['POST'])
 @app.route('/api/login/patient', methods=['POST'])
 def login_patient():
-    try:
-        data = request.json or {}
-        user = db.verify_user(data.get('username'), data.get('password'))
-        if not user:
-            return jsonify({'error': 'Invalid credentials'}), 401
-        token = generate_token(user['id'], user['username'], 'patient')
-        return jsonify({'success': True, 'token': token, 'user': user})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    data = request.json or {}
+    user = db.verify_user(data.get('username'), data.get('password'))
+    if not user:
+        return jsonify({'error': 'Invalid credentials'}), 401
+    token = generate_token(user['id'], user['username'], 'patient')
+    return jsonify({'success': True, 'token': token, 'user': user})
 
 
 @app.route('/api/login/doctor', methods=['POST'])
@@ -165,13 +139,7 @@ def doctor_login():
     if not doctor:
         return jsonify({"success": False, "error": "Invalid credentials"}), 401
 
-    payload = {
-        "doctor_id": doctor['id'],
-        "username": doctor['username'],
-        "role": "doctor",
-        "exp": datetime.utcnow() + timedelta(hours=12)
-    }
-    token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    token = generate_token(None, doctor['username'], 'doctor', doctor_id=doctor['id'])
 
     return jsonify({"success": True, "token": token, "doctor": doctor})
 
@@ -184,28 +152,56 @@ def doctor_login():
 def get_profile():
     try:
         if request.role == 'doctor':
-            doctor = db.get_doctor_by_username(request.username)
-            return jsonify({'success': True, 'profile': doctor})
+            return conditional_json({
+                'success': True, 'profile': db.get_doctor_by_username(request.username)}, private=True)
         else:
-            patient = db.get_user_by_id(request.user_id)
-            return jsonify({'success': True, 'profile': patient})
+            return conditional_json({
+                'success': True, 'profile': db.get_user_by_id(request.user_id)}, private=True)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+MAX_PAGE_SIZE = 100
+RECENT_PREDICTIONS_LIMIT = 5
+UPCOMING_APPOINTMENTS_LIMIT = 5
+APPOINTMENT_SORT_KEYS = ('appointment_date', 'appointment_time', 'id')
+
+def page_args():
+    """Read ?limit=&cursor= (limit is None when the caller wants the full list)."""
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor') or None
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    if cursor and not limit:
+        limit = MAX_PAGE_SIZE
+    return limit, cursor
+
+
+def next_cursor(items, limit, *keys):
+    """Cursor for the page after ``items``, or None when this was the last page."""
+    if not limit or len(items) < limit:
+        return None
+    return encode_cursor([items[-1][k] for k in keys])
+
+
 @app.route('/api/history', methods=['GET'])
 @token_required
 def get_history():
     try:
+        limit, cursor = page_args()
         if request.role == 'patient':
-            preds = db.get_user_predictions(request.user_id)
-            return jsonify({'success': True, 'predictions': preds})
+            preds = db.get_user_predictions(request.user_id, limit=limit, cursor=cursor)
+            return jsonify({'success': True, 'predictions': preds,
+                            'next_cursor': next_cursor(preds, limit, 'prediction_date', 'id')})
 
         elif request.role == 'doctor':
-            appointments = db.get_doctor_appointments(doctor_id=request.user_id)
-            return jsonify({'success': True, 'appointments': appointments})
+            appointments = db.get_doctor_appointments(doctor_id=request.doctor_id, limit=limit, cursor=cursor)
+            return jsonify({'success': True, 'appointments': appointments,
+                            'next_cursor': next_cursor(appointments, limit, *APPOINTMENT_SORT_KEYS)})
 
         return jsonify({'error': 'Invalid role'}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
@@ -219,27 +215,11 @@ def get_history():
 def get_stats():
     try:
         if request.role == 'patient':
-             
-            predictions = db.get_user_predictions(request.user_id)
-
-            total_predictions = len(predictions)
-            healthy_results = sum(1 for p in predictions if p['prediction_result'] == 'Negative')
-            risk_detected = sum(1 for p in predictions if p['prediction_result'] == 'Positive')
-
-            
-            user_appointments = db.get_user_appointments(request.user_id)
-            total_appointments = len(user_appointments)
-
-            return jsonify({
-                'success': True,
-                'total_predictions': total_predictions,
-                'healthy_results': healthy_results,
-                'risk_detected': risk_detected,
-                'total_appointments': total_appointments
-            })
+            stats = db.get_user_stats(request.user_id)
+            return jsonify({'success': True, **stats})
 
         elif request.role == 'doctor':
-            stats = db.get_appointment_statistics(doctor_id=request.user_id)
+            stats = db.get_appointment_statistics(doctor_id=request.doctor_id)
             return jsonify({'success': True, 'stats': stats})
 
         else:
@@ -251,74 +231,33 @@ def get_stats():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/recent-predictions', methods=['GET'])
+@app.route('/api/dashboard', methods=['GET'])
 @token_required
-def get_recent_predictions():
+def get_dashboard():
+    """Everything the patient dashboard shows, in one request."""
     try:
         if request.role != 'patient':
             return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
-        preds = db.get_user_predictions(request.user_id) or []
-         
-        preds = sorted(preds, key=lambda x: x['prediction_date'], reverse=True)[:5]
-
-        return jsonify({'success': True, 'predictions': preds})
-
-    except Exception as e:
-        print("🔥 Error in /api/recent-predictions:", e)
-        import traceback; traceback.print_exc()
-        return jsonify({'success': False, 'error': str(e)}), 500
-# =====================================================
-# RECENT PREDICTIONS 
-# =====================================================
-@app.route('/api/stats', methods=['GET'],endpoint='stats')
-@token_required
-def get_stats():
-    try:
-        if request.role == 'patient':
-             
-            predictions = db.get_user_predictions(request.user_id)
-
-            total_predictions = len(predictions)
-            healthy_results = sum(1 for p in predictions if p['prediction_result'] == 'Negative')
-            risk_detected = sum(1 for p in predictions if p['prediction_result'] == 'Positive')
-
-             
-            user_appointments = db.get_user_appointments(request.user_id)
-            total_appointments = len(user_appointments)
-
-            return jsonify({
-                'success': True,
-                'total_predictions': total_predictions,
-                'healthy_results': healthy_results,
-                'risk_detected': risk_detected,
-                'total_appointments': total_appointments
-            })
-
-        elif request.role == 'doctor':
-            stats = db.get_appointment_statistics(doctor_id=request.user_id)
-            return jsonify({'success': True, 'stats': stats})
-
-        else:
-            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        return conditional_json({
+            'success': True,
+            **db.get_patient_dashboard(request.user_id, recent_limit=RECENT_PREDICTIONS_LIMIT,
+                                       upcoming_limit=UPCOMING_APPOINTMENTS_LIMIT)
+        }, private=True)
 
     except Exception as e:
-        print("🔥 Error in /api/stats:", e)
-        import traceback; traceback.print_exc()
+        app.logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/recent-predictions', methods=['GET'], endpoint='recent_predictions')
+@app.route('/api/recent-predictions', methods=['GET'])
 @token_required
 def get_recent_predictions():
     try:
         if request.role != 'patient':
             return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
-        preds = db.get_user_predictions(request.user_id) or []
-         
-        preds = sorted(preds, key=lambda x: x['prediction_date'], reverse=True)[:5]
-
+        preds = db.get_user_predictions(request.user_id, limit=RECENT_PREDICTIONS_LIMIT)
         return jsonify({'success': True, 'predictions': preds})
 
     except Exception as e:
@@ -326,31 +265,26 @@ def get_recent_predictions():
         import traceback; traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-
-
-
- 
 @app.route('/api/appointments/<int:appointment_id>', methods=['PUT'])
 @token_required
-def update_appointment_status(current_user, appointment_id):
+def update_appointment_status(appointment_id):
     try:
-        if current_user['role'] != 'doctor':
+        if request.role != 'doctor':
             return jsonify({"success": False, "error": "Unauthorized"}), 403
 
-        data = request.get_json()
+        data = request.get_json() or {}
         status = data.get('status')
         reason = data.get('reason', None)
 
          
         apt_details = db.update_appointment_status(
-            appointment_id, status, current_user['doctor_id'], reason
+            appointment_id, status, request.doctor_id, reason
         )
 
         if not apt_details:
             return jsonify({"success": False, "error": "Appointment not found"}), 404
 
          
-        email_service = EmailService()
         patient_email, patient_name, date, time, doctor_name, specialization = apt_details
 
         if status == 'approved':
@@ -364,6 +298,8 @@ def update_appointment_status(current_user, appointment_id):
 
         return jsonify({"success": True, "message": f"Appointment {status} successfully"})
 
+    except SlotTakenError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
     except Exception as e:
         print("Error updating appointment:", e)
         return jsonify({"success": False, "error": str(e)}), 500
@@ -371,78 +307,154 @@ def update_appointment_status(current_user, appointment_id):
 # =====================================================
 # PREDICTION ROUTES 
 # =====================================================
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 5000))
+
+def read_batch_records():
+    """Read batch input from a JSON array / {"records": [...]} body or a CSV upload."""
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+    elif request.mimetype in ('text/csv', 'application/csv'):
+        text = request.get_data(as_text=True)
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('records')
+        if not isinstance(data, list):
+            raise ValueError('Expected a JSON array of records or {"records": [...]}')
+        return data
+
+    reader = csv.DictReader(io.StringIO(text))
+    return [{k.strip(): v for k, v in row.items() if k and v not in (None, '')} for row in reader]
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def prediction_response(disease, prediction_id, prediction, confidence):
+    return {
+        'success': True,
+        'prediction_id': prediction_id,
+        'result': 'Positive' if prediction == 1 else 'Negative',
+        'confidence': round(confidence, 3),
+        'recommendations': get_recommendations(disease, prediction)
+    }
+
+def replay_prediction(disease, stored, request_hash):
+    """Response for a retried request whose Idempotency-Key is already recorded."""
+    if stored['request_hash'] != request_hash:
+        return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+    prediction = 1 if stored['prediction_result'] == 'Positive' else 0
+    response = jsonify(prediction_response(disease, stored['id'], prediction, stored['confidence']))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @app.route('/api/predict/<disease>', methods=['POST'])
 @token_required
 def predict_disease(disease):
     try:
         disease = disease.lower()
-        if disease not in models:
+        model = models.get(disease)
+        if model is None:
             return jsonify({'error': f'{disease} model not available'}), 400
 
-        model_info = models[disease]
-        model = model_info.get('model')
-        scaler = model_info.get('scaler')
-        features = model_info.get('feature_columns')
-        data = request.json or {}
+        # Clients may send Idempotency-Key so a retried submission returns the
+        # original prediction instead of recording a new one
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is not None:
+            idempotency_key = idempotency_key.strip()
+            if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return jsonify({'error': f'Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters'}), 400
 
-         
-        normalized = {}
-        for key, val in data.items():
-            if isinstance(val, str):
-                v = val.strip().lower()
-                if v in ['male', 'm']: normalized[key] = 1
-                elif v in ['female', 'f']: normalized[key] = 0
-                elif v in ['yes', 'y', 'true', 'positive']: normalized[key] = 1
-                elif v in ['no', 'n', 'false', 'negative']: normalized[key] = 0
-                else:
-                    try: normalized[key] = float(v)
-                    except: normalized[key] = v
-            else:
-                normalized[key] = val
-
-        if not features:
-            features = sorted(normalized.keys())
-
-        missing = [f for f in features if f not in normalized]
-        if missing:
-            return jsonify({'error': f'Missing input fields: {", ".join(missing)}'}), 400
+        data = request.json or {}
 
-         
         try:
-            X = [[float(normalized[f]) for f in features]]
-        except Exception as ve:
-            return jsonify({'error': f'Invalid numeric input: {ve}'}), 400
+            X = model.encode_record(data)
+        except InputError as e:
+            return jsonify({'error': str(e), 'fields': e.fields}), 400
 
-        if scaler:
-            try:
-                X = scaler.transform(X)
-            except Exception as e:
-                app.logger.warning(f"Scaler transform failed for {disease}: {e}")
+        request_hash = None
+        if idempotency_key:
+            request_hash = f"{disease}:{model.row_key(X).hex()}"
+            stored = db.get_idempotent_prediction(request.user_id, idempotency_key)
+            if stored is not None:
+                return replay_prediction(disease, stored, request_hash)
 
-        prediction = int(model.predict(X)[0])
-        confidence = float(max(model.predict_proba(X)[0])) if hasattr(model, 'predict_proba') else 1.0
-        result = 'Positive' if prediction == 1 else 'Negative'
+        prediction, confidence = model.predict_one(X)
 
         prediction_id = db.save_prediction(
             user_id=request.user_id,
             disease_type=disease.capitalize(),
-            prediction_result=result,
+            prediction_result='Positive' if prediction == 1 else 'Negative',
             confidence=confidence,
-            input_data=data
+            # The encoded feature row, stored packed against the model's columns
+            input_data=dict(zip(model.feature_columns, X[0].tolist())),
+            idempotency_key=idempotency_key,
+            request_hash=request_hash
         )
+        if prediction_id is None:
+            # A concurrent retry with the same key was recorded first
+            stored = db.get_idempotent_prediction(request.user_id, idempotency_key)
+            return replay_prediction(disease, stored, request_hash)
+
+        return jsonify(prediction_response(disease, prediction_id, prediction, confidence))
+    except Exception as e:
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+
+@app.route('/api/predict/<disease>/batch', methods=['POST'])
+@token_required
+def predict_disease_batch(disease):
+    try:
+        disease = disease.lower()
+        model = models.get(disease)
+        if model is None:
+            return jsonify({'error': f'{disease} model not available'}), 400
+
+        try:
+            records = read_batch_records()
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return jsonify({'error': f'Invalid batch input: {e}'}), 400
+
+        if not records:
+            return jsonify({'error': 'No records supplied'}), 400
+        if len(records) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch too large: {len(records)} records (max {MAX_BATCH_SIZE})'}), 413
+
+        # One pass over the whole batch; invalid rows come back with per-field errors
+        X, row_index, errors = model.schema.to_array(records)
+
+        results = []
+        if row_index:
+            labels, confidences = model.predict(X)
+
+            disease_type = disease.capitalize()
+            outcomes = ['Positive' if label == 1 else 'Negative' for label in labels]
+            columns = model.feature_columns
+            prediction_ids = db.save_predictions([
+                (request.user_id, disease_type, outcome, float(conf), dict(zip(columns, row)))
+                for row, outcome, conf in zip(X.tolist(), outcomes, confidences)
+            ])
+
+            for i, pid, outcome, conf in zip(row_index, prediction_ids, outcomes, confidences):
+                results.append({
+                    'row': i,
+                    'prediction_id': pid,
+                    'result': outcome,
+                    'confidence': round(float(conf), 3)
+                })
 
         return jsonify({
             'success': True,
-            'prediction_id': prediction_id,
-            'result': result,
-            'confidence': round(confidence, 3),
-            'recommendations': get_recommendations(disease, prediction)
+            'total': len(records),
+            'scored': len(results),
+            'failed': len(errors),
+            'results': results,
+            'errors': errors
         })
     except Exception as e:
         app.logger.error(traceback.format_exc())
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-0
 # =====================================================
 # RECOMMENDATION LOGIC
 # =====================================================
@@ -518,16 +530,45 @@ def book_appointment():
 
     try:
         data = request.json or {}
+        doctor_id = data.get('doctor_id')
+        if doctor_id is not None:
+            # Booking by id: name and specialization come from the doctors table and
+            # the time must be a free slot of the doctor's schedule
+            doctor = db.get_doctor(doctor_id) if type(doctor_id) is int else None
+            if doctor is None:
+                return jsonify({'error': 'Unknown doctor_id'}), 400
+            data = {**data, 'doctor_name': doctor['full_name'], 'specialization': doctor['specialization']}
+
         required = ['doctor_name', 'specialization', 'appointment_date', 'appointment_time']
         for f in required:
             if f not in data:
                 return jsonify({'error': f'Missing field: {f}'}), 400
-         
-        existing = db.check_slot(
-            doctor_name=data['doctor_name'],
-            appointment_date=data['appointment_date'],
-            appointment_time=data['appointment_time']
-            )
+
+        if doctor_id is not None:
+            try:
+                day = date.fromisoformat(str(data['appointment_date']))
+            except ValueError:
+                return jsonify({'error': 'appointment_date must be YYYY-MM-DD'}), 400
+            now = datetime.now()
+            # Past slots are never in `free`; say so rather than reporting them as booked
+            if (day, str(data['appointment_time'])) <= (now.date(), now.strftime('%H:%M')):
+                return jsonify({
+                    'success': False,
+                    'error': 'This time is in the past. Please choose a future slot.'
+                    }), 400
+            free = db.get_doctor_availability(doctor_id, day, day, now=now)[0]['slots']
+            if data['appointment_time'] not in free and not db.is_scheduled_slot(doctor_id, day, data['appointment_time']):
+                return jsonify({
+                    'success': False,
+                    'error': "This time is not one of the doctor's slots on that day."
+                    }), 400
+            existing = data['appointment_time'] not in free
+        else:
+            existing = db.check_slot(
+                doctor_name=data['doctor_name'],
+                appointment_date=data['appointment_date'],
+                appointment_time=data['appointment_time']
+                )
 
         if existing:
             return jsonify({
@@ -543,8 +584,14 @@ def book_appointment():
             specialization=data['specialization'],
             appointment_date=data['appointment_date'],
             appointment_time=data['appointment_time'],
-            notes=data.get('notes')
+            notes=data.get('notes'),
+            doctor_id=doctor_id
         )
+        if apt_id is None:
+            return jsonify({
+                'success': False,
+                'error': 'This time slot is already booked. Please choose another time.'
+                }), 400
 
          
         if hasattr(email_service, 'send_appointment_booking_notification'):
@@ -567,14 +614,18 @@ def book_appointment():
 @token_required
 def get_appointments():
     try:
+        limit, cursor = page_args()
         if request.role == 'patient':
-            appointments = db.get_user_appointments(request.user_id)
+            appointments = db.get_user_appointments(request.user_id, limit=limit, cursor=cursor)
         elif request.role == 'doctor':
-            appointments = db.get_doctor_appointments(request.doctor_id)
+            appointments = db.get_doctor_appointments(request.doctor_id, limit=limit, cursor=cursor)
         else:
             return jsonify({'error': 'Invalid role'}), 403
 
-        return jsonify({'success': True, 'appointments': appointments})
+        return jsonify({'success': True, 'appointments': appointments,
+                        'next_cursor': next_cursor(appointments, limit, *APPOINTMENT_SORT_KEYS)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
@@ -586,8 +637,13 @@ def get_appointments():
 def get_doctor_appointments():
     if request.role != 'doctor':
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
-    appointments = db.get_doctor_appointments(request.doctor_id)
-    return jsonify({'success': True, 'appointments': appointments})
+    try:
+        limit, cursor = page_args()
+        appointments = db.get_doctor_appointments(request.doctor_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'appointments': appointments,
+                    'next_cursor': next_cursor(appointments, limit, *APPOINTMENT_SORT_KEYS)})
 
 
 # =====================================================
@@ -619,6 +675,8 @@ def approve_appointment(appointment_id):
 
         return jsonify({'success': True, 'message': 'Appointment approved successfully'})
 
+    except SlotTakenError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         app.logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -649,6 +707,8 @@ def reject_appointment(appointment_id):
 
         return jsonify({'success': True, 'message': 'Appointment rejected successfully'})
 
+    except SlotTakenError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         app.logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -658,12 +718,55 @@ def reject_appointment(appointment_id):
 # =====================================================
 @app.route('/api/doctors', methods=['GET'])
 def get_doctors():
-    doctors = db.get_all_doctors()
-    return jsonify({'success': True, 'doctors': doctors})
+    return cached_json(doctors_cache, 'all', lambda: {'success': True, 'doctors': db.get_all_doctors()})
+
+AVAILABILITY_DEFAULT_DAYS = 7
+AVAILABILITY_MAX_DAYS = 31
+
+@app.route('/api/doctors/<int:doctor_id>/availability', methods=['GET'])
+def get_doctor_availability(doctor_id):
+    """Free slots per day; ``from``/``to`` are inclusive YYYY-MM-DD dates (default: the next week)."""
+    try:
+        date_from = date.fromisoformat(request.args['from']) if 'from' in request.args else date.today()
+        date_to = (date.fromisoformat(request.args['to']) if 'to' in request.args
+                   else date_from + timedelta(days=AVAILABILITY_DEFAULT_DAYS - 1))
+    except ValueError:
+        return jsonify({'error': 'from and to must be YYYY-MM-DD dates'}), 400
+    if date_to < date_from:
+        return jsonify({'error': 'to must not be before from'}), 400
+    if (date_to - date_from).days >= AVAILABILITY_MAX_DAYS:
+        return jsonify({'error': f'At most {AVAILABILITY_MAX_DAYS} days per request'}), 400
+
+    doctor = db.get_doctor(doctor_id)
+    if doctor is None:
+        return jsonify({'error': 'Doctor not found'}), 404
+    return jsonify({
+        'success': True,
+        'doctor': doctor,
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'days': db.get_doctor_availability(doctor_id, date_from, date_to)
+    })
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'healthy', 'models_loaded': list(models.keys()), 'time': datetime.utcnow().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'models_available': models.available(),
+        'models': models.status(),
+        'time': datetime.utcnow().isoformat()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        'db_pool': db.pool_stats(),
+        'email_outbox': email_outbox.stats(),
+        'password_hashing': db.passwords.stats(),
+        'token_cache': token_cache.stats(),
+        'response_cache': {cache.name: cache.stats() for cache in response_caches},
+        'prediction_cache': models.cache_stats()
+    })
 
  
  
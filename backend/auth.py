@@ -1,51 +1,159 @@
 # backend/auth.py
-import jwt
+"""JWT issuing and verification shared by every route.
+
+Tokens are signed with JWT_SECRET and carry its key id (``kid``) in the
+header. Secrets listed in JWT_PREVIOUS_SECRETS are still accepted for
+verification, so the signing secret can be rotated without logging everyone
+out: deploy the new secret with the old one listed as previous, and drop the
+old one once its tokens have expired.
+
+Decoded claims are kept in a small LRU keyed by the SHA-256 of the whole token
+(signature included) until the token's own ``exp``, so repeat calls with the
+same token skip the HMAC check and claim validation.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from functools import wraps
+
+import jwt
 from flask import request, jsonify
 
-SECRET_KEY = "your-secret-key-change-in-production-2024"
+JWT_SECRET = os.environ.get('JWT_SECRET', 'replace-this-secret-with-env-var')
+JWT_PREVIOUS_SECRETS = [s for s in os.environ.get('JWT_PREVIOUS_SECRETS', '').split(',') if s]
+JWT_ALGORITHM = 'HS256'
+JWT_EXP_DELTA_HOURS = int(os.environ.get('JWT_EXP_DELTA_HOURS', 24))
+DOCTOR_TOKEN_HOURS = int(os.environ.get('DOCTOR_TOKEN_HOURS', 12))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 4096))
+
+
+def key_id(secret):
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()[:12]
+
+
+SIGNING_KID = key_id(JWT_SECRET)
+VERIFY_KEYS = {key_id(s): s for s in [JWT_SECRET] + JWT_PREVIOUS_SECRETS}
+
+
+class TokenCache:
+    """Bounded LRU of decoded claims, each entry valid until the token's exp."""
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()     # sha256(token) -> (payload, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, digest, payload):
+        exp = payload.get('exp')
+        if not exp or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = (payload, exp)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
 
-def generate_token(user_id, username, role='patient'):
-    """Generate JWT token"""
+token_cache = TokenCache()
+
+
+def generate_token(user_id, username, role='patient', expires_hours=None, **claims):
+    """Generate a signed JWT. Doctors get a shorter default lifetime."""
+    if expires_hours is None:
+        expires_hours = DOCTOR_TOKEN_HOURS if role == 'doctor' else JWT_EXP_DELTA_HOURS
+    now = datetime.utcnow()
     payload = {
-        'user_id': user_id,
         'username': username,
         'role': role,
-        'exp': datetime.utcnow() + timedelta(days=7)
+        'exp': now + timedelta(hours=expires_hours),
+        'iat': now,
+        **claims
     }
-    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+    if user_id is not None:
+        payload['user_id'] = user_id
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM, headers={'kid': SIGNING_KID})
+
+
+def decode_token(token):
+    """Return the token's claims; raises jwt.ExpiredSignatureError / jwt.InvalidTokenError."""
+    digest = hashlib.sha256(token.encode('utf-8')).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+
+    kid = jwt.get_unverified_header(token).get('kid')
+    if kid is not None:
+        # The header is not verified yet: anything but a string is rejected before the lookup
+        if not isinstance(kid, str) or kid not in VERIFY_KEYS:
+            raise jwt.InvalidTokenError('Unknown signing key')
+        secrets = [VERIFY_KEYS[kid]]
+    else:
+        # Tokens issued before key ids were added
+        secrets = list(VERIFY_KEYS.values())
+
+    for i, secret in enumerate(secrets):
+        try:
+            payload = jwt.decode(token, secret, algorithms=[JWT_ALGORITHM])
+            break
+        except jwt.InvalidSignatureError:
+            if i == len(secrets) - 1:
+                raise
+    token_cache.put(digest, payload)
+    return payload
+
 
 def verify_token(token):
-    """Verify JWT token"""
+    """Verify JWT token; returns the claims or None."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None
+        return decode_token(token)
     except jwt.InvalidTokenError:
         return None
 
+
 def token_required(f):
     """Decorator to protect routes"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            return jsonify({'error': 'Token is missing'}), 401
-        
-        if token.startswith('Bearer '):
-            token = token[7:]
-        
-        payload = verify_token(token)
-        if not payload:
-            return jsonify({'error': 'Token is invalid or expired'}), 401
-        
-        request.user_id = payload['user_id']
-        request.username = payload['username']
+        auth = request.headers.get('Authorization', '')
+        if not auth:
+            return jsonify({'error': 'Authorization header missing'}), 401
+
+        parts = auth.split()
+        if len(parts) != 2 or parts[0].lower() != 'bearer':
+            return jsonify({'error': 'Invalid token format'}), 401
+
+        try:
+            payload = decode_token(parts[1])
+        except jwt.ExpiredSignatureError:
+            return jsonify({'error': 'Token expired'}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({'error': 'Invalid token'}), 401
+
+        request.user_id = payload.get('user_id')
+        request.username = payload.get('username')
         request.role = payload.get('role', 'patient')
-        
+        request.doctor_id = payload.get('doctor_id')
+
         return f(*args, **kwargs)
-    
-    return decorated
\ No newline at end of file
+    return decorated
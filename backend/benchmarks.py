@@ -0,0 +1,216 @@
+# backend/benchmarks.py
+"""Micro-benchmarks for the request path.
+
+Run from the backend/ directory:  python benchmarks.py [name ...]
+"""
+import os
+import sys
+import time
+import statistics
+import warnings
+
+from inference import DISEASES, load_model_bundle
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+DATASETS_DIR = os.path.join(BASE_DIR, 'datasets')
+
+
+def _timeit(fn, repeat):
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def _load_models():
+    models = {}
+    for disease in DISEASES:
+        path = os.path.join(MODELS_DIR, f'{disease}_model.pkl')
+        if os.path.exists(path):
+            models[disease] = load_model_bundle(disease, path)
+    return models
+
+
+def _sample_row(model):
+    return [[1.0] * len(model.feature_columns)]
+
+
+def bench_single_pass(repeat=200):
+    """Per-request latency: predict() + predict_proba() vs one predict_proba pass."""
+    print("\n⏱  Single-row inference (median ms/request)")
+    print(f"{'disease':<10}{'before':>10}{'after':>10}{'speedup':>10}")
+    for disease, model in _load_models().items():
+        row = _sample_row(model)
+
+        def before():
+            int(model.model.predict(row)[0])
+            float(max(model.model.predict_proba(row)[0]))
+
+        def after():
+            model.predict(row)
+
+        t_before, t_after = _timeit(before, repeat), _timeit(after, repeat)
+        print(f"{disease:<10}{t_before:>10.3f}{t_after:>10.3f}{t_before / t_after:>9.2f}x")
+
+
+def bench_engines(repeat=200, batch_rows=1000):
+    """sklearn vs compiled (flattened NumPy) tree engine, single row and batch."""
+    print(f"\n⏱  Inference engine (median ms; batch = {batch_rows} rows)")
+    print(f"{'disease':<10}{'sk 1 row':>10}{'np 1 row':>10}{'sk batch':>10}{'np batch':>10}")
+    for disease, model in _load_models().items():
+        compiled = load_model_bundle(disease, os.path.join(MODELS_DIR, f'{disease}_model.pkl'),
+                                     engine='compiled')
+        row = _sample_row(model)
+        batch = row * batch_rows
+        print(f"{disease:<10}"
+              f"{_timeit(lambda: model.predict(row), repeat):>10.3f}"
+              f"{_timeit(lambda: compiled.predict(row), repeat):>10.3f}"
+              f"{_timeit(lambda: model.predict(batch), repeat // 10):>10.3f}"
+              f"{_timeit(lambda: compiled.predict(batch), repeat // 10):>10.3f}")
+
+
+def bench_email_templates(repeat=2000):
+    """Email rendering: str.format on the full source per send vs the compiled registry."""
+    import html
+    from email_templates import TemplateRegistry, TEMPLATES, FRAME
+
+    registry = TemplateRegistry('MediCare AI Hospital', '+1 (555) 123-4567', '123 Health Street, Medical City')
+    values = {'patient_name': 'Jane <Doe>', 'doctor_name': 'Dr. Sarah Johnson', 'appointment_date': '2030-01-07',
+              'appointment_time': '10:00', 'specialization': 'Diabetologist'}
+    _, title, color, body = TEMPLATES['appointment_confirmed']
+    source = FRAME.replace('[[content]]', body)
+
+    def before():
+        escaped = {k: html.escape(v) for k, v in values.items()}
+        page = (source.replace('[[header_color]]', color).replace('[[title]]', title)
+                .replace('[[hospital_name]]', registry.hospital_name)
+                .replace('[[hospital_phone]]', '+1 (555) 123-4567')
+                .replace('[[hospital_address]]', '123 Health Street, Medical City'))
+        page.format(**escaped)
+
+    def after():
+        registry.render('appointment_confirmed', **values)
+
+    t_before, t_after = _timeit(before, repeat), _timeit(after, repeat)
+    print("\n⏱  Email template render (html + text for 'after'; median ms/email)")
+    print(f"{'before':>10}{'after':>10}{'emails/s':>12}")
+    print(f"{t_before:>10.4f}{t_after:>10.4f}{1000 / t_after:>12.0f}")
+
+
+def _legacy_normalize(data):
+    """The pre-schema per-field normalization, kept here as the benchmark baseline."""
+    normalized = {}
+    for key, val in data.items():
+        if isinstance(val, str):
+            v = val.strip().lower()
+            if v in ['male', 'm']: normalized[key] = 1
+            elif v in ['female', 'f']: normalized[key] = 0
+            elif v in ['yes', 'y', 'true', 'positive']: normalized[key] = 1
+            elif v in ['no', 'n', 'false', 'negative']: normalized[key] = 0
+            else:
+                try: normalized[key] = float(v)
+                except ValueError: normalized[key] = v
+        else:
+            normalized[key] = val
+    return normalized
+
+
+def bench_input_schema(repeat=20, batch_rows=1000):
+    """Record -> feature matrix: per-record normalize + float loop vs the compiled schema."""
+    print(f"\n⏱  Input conversion (median ms; batch = {batch_rows} records, string-valued fields)")
+    print(f"{'disease':<10}{'loop 1':>10}{'schema 1':>10}{'loop batch':>12}{'schema batch':>14}")
+    for disease, model in _load_models().items():
+        features = model.feature_columns
+        # '1' is a valid value for the encoded (categorical) columns too
+        record = {f: '1' for f in features}
+        records = [dict(record) for _ in range(batch_rows)]
+
+        def loop(batch):
+            rows = []
+            for data in batch:
+                normalized = _legacy_normalize(data)
+                rows.append([float(normalized[f]) for f in features])
+            return rows
+
+        print(f"{disease:<10}"
+              f"{_timeit(lambda: loop([record]), repeat * 10):>10.4f}"
+              f"{_timeit(lambda: model.schema.to_array([record]), repeat * 10):>10.4f}"
+              f"{_timeit(lambda: loop(records), repeat):>12.3f}"
+              f"{_timeit(lambda: model.schema.to_array(records), repeat):>14.3f}")
+
+
+def bench_input_storage(rows=1_000_000, batch=10_000):
+    """predictions.input_data as str(dict) vs packed float32 on a synthetic table."""
+    import tempfile
+    from itertools import cycle, islice
+    from database import Database, _compact_input_data
+    from tree_engine import _dataset_matrix
+
+    samples = []
+    for disease, model in _load_models().items():
+        X = _dataset_matrix(disease, model.feature_columns, DATASETS_DIR)
+        samples += [(disease.capitalize(), dict(zip(model.feature_columns, row))) for row in X.tolist()]
+    data = [(i % 1000 + 1, d, 'Positive' if i % 3 else 'Negative', 0.9, record)
+            for i, (d, record) in enumerate(islice(cycle(samples), rows))]
+
+    def file_size(db):
+        with db.connection() as conn:
+            conn.execute('VACUUM')
+            return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = Database(os.path.join(tmp, 'legacy.db'))
+        start = time.perf_counter()
+        for i in range(0, rows, batch):
+            with legacy.connection() as conn:
+                conn.executemany('''
+                    INSERT INTO predictions (user_id, disease_type, prediction_result, confidence, input_data)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [(u, d, r, c, str(x)) for u, d, r, c, x in data[i:i + batch]])
+                conn.commit()
+        t_legacy = time.perf_counter() - start
+        size_legacy = file_size(legacy)
+
+        compact = Database(os.path.join(tmp, 'compact.db'))
+        start = time.perf_counter()
+        for i in range(0, rows, batch):
+            compact.save_predictions(data[i:i + batch])
+        t_compact = time.perf_counter() - start
+        size_compact = file_size(compact)
+
+        # What migration 9 does to an existing table of repr rows
+        start = time.perf_counter()
+        with legacy.connection() as conn:
+            _compact_input_data(conn.cursor())
+            conn.commit()
+        t_migrate = time.perf_counter() - start
+        size_migrated = file_size(legacy)
+
+    print(f"\n⏱  predictions.input_data storage ({rows:,} rows, batches of {batch:,})")
+    print(f"{'':<18}{'insert s':>10}{'rows/s':>10}{'db MiB':>10}")
+    print(f"{'str(dict)':<18}{t_legacy:>10.1f}{rows / t_legacy:>10.0f}{size_legacy / 2**20:>10.1f}")
+    print(f"{'packed float32':<18}{t_compact:>10.1f}{rows / t_compact:>10.0f}{size_compact / 2**20:>10.1f}")
+    print(f"{'migrated repr':<18}{t_migrate:>10.1f}{rows / t_migrate:>10.0f}{size_migrated / 2**20:>10.1f}")
+
+
+BENCHMARKS = {
+    'single_pass': bench_single_pass,
+    'engines': bench_engines,
+    'email_templates': bench_email_templates,
+    'input_schema': bench_input_schema,
+    'input_storage': bench_input_storage,
+}
+
+
+def main(names):
+    warnings.filterwarnings('ignore')
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
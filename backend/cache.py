@@ -0,0 +1,98 @@
+# backend/cache.py
+"""In-process TTL/LRU cache for read-mostly API responses.
+
+Entries expire after ``ttl`` seconds and are also dropped explicitly when
+``Database`` reports a write to the table they were built from, so within one
+process readers see changes immediately; other worker processes converge
+within ``ttl``.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, name, ttl=60.0, max_size=1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()     # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        # Bumped by invalidate()/clear() so a load that straddles one is not stored
+        self._generations = {}            # key -> invalidation count
+        self._epoch = 0                   # clear() count
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        # Caller holds self._lock
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value or call ``loader()`` and cache its result.
+
+        If ``key`` is invalidated (or the cache cleared) while the loader runs,
+        the result is returned to this caller but not stored, since it may have
+        been built from data read before the write.
+        """
+        value = self.get(key)
+        if value is None:
+            with self._lock:
+                version = (self._epoch, self._generations.get(key, 0))
+            value = loader()
+            if value is not None:
+                with self._lock:
+                    if version == (self._epoch, self._generations.get(key, 0)):
+                        self._store(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+
+def etag_for(body):
+    """Strong (unquoted) ETag value for a serialized response body."""
+    return hashlib.sha1(body).hexdigest()
@@ -1,180 +1,792 @@
+import os
+import ast
+import base64
+import json
+import queue
 import sqlite3
-from datetime import datetime
-import bcrypt
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+from password_hasher import PasswordHasher
+
+
+class SlotTakenError(Exception):
+    """An appointment cannot become active because another booking holds its slot."""
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+
+    Connections are opened lazily up to ``max_size`` and configured once for WAL
+    journaling, ``synchronous=NORMAL``, a busy timeout and a larger page cache.
+    Callers that find every connection checked out wait up to ``timeout`` seconds.
+    """
+
+    def __init__(self, db_name, max_size=8, timeout=30.0, busy_timeout_ms=5000, cache_size_kib=16384):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kib = cache_size_kib
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # SQLite handles must not cross fork(); a new process starts a fresh pool.
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._open = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute(f'PRAGMA cache_size={-int(self.cache_size_kib)}')
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._checkouts += 1
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                create = self._open < self.max_size
+                if create:
+                    self._open += 1
+                else:
+                    self._waits += 1
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise sqlite3.OperationalError(f'Connection pool exhausted ({self.max_size} connections in use)')
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken handle: drop it so the next checkout opens a fresh one.
+            with self._lock:
+                self._open -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                'max_size': self.max_size,
+                'open_connections': self._open,
+                'idle_connections': idle,
+                'in_use': self._open - idle,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'total_wait_ms': round(self._wait_time * 1000, 3),
+                'max_wait_ms': round(self._max_wait * 1000, 3),
+            }
+
+
+# ---------------- SCHEMA MIGRATIONS ----------------
+# Applied in order on startup; PRAGMA user_version records the last one applied.
+# Each step is a list of SQL statements or a callable taking a cursor.
+
+def _add_appointment_reason(cur):
+    # update_appointment_status writes a reason that the original schema never had
+    columns = [row[1] for row in cur.execute('PRAGMA table_info(appointments)')]
+    if 'reason' not in columns:
+        cur.execute('ALTER TABLE appointments ADD COLUMN reason TEXT')
+
+
+def _unique_active_slots(cur):
+    # Bookings that raced past check_slot before this constraint existed: keep the
+    # oldest active booking per slot and reject the rest.
+    cur.execute("""
+        UPDATE appointments
+        SET status = 'rejected', reason = 'Duplicate booking for an already reserved slot'
+        WHERE status IN ('pending', 'approved')
+        AND id NOT IN (
+            SELECT MIN(id) FROM appointments
+            WHERE status IN ('pending', 'approved')
+            GROUP BY doctor_name, appointment_date, appointment_time
+        )
+    """)
+    if cur.rowcount:
+        print(f"⚠️ Rejected {cur.rowcount} duplicate active bookings before adding slot constraint")
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_active_slot
+        ON appointments (doctor_name, appointment_date, appointment_time)
+        WHERE status IN ('pending', 'approved')
+    """)
+
+
+# Dashboard counts kept in step with their source rows by triggers, so every write
+# (including bulk inserts and migrations) updates them in its own transaction.
+# doctor_counters files appointments without a doctor on record under doctor_id 0.
+COUNTER_TABLES = {
+    'user_counters': ('user_id', ['predictions', 'healthy_predictions', 'risk_predictions', 'appointments',
+                                  'pending_appointments', 'approved_appointments', 'rejected_appointments']),
+    'doctor_counters': ('doctor_id', ['appointments', 'pending_appointments', 'approved_appointments',
+                                      'rejected_appointments']),
+}
+
+# The same counts recomputed from the source tables, in COUNTER_TABLES column order
+COUNTER_SOURCES = {
+    'user_counters': '''
+        SELECT user_id, SUM(p), SUM(h), SUM(r), SUM(a), SUM(pa), SUM(ap), SUM(re) FROM (
+            SELECT user_id, 1 AS p, prediction_result = 'Negative' AS h, prediction_result = 'Positive' AS r,
+                   0 AS a, 0 AS pa, 0 AS ap, 0 AS re
+            FROM predictions
+            UNION ALL
+            SELECT user_id, 0, 0, 0, 1, status = 'pending', status = 'approved', status = 'rejected'
+            FROM appointments
+        ) GROUP BY user_id
+    ''',
+    'doctor_counters': '''
+        SELECT COALESCE(doctor_id, 0), COUNT(*), SUM(status = 'pending'), SUM(status = 'approved'),
+               SUM(status = 'rejected')
+        FROM appointments GROUP BY COALESCE(doctor_id, 0)
+    ''',
+}
+
+
+def _bump_counters(table, key, deltas):
+    """Trigger statement adding ``{column: SQL expression}`` to a counters row."""
+    key_column = COUNTER_TABLES[table][0]
+    return (f"INSERT INTO {table} ({key_column}, {', '.join(deltas)}) VALUES ({key}, {', '.join(deltas.values())}) "
+            f"ON CONFLICT ({key_column}) DO UPDATE SET "
+            + ', '.join(f'{c} = {c} + excluded.{c}' for c in deltas) + ';')
+
+
+def _prediction_deltas(row, sign):
+    return [_bump_counters('user_counters', f'{row}.user_id', {
+        'predictions': sign,
+        'healthy_predictions': f"{sign} * ({row}.prediction_result = 'Negative')",
+        'risk_predictions': f"{sign} * ({row}.prediction_result = 'Positive')",
+    })]
+
+
+def _appointment_deltas(row, sign):
+    deltas = {'appointments': sign}
+    for status in ('pending', 'approved', 'rejected'):
+        deltas[f'{status}_appointments'] = f"{sign} * ({row}.status = '{status}')"
+    return [_bump_counters('user_counters', f'{row}.user_id', deltas),
+            _bump_counters('doctor_counters', f'COALESCE({row}.doctor_id, 0)', deltas)]
+
+
+def _rebuild_counters(cur):
+    for table, (key_column, columns) in COUNTER_TABLES.items():
+        cur.execute(f'DELETE FROM {table}')
+        cur.execute(f"INSERT INTO {table} ({key_column}, {', '.join(columns)}) {COUNTER_SOURCES[table]}")
+
+
+def _add_counters(cur):
+    for table, (key_column, columns) in COUNTER_TABLES.items():
+        cur.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+            {key_column} INTEGER PRIMARY KEY,
+            {', '.join(f'{c} INTEGER NOT NULL DEFAULT 0' for c in columns)}
+        )''')
+    triggers = {
+        'predictions_counters_insert': ('AFTER INSERT ON predictions', _prediction_deltas('NEW', '1')),
+        'predictions_counters_delete': ('AFTER DELETE ON predictions', _prediction_deltas('OLD', '-1')),
+        'predictions_counters_update': ('AFTER UPDATE OF user_id, prediction_result ON predictions',
+                                        _prediction_deltas('OLD', '-1') + _prediction_deltas('NEW', '1')),
+        'appointments_counters_insert': ('AFTER INSERT ON appointments', _appointment_deltas('NEW', '1')),
+        'appointments_counters_delete': ('AFTER DELETE ON appointments', _appointment_deltas('OLD', '-1')),
+        'appointments_counters_update': ('AFTER UPDATE OF user_id, doctor_id, status ON appointments',
+                                         _appointment_deltas('OLD', '-1') + _appointment_deltas('NEW', '1')),
+    }
+    for name, (event, statements) in triggers.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {' '.join(statements)} END")
+    _rebuild_counters(cur)
+
+
+# ---------------- PREDICTION INPUTS ----------------
+# predictions.input_data holds a packed little-endian float32 vector when every
+# value is a number; input_schema_id then points at the column dictionary entry
+# naming its columns. Anything else is stored as compact JSON with a NULL
+# input_schema_id.
+
+def _pack_struct(n_columns):
+    return struct.Struct(f'<{n_columns}f')
+
+
+def _input_schema_id(cur, columns):
+    """input_schemas id for a column tuple, adding the entry on first use."""
+    text = json.dumps(columns, separators=(',', ':'))
+    row = cur.execute('SELECT id FROM input_schemas WHERE columns = ?', (text,)).fetchone()
+    if row:
+        return row[0]
+    cur.execute('INSERT OR IGNORE INTO input_schemas (columns) VALUES (?)', (text,))
+    return cur.execute('SELECT id FROM input_schemas WHERE columns = ?', (text,)).fetchone()[0]
+
+
+def _encode_input(data, schema_for):
+    """``(input_schema_id, payload)`` for a prediction's input record; ``schema_for``
+    maps a column tuple to its ``(input_schema_id, Struct)``."""
+    if isinstance(data, dict) and data and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in data.values()):
+        schema_id, packer = schema_for(tuple(data))
+        return schema_id, packer.pack(*data.values())
+    return None, json.dumps(data, separators=(',', ':'), default=str)
+
+
+def decode_input(payload, columns=None):
+    """Inverse of the stored encoding: ``columns`` is the input_schemas entry for
+    packed rows and None for JSON ones."""
+    if payload is None:
+        return None
+    if columns is None:
+        return json.loads(payload)
+    # str() of a float32 is the shortest decimal that round-trips (0.1, not 0.10000000149)
+    return dict(zip(columns, (float(str(v)) for v in np.frombuffer(payload, dtype='<f4'))))
+
+
+def _compact_input_data(cur):
+    # Rows written before this migration hold str(dict), a Python repr
+    cur.execute('''CREATE TABLE IF NOT EXISTS input_schemas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        columns TEXT NOT NULL UNIQUE
+    )''')
+    columns = [row[1] for row in cur.execute('PRAGMA table_info(predictions)')]
+    if 'input_schema_id' not in columns:
+        cur.execute('ALTER TABLE predictions ADD COLUMN input_schema_id INTEGER REFERENCES input_schemas (id)')
+
+    schemas = {}
+
+    def schema_for(columns):
+        if columns not in schemas:
+            schemas[columns] = (_input_schema_id(cur, columns), _pack_struct(len(columns)))
+        return schemas[columns]
+
+    reader = cur.connection.cursor()
+    reader.execute('SELECT id, input_data FROM predictions WHERE input_schema_id IS NULL AND input_data IS NOT NULL')
+    converted, unreadable = 0, 0
+    while True:
+        batch = reader.fetchmany(10000)
+        if not batch:
+            break
+        updates = []
+        for prediction_id, text in batch:
+            try:
+                data = ast.literal_eval(text)
+            except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                # Not a repr (already JSON, or damaged); keep the text as it is
+                try:
+                    json.loads(text)
+                except (ValueError, TypeError):
+                    unreadable += 1
+                    updates.append((None, json.dumps({'_raw': str(text)}), prediction_id))
+                continue
+            updates.append((*_encode_input(data, schema_for), prediction_id))
+        cur.executemany('UPDATE predictions SET input_schema_id = ?, input_data = ? WHERE id = ?', updates)
+        converted += len(updates)
+    if converted:
+        print(f"📦 Re-encoded input_data for {converted} predictions"
+              + (f" ({unreadable} unreadable, kept under '_raw')" if unreadable else ""))
+
+
+
+# ---------------- DOCTOR SCHEDULES ----------------
+# Weekly bookable hours per doctor: weekday 0 = Monday, times 'HH:MM', end exclusive.
+DEFAULT_SCHEDULE = {'weekdays': range(5), 'start_time': '09:00', 'end_time': '17:00', 'slot_minutes': 30}
+
+
+def _seed_default_schedules(cur):
+    """Give every doctor without schedule rows the DEFAULT_SCHEDULE."""
+    cur.execute('''
+        INSERT INTO doctor_schedules (doctor_id, weekday, start_time, end_time, slot_minutes)
+        SELECT d.id, w.value, ?, ?, ?
+        FROM doctors d, json_each(?) w
+        WHERE NOT EXISTS (SELECT 1 FROM doctor_schedules s WHERE s.doctor_id = d.id)
+    ''', (DEFAULT_SCHEDULE['start_time'], DEFAULT_SCHEDULE['end_time'], DEFAULT_SCHEDULE['slot_minutes'],
+          json.dumps(list(DEFAULT_SCHEDULE['weekdays']))))
+    return cur.rowcount
+
+
+def _add_doctor_schedules(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS doctor_schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            slot_minutes INTEGER NOT NULL DEFAULT 30 CHECK (slot_minutes > 0),
+            UNIQUE (doctor_id, weekday, start_time),
+            FOREIGN KEY (doctor_id) REFERENCES doctors (id)
+        )
+    ''')
+    # Booked (active) slots of one doctor over a date range, in index order
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_appointments_doctor_active_slot
+        ON appointments (doctor_id, appointment_date, appointment_time)
+        WHERE status IN ('pending', 'approved')
+    ''')
+    _seed_default_schedules(cur)
+
+
+def schedule_slots(schedule, day):
+    """Slot start times ('HH:MM') that ``schedule`` rows offer on ``day`` (a date)."""
+    slots = []
+    for weekday, start_time, end_time, slot_minutes in schedule:
+        if weekday != day.weekday():
+            continue
+        start = datetime.combine(day, datetime.strptime(start_time, '%H:%M').time())
+        end = datetime.combine(day, datetime.strptime(end_time, '%H:%M').time())
+        step = timedelta(minutes=slot_minutes)
+        while start + step <= end:
+            slots.append(start.strftime('%H:%M'))
+            start += step
+    return sorted(slots)
+
+
+SCHEMA_MIGRATIONS = [
+    (1, 'add appointments.reason', _add_appointment_reason),
+    (2, 'indexes for dashboard and history queries', [
+        # Covers get_user_predictions without touching the table
+        '''CREATE INDEX IF NOT EXISTS idx_predictions_user_date
+           ON predictions (user_id, prediction_date, disease_type, prediction_result, confidence)''',
+        '''CREATE INDEX IF NOT EXISTS idx_appointments_user_date
+           ON appointments (user_id, appointment_date, appointment_time)''',
+        '''CREATE INDEX IF NOT EXISTS idx_appointments_doctor_date
+           ON appointments (doctor_id, appointment_date, appointment_time)''',
+    ]),
+    (3, 'unique active appointment slots', _unique_active_slots),
+    (4, 'index for per-doctor status counts', [
+        '''CREATE INDEX IF NOT EXISTS idx_appointments_doctor_status
+           ON appointments (doctor_id, status)''',
+    ]),
+    (5, 'predictions index ordered by (date, id) for keyset pagination', [
+        # id must follow prediction_date directly or ORDER BY ... id DESC needs a sort
+        'DROP INDEX IF EXISTS idx_predictions_user_date',
+        '''CREATE INDEX IF NOT EXISTS idx_predictions_user_date_id
+           ON predictions (user_id, prediction_date, id, disease_type, prediction_result, confidence)''',
+    ]),
+    (6, 'durable email outbox', [
+        # Times are epoch seconds so the sender can do backoff arithmetic in SQL
+        '''CREATE TABLE IF NOT EXISTS email_outbox (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               to_email TEXT NOT NULL,
+               subject TEXT NOT NULL,
+               html_body TEXT NOT NULL,
+               text_body TEXT,
+               status TEXT NOT NULL DEFAULT 'pending',
+               attempts INTEGER NOT NULL DEFAULT 0,
+               next_attempt_at REAL NOT NULL,
+               last_error TEXT,
+               created_at REAL NOT NULL,
+               sent_at REAL
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+           ON email_outbox (status, next_attempt_at)''',
+    ]),
+    (7, 'idempotency keys for prediction requests', [
+        # request_hash lets a reused key with a different request be refused
+        '''CREATE TABLE IF NOT EXISTS prediction_requests (
+               user_id INTEGER NOT NULL,
+               idempotency_key TEXT NOT NULL,
+               request_hash TEXT NOT NULL,
+               prediction_id INTEGER NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (user_id, idempotency_key),
+               FOREIGN KEY (prediction_id) REFERENCES predictions (id)
+           )''',
+    ]),
+    (8, 'trigger-maintained dashboard counters', _add_counters),
+    (9, 'packed float32 / JSON prediction input_data', _compact_input_data),
+    (10, 'doctor schedules and active-slot index by doctor_id', _add_doctor_schedules),
+]
+
+# Representative forms of the hot queries; each must be answered from an index.
+HOT_QUERIES = {
+    'user_predictions': ('''
+        SELECT id, disease_type, prediction_result, confidence, prediction_date
+        FROM predictions WHERE user_id = ? AND (prediction_date, id) < (?, ?)
+        ORDER BY prediction_date DESC, id DESC LIMIT 5
+    ''', (1, '2030-01-01 00:00:00', 10)),
+    'user_appointments': ('''
+        SELECT id, doctor_name, status FROM appointments
+        WHERE user_id = ? AND (appointment_date, appointment_time, id) < (?, ?, ?)
+        ORDER BY appointment_date DESC, appointment_time DESC, id DESC LIMIT 20
+    ''', (1, '2030-01-01', '10:00', 10)),
+    'doctor_appointments': ('''
+        SELECT a.id, u.full_name, p.disease_type
+        FROM appointments a
+        JOIN users u ON a.user_id = u.id
+        LEFT JOIN predictions p ON a.prediction_id = p.id
+        WHERE a.doctor_id = ? AND (a.appointment_date, a.appointment_time, a.id) < (?, ?, ?)
+        ORDER BY a.appointment_date DESC, a.appointment_time DESC, a.id DESC LIMIT 20
+    ''', (1, '2030-01-01', '10:00', 10)),
+    'user_upcoming_appointments': ('''
+        SELECT id, doctor_name, status FROM appointments
+        WHERE user_id = ? AND appointment_date >= ? AND status IN ('pending', 'approved')
+        ORDER BY appointment_date, appointment_time, id LIMIT 5
+    ''', (1, '2030-01-01')),
+    'doctor_availability': ('''
+        SELECT appointment_date, appointment_time FROM appointments
+        WHERE doctor_id = ? AND appointment_date BETWEEN ? AND ? AND status IN ('pending', 'approved')
+    ''', (1, '2030-01-01', '2030-01-07')),
+    'check_slot': ('''
+        SELECT id FROM appointments
+        WHERE doctor_name = ? AND appointment_date = ? AND appointment_time = ?
+        AND status IN ('pending', 'approved')
+    ''', ('Dr. Sarah Johnson', '2030-01-01', '10:00')),
+    'user_stats': ('''
+        SELECT predictions, healthy_predictions, risk_predictions, appointments
+        FROM user_counters WHERE user_id = ?
+    ''', (1,)),
+    'doctor_stats': ('''
+        SELECT appointments, pending_appointments FROM doctor_counters WHERE doctor_id = ?
+    ''', (1,)),
+}
+
+
+def _user_counts(conn, user_id):
+    """(predictions, healthy, risk, appointments) from user_counters; zeros for a new user."""
+    row = conn.execute('''
+        SELECT predictions, healthy_predictions, risk_predictions, appointments
+        FROM user_counters WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+    return row or (0, 0, 0, 0)
+
+
+# ---------------- KEYSET PAGINATION ----------------
+def encode_cursor(values):
+    """Opaque page cursor holding the sort key of the last row returned."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    # Values are bound as SQL parameters, so only scalars sqlite3 accepts may pass
+    if not isinstance(values, list) or not all(
+            isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in values):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def _keyset_condition(columns, cursor):
+    """``(c1, c2, ...) < (?, ?, ...)`` for rows after ``cursor`` in DESC order on ``columns``."""
+    values = decode_cursor(cursor)
+    if len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+    return f"({', '.join(columns)}) < ({', '.join('?' * len(columns))})", values
+
 
 class Database:
-    def __init__(self, db_name='medical_app.db'):
+    def __init__(self, db_name='medical_app.db', pool_size=None, passwords=None):
         self.db_name = db_name
+        self.passwords = passwords or PasswordHasher()
+        self._invalidation_hooks = []
+        self._input_schemas = {}
+        self.pool = ConnectionPool(
+            db_name,
+            max_size=pool_size or int(os.environ.get('DB_POOL_SIZE', 8)),
+            timeout=float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            busy_timeout_ms=int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000)),
+            cache_size_kib=int(os.environ.get('DB_CACHE_SIZE_KIB', 16384)),
+        )
         self.init_database()
     
     def get_connection(self):
+        """Open a standalone (unpooled) connection, e.g. for maintenance scripts."""
         return sqlite3.connect(self.db_name)
+
+    def connection(self):
+        """Check out a pooled connection; uncommitted work is rolled back on return."""
+        return self.pool.connection()
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def add_invalidation_hook(self, hook):
+        """Register ``hook(table, key)``, called after every committed write.
+
+        ``key`` is the affected user id for per-user tables, or None when the
+        change is not tied to a single user (e.g. the doctor roster).
+        """
+        self._invalidation_hooks.append(hook)
+
+    def _invalidate(self, table, key=None):
+        for hook in self._invalidation_hooks:
+            hook(table, key)
     
     def init_database(self):
         """Initialize all database tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        # Patients table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password BLOB NOT NULL,
-                full_name TEXT NOT NULL,
-                phone TEXT,
-                date_of_birth DATE,
-                gender TEXT,
-                role TEXT DEFAULT 'patient',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Doctors table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS doctors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password BLOB NOT NULL,
-                full_name TEXT NOT NULL,
-                phone TEXT,
-                specialization TEXT NOT NULL,
-                qualification TEXT,
-                experience_years INTEGER,
-                role TEXT DEFAULT 'doctor',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+            # Patients table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    password BLOB NOT NULL,
+                    full_name TEXT NOT NULL,
+                    phone TEXT,
+                    date_of_birth DATE,
+                    gender TEXT,
+                    role TEXT DEFAULT 'patient',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
         
-        # Predictions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS predictions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                disease_type TEXT NOT NULL,
-                prediction_result TEXT NOT NULL,
-                confidence REAL,
-                input_data TEXT,
-                prediction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+            # Doctors table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS doctors (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    password BLOB NOT NULL,
+                    full_name TEXT NOT NULL,
+                    phone TEXT,
+                    specialization TEXT NOT NULL,
+                    qualification TEXT,
+                    experience_years INTEGER,
+                    role TEXT DEFAULT 'doctor',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
         
-        # Appointments table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appointments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                prediction_id INTEGER,
-                doctor_id INTEGER,
-                doctor_name TEXT NOT NULL,
-                specialization TEXT NOT NULL,
-                appointment_date DATE NOT NULL,
-                appointment_time TIME NOT NULL,
-                status TEXT DEFAULT 'pending',
-                notes TEXT,
-                doctor_notes TEXT,
-                approved_at TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (doctor_id) REFERENCES doctors (id)
-            )
-        ''')
+            # Predictions table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS predictions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    disease_type TEXT NOT NULL,
+                    prediction_result TEXT NOT NULL,
+                    confidence REAL,
+                    input_data TEXT,
+                    prediction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
         
-        conn.commit()
-        conn.close()
+            # Appointments table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS appointments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    prediction_id INTEGER,
+                    doctor_id INTEGER,
+                    doctor_name TEXT NOT NULL,
+                    specialization TEXT NOT NULL,
+                    appointment_date DATE NOT NULL,
+                    appointment_time TIME NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    notes TEXT,
+                    doctor_notes TEXT,
+                    approved_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (doctor_id) REFERENCES doctors (id)
+                )
+            ''')
         
-         
+            conn.commit()
+
+        self.migrate()
         self.insert_sample_doctors()
+
+    def schema_version(self):
+        with self.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
+        """Apply pending SCHEMA_MIGRATIONS, one transaction per version."""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            for version, description, step in SCHEMA_MIGRATIONS:
+                if cur.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    continue
+                # IMMEDIATE takes the write lock up front, so concurrently starting
+                # workers queue here and then see the version already bumped.
+                cur.execute('BEGIN IMMEDIATE')
+                try:
+                    if cur.execute('PRAGMA user_version').fetchone()[0] < version:
+                        if callable(step):
+                            step(cur)
+                        else:
+                            for statement in step:
+                                cur.execute(statement)
+                        cur.execute(f'PRAGMA user_version = {int(version)}')
+                        print(f"📌 Applied schema migration {version}: {description}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+    def explain_hot_queries(self):
+        """Return ``{name: [plan step, ...]}`` from EXPLAIN QUERY PLAN for HOT_QUERIES."""
+        plans = {}
+        with self.connection() as conn:
+            for name, (sql, params) in HOT_QUERIES.items():
+                rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                plans[name] = [row[3] for row in rows]
+        return plans
+
+    def check_query_plans(self):
+        """Return the hot queries whose plan full-scans a table or sorts rows outside an
+        index (empty when every hot query is served in index order)."""
+        return {
+            name: plan for name, plan in self.explain_hot_queries().items()
+            if any((step.startswith('SCAN ') and 'USING' not in step) or 'TEMP B-TREE' in step
+                   for step in plan)
+        }
     
+    def rebuild_counters(self):
+        """Recompute user_counters and doctor_counters from the source tables."""
+        with self.connection() as conn:
+            _rebuild_counters(conn.cursor())
+            conn.commit()
+        self._invalidate('predictions')
+        self._invalidate('appointments')
+
+    def verify_counters(self):
+        """Return ``[(table, key, stored, expected), ...]`` for every counters row that
+        disagrees with the source tables (empty when they all match)."""
+        mismatches = []
+        with self.connection() as conn:
+            # One read transaction, so both sides come from the same snapshot
+            conn.execute('BEGIN')
+            try:
+                for table, (key_column, columns) in COUNTER_TABLES.items():
+                    expected = {row[0]: tuple(row[1:]) for row in conn.execute(COUNTER_SOURCES[table])}
+                    stored = {row[0]: tuple(row[1:]) for row in conn.execute(
+                        f"SELECT {key_column}, {', '.join(columns)} FROM {table}")}
+                    zero = (0,) * len(columns)
+                    for key in sorted(expected.keys() | stored.keys()):
+                        if stored.get(key, zero) != expected.get(key, zero):
+                            mismatches.append((table, key, stored.get(key, zero), expected.get(key, zero)))
+            finally:
+                conn.rollback()
+        return mismatches
+
     # ---------------- DOCTOR SETUP ----------------
     def insert_sample_doctors(self):
         """Insert sample doctors if DB is empty"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*) FROM doctors')
-        if cursor.fetchone()[0] == 0:
-            password = bcrypt.hashpw("doctor123".encode('utf-8'), bcrypt.gensalt())
+            cursor.execute('SELECT COUNT(*) FROM doctors')
+            if cursor.fetchone()[0] == 0:
+                password = self.passwords.hash("doctor123")
             
-            doctors = [
-                ('dr.sarah', 'dr.sarah@hospital.com', password, 'Dr. Sarah Johnson', 
-                 '555-0101', 'Diabetologist', 'MD, Endocrinology', 10),
-                ('dr.michael', 'dr.michael@hospital.com', password, 'Dr. Michael Chen', 
-                 '555-0102', 'Cardiologist', 'MD, Cardiology', 15),
-                ('dr.emily', 'dr.emily@hospital.com', password, 'Dr. Emily Davis', 
-                 '555-0103', 'Hepatologist', 'MD, Gastroenterology', 12),
-                ('dr.robert', 'dr.robert@hospital.com', password, 'Dr. Robert Williams', 
-                 '555-0104', 'Nephrologist', 'MD, Nephrology', 8)
-            ]
+                doctors = [
+                    ('dr.sarah', 'dr.sarah@hospital.com', password, 'Dr. Sarah Johnson', 
+                     '555-0101', 'Diabetologist', 'MD, Endocrinology', 10),
+                    ('dr.michael', 'dr.michael@hospital.com', password, 'Dr. Michael Chen', 
+                     '555-0102', 'Cardiologist', 'MD, Cardiology', 15),
+                    ('dr.emily', 'dr.emily@hospital.com', password, 'Dr. Emily Davis', 
+                     '555-0103', 'Hepatologist', 'MD, Gastroenterology', 12),
+                    ('dr.robert', 'dr.robert@hospital.com', password, 'Dr. Robert Williams', 
+                     '555-0104', 'Nephrologist', 'MD, Nephrology', 8)
+                ]
             
-            cursor.executemany('''
-                INSERT INTO doctors (username, email, password, full_name, phone, 
-                                   specialization, qualification, experience_years)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', doctors)
+                cursor.executemany('''
+                    INSERT INTO doctors (username, email, password, full_name, phone, 
+                                       specialization, qualification, experience_years)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', doctors)
+                _seed_default_schedules(cursor)
             
-            conn.commit()
+                conn.commit()
+                self._invalidate('doctors')
         
-        conn.close()
     
     # ---------------- PATIENT AUTH ----------------
     def create_user(self, username, email, password, full_name, phone=None, dob=None, gender=None):
         """Create a new patient"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        # Hash before borrowing a connection so a slow hash does not hold one
+        hashed_password = self.passwords.hash(password)
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            cursor.execute('''
-                INSERT INTO users (username, email, password, full_name, phone, date_of_birth, gender, role)
-                VALUES (?, ?, ?, ?, ?, ?, ?, 'patient')
-            ''', (username, email, hashed_password, full_name, phone, dob, gender))
+            try:
+                cursor.execute('''
+                    INSERT INTO users (username, email, password, full_name, phone, date_of_birth, gender, role)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 'patient')
+                ''', (username, email, hashed_password, full_name, phone, dob, gender))
             
-            user_id = cursor.lastrowid
-            conn.commit()
-            return user_id
-        except sqlite3.IntegrityError:
-            return None
-        finally:
-            conn.close()
+                user_id = cursor.lastrowid
+                conn.commit()
+                self._invalidate('users', user_id)
+                return user_id
+            except sqlite3.IntegrityError:
+                return None
 
     def verify_user(self, username, password):
         """Verify a patient during login"""
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, username, email, password, full_name FROM users WHERE username=?", (username,))
-        user = cur.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id, username, email, password, full_name FROM users WHERE username=?", (username,))
+            user = cur.fetchone()
 
-        if user:
-            stored_hash = user[3]
-            if isinstance(stored_hash, str):
-                stored_hash = stored_hash.encode('utf-8')
-
-            if bcrypt.checkpw(password.encode('utf-8'), stored_hash):
-                return {
-                    'id': user[0],
-                    'username': user[1],
-                    'email': user[2],
-                    'full_name': user[4],
-                    'role': 'patient'
-                }
+        if user and self.passwords.verify(password, user[3], username):
+            return {
+                'id': user[0],
+                'username': user[1],
+                'email': user[2],
+                'full_name': user[4],
+                'role': 'patient'
+            }
         return None
 
     def get_user_by_id(self, user_id):
         """Fetch patient details by ID (used for booking and emails)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, username, email, full_name, phone, date_of_birth, gender
-            FROM users WHERE id = ?
-        ''', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, username, email, full_name, phone, date_of_birth, gender
+                FROM users WHERE id = ?
+            ''', (user_id,))
+            user = cursor.fetchone()
         if user:
             return {
                 'id': user[0],
@@ -191,49 +803,36 @@ class Database:
     # ---------------- DOCTOR AUTH ----------------
     def verify_doctor(self, username, password):
         """Verify doctor login"""
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, username, email, password, full_name, phone, specialization
-            FROM doctors WHERE username=?
-        """, (username,))
-        doctor = cur.fetchone()
-        conn.close()
-
-        print(f"🧠 Checking doctor {username}: {doctor}")   
-
-        if doctor:
-            stored_hash = doctor[3]
-            print(f"Stored hash: {stored_hash}")   
-
-            if isinstance(stored_hash, str):
-                stored_hash = stored_hash.encode('utf-8')
-
-            print(f"CheckPW: {bcrypt.checkpw(password.encode('utf-8'), stored_hash)}")   
-
-            if bcrypt.checkpw(password.encode('utf-8'), stored_hash):
-                return {
-                    'id': doctor[0],
-                    'username': doctor[1],
-                    'email': doctor[2],
-                    'full_name': doctor[4],
-                    'phone': doctor[5],
-                    'specialization': doctor[6],
-                    'role': 'doctor'
-                }
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, username, email, password, full_name, phone, specialization
+                FROM doctors WHERE username=?
+            """, (username,))
+            doctor = cur.fetchone()
+
+        if doctor and self.passwords.verify(password, doctor[3], username):
+            return {
+                'id': doctor[0],
+                'username': doctor[1],
+                'email': doctor[2],
+                'full_name': doctor[4],
+                'phone': doctor[5],
+                'specialization': doctor[6],
+                'role': 'doctor'
+            }
         return None
 
 
   
     def get_doctor_by_username(self, username):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, username, email, full_name, phone, specialization, role
-            FROM doctors WHERE username=?
-        """, (username,))
-        row = cur.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, username, email, full_name, phone, specialization, role
+                FROM doctors WHERE username=?
+            """, (username,))
+            row = cur.fetchone()
         if not row: return None
         return {
             'id': row[0], 'username': row[1], 'email': row[2],
@@ -244,15 +843,14 @@ class Database:
 
     def get_all_doctors(self):
         """List of all doctors"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, full_name, specialization, qualification, experience_years
-            FROM doctors
-            ORDER BY full_name
-        ''')
-        doctors = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, full_name, specialization, qualification, experience_years
+                FROM doctors
+                ORDER BY full_name
+            ''')
+            doctors = cursor.fetchall()
         
         return [{
             'id': d[0],
@@ -262,30 +860,188 @@ class Database:
             'experience_years': d[4]
         } for d in doctors]
 
+    def get_doctor(self, doctor_id):
+        """Public details of one doctor, or None."""
+        with self.connection() as conn:
+            d = conn.execute('''
+                SELECT id, full_name, specialization, qualification, experience_years
+                FROM doctors WHERE id = ?
+            ''', (doctor_id,)).fetchone()
+        if not d:
+            return None
+        return {
+            'id': d[0],
+            'full_name': d[1],
+            'specialization': d[2],
+            'qualification': d[3],
+            'experience_years': d[4]
+        }
+
+    def get_doctor_schedule(self, doctor_id, conn=None):
+        """``[(weekday, start_time, end_time, slot_minutes), ...]`` for a doctor."""
+        query = '''
+            SELECT weekday, start_time, end_time, slot_minutes
+            FROM doctor_schedules WHERE doctor_id = ?
+            ORDER BY weekday, start_time
+        '''
+        if conn is not None:
+            return conn.execute(query, (doctor_id,)).fetchall()
+        with self.connection() as conn:
+            return conn.execute(query, (doctor_id,)).fetchall()
+
+    def get_doctor_availability(self, doctor_id, date_from, date_to, now=None):
+        """Free slots per day from ``date_from`` to ``date_to`` (dates, inclusive).
+
+        The doctor's weekly schedule gives the candidate slots; the active
+        bookings for the whole range come from one idx_appointments_doctor_active_slot
+        range scan. Slots already in the past relative to ``now`` are left out.
+        """
+        now = now or datetime.now()
+        with self.connection() as conn:
+            schedule = self.get_doctor_schedule(doctor_id, conn)
+            booked = set(conn.execute('''
+                SELECT appointment_date, appointment_time FROM appointments
+                WHERE doctor_id = ? AND appointment_date BETWEEN ? AND ?
+                AND status IN ('pending', 'approved')
+            ''', (doctor_id, date_from.isoformat(), date_to.isoformat())).fetchall())
+
+        today, current = now.date(), now.strftime('%H:%M')
+        days = []
+        day = date_from
+        while day <= date_to:
+            date = day.isoformat()
+            slots = [] if day < today else [
+                t for t in schedule_slots(schedule, day)
+                if (date, t) not in booked and (day > today or t > current)
+            ]
+            days.append({'date': date, 'slots': slots})
+            day += timedelta(days=1)
+        return days
+
+    def is_scheduled_slot(self, doctor_id, day, appointment_time):
+        """Whether ``appointment_time`` starts a slot of the doctor's schedule on ``day``."""
+        return appointment_time in schedule_slots(self.get_doctor_schedule(doctor_id), day)
+
     # ---------------- PREDICTIONS ----------------
-    def save_prediction(self, user_id, disease_type, prediction_result, confidence, input_data):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO predictions (user_id, disease_type, prediction_result, confidence, input_data)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, disease_type, prediction_result, confidence, str(input_data)))
-        prediction_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+    def save_prediction(self, user_id, disease_type, prediction_result, confidence, input_data,
+                        idempotency_key=None, request_hash=None):
+        """Insert a prediction; with ``idempotency_key`` the key is recorded in the same
+        transaction. Returns None if that key was already used by this user."""
+        schema_id, payload = _encode_input(input_data, self._input_schema)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO predictions (user_id, disease_type, prediction_result, confidence, input_data, input_schema_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, disease_type, prediction_result, confidence, payload, schema_id))
+            prediction_id = cursor.lastrowid
+            if idempotency_key is not None:
+                try:
+                    cursor.execute('''
+                        INSERT INTO prediction_requests (user_id, idempotency_key, request_hash, prediction_id)
+                        VALUES (?, ?, ?, ?)
+                    ''', (user_id, idempotency_key, request_hash, prediction_id))
+                except sqlite3.IntegrityError:
+                    # A concurrent retry with the same key committed first
+                    conn.rollback()
+                    return None
+            conn.commit()
+        self._invalidate('predictions', user_id)
         return prediction_id
-    
-    def get_user_predictions(self, user_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
+
+    def get_idempotent_prediction(self, user_id, idempotency_key):
+        """The prediction recorded under a user's idempotency key, or None."""
+        with self.connection() as conn:
+            row = conn.execute('''
+                SELECT r.request_hash, p.id, p.disease_type, p.prediction_result, p.confidence
+                FROM prediction_requests r JOIN predictions p ON p.id = r.prediction_id
+                WHERE r.user_id = ? AND r.idempotency_key = ?
+            ''', (user_id, idempotency_key)).fetchone()
+        if not row:
+            return None
+        return {
+            'request_hash': row[0],
+            'id': row[1],
+            'disease_type': row[2],
+            'prediction_result': row[3],
+            'confidence': row[4]
+        }
+
+    def save_predictions(self, rows):
+        """Bulk insert (user_id, disease_type, prediction_result, confidence, input_data) rows.
+
+        Returns the new prediction ids in input order.
+        """
+        if not rows:
+            return []
+        rows = [(u, d, r, c, *_encode_input(i, self._input_schema)) for u, d, r, c, i in rows]
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO predictions (user_id, disease_type, prediction_result, confidence, input_schema_id, input_data)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            # All rows are written inside one transaction holding the write lock,
+            # so AUTOINCREMENT hands out a contiguous id range.
+            last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+            conn.commit()
+        for user_id in {row[0] for row in rows}:
+            self._invalidate('predictions', user_id)
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def _input_schema(self, columns):
+        """Cached ``(input_schema_id, Struct)`` for a column tuple. New entries are
+        committed on their own, so a rolled-back prediction cannot leave the cache
+        pointing at an id that was never stored."""
+        entry = self._input_schemas.get(columns)
+        if entry is None:
+            with self.connection() as conn:
+                schema_id = _input_schema_id(conn.cursor(), columns)
+                conn.commit()
+            entry = self._input_schemas[columns] = (schema_id, _pack_struct(len(columns)))
+        return entry
+
+    def input_schemas(self):
+        """The column dictionary: ``{input_schema_id: [column, ...]}``."""
+        with self.connection() as conn:
+            rows = conn.execute('SELECT id, columns FROM input_schemas').fetchall()
+        return {schema_id: json.loads(columns) for schema_id, columns in rows}
+
+    def get_prediction_input(self, prediction_id, user_id=None):
+        """The decoded input record of a prediction (optionally only if it belongs to ``user_id``)."""
+        query = '''
+            SELECT p.input_data, s.columns
+            FROM predictions p LEFT JOIN input_schemas s ON s.id = p.input_schema_id
+            WHERE p.id = ?
+        '''
+        params = [prediction_id]
+        if user_id is not None:
+            query += ' AND p.user_id = ?'
+            params.append(user_id)
+        with self.connection() as conn:
+            row = conn.execute(query, params).fetchone()
+        if not row:
+            return None
+        return decode_input(row[0], json.loads(row[1]) if row[1] else None)
+
+    def get_user_predictions(self, user_id, limit=None, cursor=None):
+        """Newest-first prediction history; pass ``limit``/``cursor`` to page through it."""
+        conditions, params = ['user_id = ?'], [user_id]
+        if cursor:
+            clause, values = _keyset_condition(('prediction_date', 'id'), cursor)
+            conditions.append(clause)
+            params.extend(values)
+        query = f'''
             SELECT id, disease_type, prediction_result, confidence, prediction_date
             FROM predictions
-            WHERE user_id = ?
-            ORDER BY prediction_date DESC
-        ''', (user_id,))
-        predictions = cursor.fetchall()
-        conn.close()
+            WHERE {' AND '.join(conditions)}
+            ORDER BY prediction_date DESC, id DESC
+        '''
+        if limit:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+        with self.connection() as conn:
+            predictions = conn.execute(query, params).fetchall()
         return [{
             'id': p[0],
             'disease_type': p[1],
@@ -295,33 +1051,45 @@ class Database:
         } for p in predictions]
 
     # ---------------- APPOINTMENTS ----------------
-    def save_appointment(self, user_id, prediction_id, doctor_name, specialization, appointment_date, appointment_time, notes=None):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM doctors WHERE full_name = ?', (doctor_name,))
-        doctor = cursor.fetchone()
-        doctor_id = doctor[0] if doctor else None
+    def save_appointment(self, user_id, prediction_id, doctor_name, specialization, appointment_date, appointment_time, notes=None,
+                         doctor_id=None):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if doctor_id is None:
+                cursor.execute('SELECT id FROM doctors WHERE full_name = ?', (doctor_name,))
+                doctor = cursor.fetchone()
+                doctor_id = doctor[0] if doctor else None
         
-        cursor.execute('''
-            INSERT INTO appointments (user_id, prediction_id, doctor_id, doctor_name, specialization, appointment_date, appointment_time, notes, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')
-        ''', (user_id, prediction_id, doctor_id, doctor_name, specialization, appointment_date, appointment_time, notes))
-        appointment_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            try:
+                cursor.execute('''
+                    INSERT INTO appointments (user_id, prediction_id, doctor_id, doctor_name, specialization, appointment_date, appointment_time, notes, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+                ''', (user_id, prediction_id, doctor_id, doctor_name, specialization, appointment_date, appointment_time, notes))
+            except sqlite3.IntegrityError:
+                # uq_appointments_active_slot: the slot was taken since check_slot ran
+                return None
+            appointment_id = cursor.lastrowid
+            conn.commit()
+        self._invalidate('appointments', user_id)
         return appointment_id
     
-    def get_user_appointments(self, user_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
+    def get_user_appointments(self, user_id, limit=None, cursor=None):
+        conditions, params = ['user_id = ?'], [user_id]
+        if cursor:
+            clause, values = _keyset_condition(('appointment_date', 'appointment_time', 'id'), cursor)
+            conditions.append(clause)
+            params.extend(values)
+        query = f'''
             SELECT id, doctor_name, specialization, appointment_date, appointment_time, status, notes, doctor_notes, created_at
             FROM appointments
-            WHERE user_id = ?
-            ORDER BY appointment_date DESC, appointment_time DESC
-        ''', (user_id,))
-        appointments = cursor.fetchall()
-        conn.close()
+            WHERE {' AND '.join(conditions)}
+            ORDER BY appointment_date DESC, appointment_time DESC, id DESC
+        '''
+        if limit:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+        with self.connection() as conn:
+            appointments = conn.execute(query, params).fetchall()
         return [{
             'id': a[0],
             'doctor_name': a[1],
@@ -334,10 +1102,8 @@ class Database:
             'created_at': a[8]
         } for a in appointments]
 
-    def get_doctor_appointments(self, doctor_id=None, status=None):
+    def get_doctor_appointments(self, doctor_id=None, status=None, limit=None, cursor=None):
         """Return doctor’s appointments list"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         query = '''
             SELECT a.id, u.full_name, u.email, u.phone, u.gender,
                    a.doctor_name, a.specialization, a.appointment_date, a.appointment_time,
@@ -355,12 +1121,18 @@ class Database:
         if status:
             conditions.append('a.status = ?')
             params.append(status)
+        if cursor:
+            clause, values = _keyset_condition(('a.appointment_date', 'a.appointment_time', 'a.id'), cursor)
+            conditions.append(clause)
+            params.extend(values)
         if conditions:
             query += ' WHERE ' + ' AND '.join(conditions)
-        query += ' ORDER BY a.appointment_date DESC, a.appointment_time DESC'
-        cursor.execute(query, params)
-        appointments = cursor.fetchall()
-        conn.close()
+        query += ' ORDER BY a.appointment_date DESC, a.appointment_time DESC, a.id DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+        with self.connection() as conn:
+            appointments = conn.execute(query, params).fetchall()
         return [{
             'id': apt[0],
             'patient_name': apt[1],
@@ -381,87 +1153,242 @@ class Database:
 
     def get_doctor_appointments_by_username(self, username):
         """Return all appointments where this doctor’s username matches"""
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT a.*, d.username FROM appointments a
-            JOIN doctors d ON a.doctor_id = d.id
-            WHERE d.username = ?
-        """, (username,))
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT a.*, d.username FROM appointments a
+                JOIN doctors d ON a.doctor_id = d.id
+                WHERE d.username = ?
+            """, (username,))
+            rows = cur.fetchall()
+            columns = [desc[0] for desc in cur.description]
         return [dict(zip(columns, row)) for row in rows]
     def check_slot(self, doctor_name, appointment_date, appointment_time):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT id FROM appointments
-            WHERE doctor_name = ?
-            AND appointment_date = ?
-            AND appointment_time = ?
-            AND status IN ('pending', 'approved')
-        """, (doctor_name, appointment_date, appointment_time))
+            cursor.execute("""
+                SELECT id FROM appointments
+                WHERE doctor_name = ?
+                AND appointment_date = ?
+                AND appointment_time = ?
+                AND status IN ('pending', 'approved')
+            """, (doctor_name, appointment_date, appointment_time))
 
-        result = cursor.fetchone()
-        conn.close()
+            result = cursor.fetchone()
 
         return result is not None
 
 
     def update_appointment_status(self, appointment_id, status, doctor_id=None, reason=None):
-        conn = self.get_connection()
-        cur = conn.cursor()
+        with self.connection() as conn:
+            cur = conn.cursor()
 
          
-        cur.execute("""
-            UPDATE appointments
-            SET status = ?, reason = ?, doctor_id = ?
-            WHERE id = ?
-        """, (status, reason, doctor_id, appointment_id))
-        conn.commit()
+            try:
+                cur.execute("""
+                    UPDATE appointments
+                    SET status = ?, reason = ?, doctor_id = ?
+                    WHERE id = ?
+                """, (status, reason, doctor_id, appointment_id))
+            except sqlite3.IntegrityError:
+                # uq_appointments_active_slot: e.g. approving a rejected booking
+                # whose slot has been booked again since
+                conn.rollback()
+                raise SlotTakenError('This time slot has since been booked by another appointment') from None
+            conn.commit()
 
          
-        cur.execute("""
-            SELECT u.email AS patient_email,
-                u.full_name AS patient_name,
-                a.appointment_date,
-                a.appointment_time,
-                a.doctor_name,
-                a.specialization
-            FROM appointments a
-            JOIN users u ON a.user_id = u.id
-            WHERE a.id = ?
-        """, (appointment_id,))
+            cur.execute("""
+                SELECT u.email AS patient_email,
+                    u.full_name AS patient_name,
+                    a.appointment_date,
+                    a.appointment_time,
+                    a.doctor_name,
+                    a.specialization
+                FROM appointments a
+                JOIN users u ON a.user_id = u.id
+                WHERE a.id = ?
+            """, (appointment_id,))
         
-        details = cur.fetchone()
-        conn.close()
+            details = cur.fetchone()
+        self._invalidate('appointments')
         return details
 
 
 
+    # ---------------- EMAIL OUTBOX ----------------
+    # Status flow: pending -> sending (leased by a sender) -> sent | pending (retry) | failed
+    def enqueue_email(self, to_email, subject, html_body, text_body=None):
+        now = time.time()
+        with self.connection() as conn:
+            cur = conn.execute('''
+                INSERT INTO email_outbox (to_email, subject, html_body, text_body, status, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            ''', (to_email, subject, html_body, text_body, now, now))
+            conn.commit()
+            return cur.lastrowid
+
+    def claim_due_emails(self, limit=20, lease_seconds=300):
+        """Lease up to ``limit`` due messages to the caller.
+
+        A message stuck in 'sending' (its sender died) becomes due again once its
+        lease expires.
+        """
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                SELECT id, to_email, subject, html_body, text_body, attempts, created_at
+                FROM email_outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            ''', (now, limit)).fetchall()
+            conn.executemany(
+                "UPDATE email_outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+                [(now + lease_seconds, r[0]) for r in rows])
+            conn.commit()
+        return [{
+            'id': r[0], 'to_email': r[1], 'subject': r[2], 'html_body': r[3],
+            'text_body': r[4], 'attempts': r[5], 'created_at': r[6]
+        } for r in rows]
+
+    def mark_email_sent(self, email_id):
+        with self.connection() as conn:
+            conn.execute('''
+                UPDATE email_outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1, last_error = NULL
+                WHERE id = ?
+            ''', (time.time(), email_id))
+            conn.commit()
+
+    def mark_email_failed(self, email_id, error, retry_at=None):
+        """Record a failed attempt; requeue for ``retry_at`` (epoch) or give up when None."""
+        with self.connection() as conn:
+            conn.execute('''
+                UPDATE email_outbox
+                SET status = ?, attempts = attempts + 1, last_error = ?, next_attempt_at = COALESCE(?, next_attempt_at)
+                WHERE id = ?
+            ''', ('pending' if retry_at else 'failed', str(error)[:500], retry_at, email_id))
+            conn.commit()
+
+    def get_outbox_stats(self):
+        with self.connection() as conn:
+            # 'sent' rows only grow; leave them out so this stays an index range count
+            counts = dict(conn.execute('''
+                SELECT status, COUNT(*) FROM email_outbox
+                WHERE status IN ('pending', 'sending', 'failed')
+                GROUP BY status
+            ''').fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM email_outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+        return {
+            'pending': counts.get('pending', 0),
+            'sending': counts.get('sending', 0),
+            'failed': counts.get('failed', 0),
+            'oldest_pending_age_s': round(time.time() - oldest, 1) if oldest else 0.0
+        }
+
     def get_appointment_statistics(self, doctor_id=None):
-        """Return summary stats for a doctor"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Return summary stats for a doctor (all doctors when doctor_id is None)"""
         where_clause = 'WHERE doctor_id = ?' if doctor_id else ''
         params = [doctor_id] if doctor_id else []
-        
-        cursor.execute(f'SELECT COUNT(*) FROM appointments {where_clause}', params)
-        total = cursor.fetchone()[0]
-        cursor.execute(f'SELECT COUNT(*) FROM appointments {where_clause} {"AND" if doctor_id else "WHERE"} status = "pending"', params)
-        pending = cursor.fetchone()[0]
-        cursor.execute(f'SELECT COUNT(*) FROM appointments {where_clause} {"AND" if doctor_id else "WHERE"} status = "approved"', params)
-        approved = cursor.fetchone()[0]
-        cursor.execute(f'SELECT COUNT(*) FROM appointments {where_clause} {"AND" if doctor_id else "WHERE"} status = "rejected"', params)
-        rejected = cursor.fetchone()[0]
-        conn.close()
-        
+        with self.connection() as conn:
+            total, pending, approved, rejected = conn.execute(f'''
+                SELECT COALESCE(SUM(appointments), 0),
+                       COALESCE(SUM(pending_appointments), 0),
+                       COALESCE(SUM(approved_appointments), 0),
+                       COALESCE(SUM(rejected_appointments), 0)
+                FROM doctor_counters {where_clause}
+            ''', params).fetchone()
+
         return {
             'total': total,
             'pending': pending,
             'approved': approved,
             'rejected': rejected
         }
-     
+
+    def get_patient_dashboard(self, user_id, recent_limit=5, upcoming_limit=5):
+        """Counts, latest predictions and upcoming active appointments, read on one connection."""
+        today = datetime.now().strftime('%Y-%m-%d')
+        with self.connection() as conn:
+            total, healthy, risk, appointments = _user_counts(conn, user_id)
+            recent = conn.execute('''
+                SELECT id, disease_type, prediction_result, confidence, prediction_date
+                FROM predictions
+                WHERE user_id = ?
+                ORDER BY prediction_date DESC, id DESC
+                LIMIT ?
+            ''', (user_id, int(recent_limit))).fetchall()
+            upcoming = conn.execute('''
+                SELECT id, doctor_name, specialization, appointment_date, appointment_time, status
+                FROM appointments
+                WHERE user_id = ? AND appointment_date >= ? AND status IN ('pending', 'approved')
+                ORDER BY appointment_date, appointment_time, id
+                LIMIT ?
+            ''', (user_id, today, int(upcoming_limit))).fetchall()
+        return {
+            'stats': {
+                'total_predictions': total,
+                'healthy_results': healthy,
+                'risk_detected': risk,
+                'total_appointments': appointments
+            },
+            'recent_predictions': [{
+                'id': p[0],
+                'disease_type': p[1],
+                'prediction_result': p[2],
+                'confidence': p[3],
+                'prediction_date': p[4]
+            } for p in recent],
+            'upcoming_appointments': [{
+                'id': a[0],
+                'doctor_name': a[1],
+                'specialization': a[2],
+                'appointment_date': a[3],
+                'appointment_time': a[4],
+                'status': a[5]
+            } for a in upcoming]
+        }
+
+    def get_user_stats(self, user_id):
+        """Prediction and appointment counts for a patient's dashboard"""
+        with self.connection() as conn:
+            total, healthy, risk, appointments = _user_counts(conn, user_id)
+
+        return {
+            'total_predictions': total,
+            'healthy_results': healthy,
+            'risk_detected': risk,
+            'total_appointments': appointments
+        }
+
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    database = Database(sys.argv[2] if len(sys.argv) > 2 else 'medical_app.db')
+    if command == 'migrate':
+        print(f"✅ Schema at version {database.schema_version()}")
+    elif command == 'rebuild-counters':
+        database.rebuild_counters()
+        print("✅ Counters rebuilt from predictions and appointments")
+    elif command == 'verify-counters':
+        mismatches = database.verify_counters()
+        for table, key, stored, expected in mismatches:
+            print(f"❌ {table}[{key}]: stored {stored}, expected {expected}")
+        print("✅ Counters match the source tables" if not mismatches else f"❌ {len(mismatches)} counters rows differ")
+        sys.exit(1 if mismatches else 0)
+    elif command == 'explain':
+        for name, plan in database.explain_hot_queries().items():
+            print(f"{name}:")
+            for step in plan:
+                print(f"    {step}")
+        failing = database.check_query_plans()
+        print("✅ All hot queries use an index" if not failing else f"❌ Full scans in: {', '.join(failing)}")
+        sys.exit(1 if failing else 0)
+    else:
+        print(f"Unknown command: {command} (expected migrate, explain, rebuild-counters or verify-counters)")
+        sys.exit(2)
@@ -0,0 +1,160 @@
+# backend/email_outbox.py
+"""Durable email outbox.
+
+With EMAIL_OUTBOX_WORKER=0 the API only queues mail; run the sender as its own
+process from backend/:  python email_outbox.py [--once] [--db medical_app.db]
+"""
+import os
+import threading
+import time
+
+
+class EmailOutbox:
+    """Durable email queue backed by the ``email_outbox`` table.
+
+    Request handlers call ``enqueue`` (one INSERT); a daemon thread drains due
+    messages in batches through ``EmailService.send_many`` and retries failures with
+    exponential backoff until ``max_attempts`` is reached.
+    """
+
+    def __init__(self, db, email_service, poll_interval=5.0, batch_size=20,
+                 max_attempts=6, base_backoff=30.0, max_backoff=3600.0):
+        self.db = db
+        self.email_service = email_service
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self._sent = 0
+        self._retried = 0
+        self._failed = 0
+        self._send_time = 0.0
+        self._max_send_time = 0.0
+        self._queue_delay = 0.0
+
+    # ---------------- Producer side ----------------
+    def enqueue(self, to_email, subject, html_body, text_body=None):
+        email_id = self.db.enqueue_email(to_email, subject, html_body, text_body)
+        if self._thread is not None and not self._stop.is_set():
+            self.start()   # no-op unless this is a forked worker process
+        self._wake.set()
+        return email_id
+
+    # ---------------- Sender thread ----------------
+    def start(self):
+        """Start the sender thread (again after fork(), where threads do not survive)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='email-outbox', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """Deliver messages until stop(); the sender thread's loop, or a standalone process."""
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                print(f"❌ Email outbox error: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def backoff(self, attempts):
+        return min(self.base_backoff * (2 ** max(attempts - 1, 0)), self.max_backoff)
+
+    def run_once(self):
+        """Deliver one batch of due messages; returns how many were attempted."""
+        batch = self.db.claim_due_emails(limit=self.batch_size)
+        if not batch:
+            return 0
+
+        start = time.perf_counter()
+        errors = self.email_service.send_many([
+            (m['to_email'], m['subject'], m['html_body'], m['text_body']) for m in batch])
+        per_message = (time.perf_counter() - start) / len(batch)
+
+        for message, error in zip(batch, errors):
+            if error is None:
+                self.db.mark_email_sent(message['id'])
+                with self._lock:
+                    self._sent += 1
+                    self._send_time += per_message
+                    self._max_send_time = max(self._max_send_time, per_message)
+                    self._queue_delay += time.time() - message['created_at']
+                continue
+
+            attempts = message['attempts'] + 1
+            if attempts >= self.max_attempts:
+                self.db.mark_email_failed(message['id'], error)
+                print(f"❌ Giving up on email {message['id']} to {message['to_email']} after {attempts} attempts: {error}")
+                with self._lock:
+                    self._failed += 1
+            else:
+                self.db.mark_email_failed(message['id'], error, retry_at=time.time() + self.backoff(attempts))
+                with self._lock:
+                    self._retried += 1
+        return len(batch)
+
+    def drain(self):
+        """Deliver every message due now (failures are rescheduled); returns how many were attempted."""
+        total = 0
+        while True:
+            processed = self.run_once()
+            total += processed
+            if processed < self.batch_size:
+                return total
+
+    def stats(self):
+        queue = self.db.get_outbox_stats()
+        with self._lock:
+            sent = self._sent
+            return {
+                'queue': queue,
+                'sent': sent,
+                'retried': self._retried,
+                'failed': self._failed,
+                'avg_send_ms': round(self._send_time / sent * 1000, 1) if sent else 0.0,
+                'max_send_ms': round(self._max_send_time * 1000, 1),
+                'avg_queue_delay_s': round(self._queue_delay / sent, 2) if sent else 0.0,
+                'worker_alive': bool(self._thread and self._thread.is_alive()),
+                'smtp': self.email_service.smtp_stats(),
+            }
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import Database
+    from email_service import EmailService
+
+    parser = argparse.ArgumentParser(description="Deliver queued emails from the email_outbox table.")
+    parser.add_argument('--db', default='medical_app.db', help="SQLite database the API writes to")
+    parser.add_argument('--once', action='store_true', help="deliver what is due now, then exit")
+    args = parser.parse_args()
+
+    outbox = EmailOutbox(Database(args.db), EmailService())
+    if args.once:
+        print(f"📧 Attempted {outbox.drain()} queued emails; queue now {outbox.db.get_outbox_stats()}")
+    else:
+        print("📧 Email outbox sender running (Ctrl+C to stop)")
+        try:
+            outbox.run()
+        except KeyboardInterrupt:
+            outbox.stop()
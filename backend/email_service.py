@@ -1,15 +1,111 @@
 import os
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
 
+from email_templates import TemplateRegistry
+
+
+class SMTPSessionPool:
+    """Keeps authenticated SMTP sessions open between messages.
+
+    ``connect`` opens a ready-to-send session. Idle sessions are checked with
+    NOOP before reuse and dropped once they have been idle for too long or
+    have sent ``max_messages`` messages (Gmail caps messages per connection).
+    """
+
+    def __init__(self, connect, max_idle=2, idle_timeout=120.0, check_after=10.0, max_messages=100):
+        self.connect = connect
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.max_messages = max_messages
+        self._idle = []           # [(session, released_at)], most recent last
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'failed_checks': 0}
+
+    def acquire(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Sessions opened by the parent process share its sockets
+                    self._idle, self._pid = [], os.getpid()
+                if not self._idle:
+                    break
+                session, released_at = self._idle.pop()
+            idle_for = now - released_at
+            if idle_for < self.idle_timeout and (idle_for < self.check_after or self._healthy(session)):
+                self._count('reuses')
+                return session
+            self._close(session)
+            self._count('reconnects')
+
+        session = self.connect()
+        session.sent_count = 0
+        self._count('connects')
+        return session
+
+    def release(self, session):
+        if session.sent_count >= self.max_messages:
+            self._close(session)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((session, time.monotonic()))
+                return
+        self._close(session)
+
+    def discard(self, session):
+        self._close(session)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session, _ in idle:
+            self._close(session)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+    def _healthy(self, session):
+        try:
+            return session.noop()[0] == 250
+        except Exception:
+            self._count('failed_checks')
+            return False
+
+    def _count(self, stat):
+        # The network calls above run unlocked; only the counter update needs the lock
+        with self._lock:
+            self._stats[stat] += 1
+
+    @staticmethod
+    def _close(session):
+        try:
+            session.quit()
+        except Exception:
+            session.close()
+
+
 class EmailService:
-    def __init__(self):
+    def __init__(self, outbox=None):
+        # When set, messages are queued with outbox.enqueue(...) and delivered by a
+        # background sender instead of on the calling thread.
+        self.outbox = outbox
          
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port_tls = 587   # STARTTLS
-        self.smtp_port_ssl = 465   # SSL fallback
+        self.smtp_server = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+        self.smtp_port_tls = int(os.getenv("MAIL_PORT_TLS", 587))     # STARTTLS
+        self.smtp_port_ssl = int(os.getenv("MAIL_PORT_SSL", 465))     # SSL fallback
+        self.smtp_port_plain = int(os.getenv("MAIL_PORT_PLAIN", 25))  # unencrypted, local relays / test servers
+        self.smtp_timeout = float(os.getenv("MAIL_TIMEOUT", 20))
+        # Tried in order; whichever connects is tried first next time
+        self.transports = [t.strip() for t in os.getenv("MAIL_TRANSPORTS", "tls,ssl").split(",") if t.strip()]
 
          
         self.sender_email = os.getenv("MAIL_SENDER", "siravatiramesh@gmail.com")
@@ -21,79 +117,136 @@ class EmailService:
         self.hospital_address = os.getenv("HOSPITAL_ADDRESS", "123 Health Street, Medical City")
         self.reply_to = os.getenv("MAIL_REPLY_TO", self.sender_email)
 
+        self._pool = SMTPSessionPool(self._connect)
+        self.templates = TemplateRegistry(self.hospital_name, self.hospital_phone, self.hospital_address)
+
     # ---------------------------- Internal helpers ----------------------------
 
-    def _footer_html(self) -> str:
-        return f"""
-            <div style="text-align:center;color:#7f8c8d;font-size:13px;margin-top:20px;line-height:1.4">
-                <div>{self.hospital_name} • {self.hospital_phone}</div>
-                <div>{self.hospital_address}</div>
-            </div>
-        """
+    def _configured(self) -> bool:
+        # A password is only needed when talking to a real (authenticating) server
+        return bool(self.sender_email) and (bool(self.sender_password) or "plain" in self.transports)
 
-    def _frame_html(self, title: str, header_color: str, inner_html: str) -> str:
-        """Wraps provided HTML in a consistent branded template."""
-        return f"""
-        <html>
-        <head>
-            <meta charset="utf-8" />
-            <meta name="viewport" content="width=device-width, initial-scale=1" />
-        </head>
-        <body style="margin:0;padding:0;background:#f6f8fb;font-family:Arial,Helvetica,sans-serif;">
-            <div style="max-width:640px;margin:0 auto;padding:16px;">
-                <div style="background:{header_color};color:#fff;padding:18px 20px;border-radius:12px 12px 0 0;text-align:center;">
-                    <div style="font-size:20px;font-weight:700;margin:0;">{title}</div>
-                </div>
-                <div style="background:#ffffff;padding:20px;border-radius:0 0 12px 12px;border:1px solid #eaecef;border-top:none;">
-                    {inner_html}
-                    {self._footer_html()}
-                </div>
-            </div>
-        </body>
-        </html>
+    def _open(self, transport: str) -> smtplib.SMTP:
+        if transport == "ssl":
+            server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port_ssl, timeout=self.smtp_timeout)
+        else:
+            port = self.smtp_port_tls if transport == "tls" else self.smtp_port_plain
+            server = smtplib.SMTP(self.smtp_server, port, timeout=self.smtp_timeout)
+        try:
+            server.ehlo()
+            if transport == "tls":
+                server.starttls()
+                server.ehlo()
+            if self.sender_password and server.has_extn("auth"):
+                server.login(self.sender_email, self.sender_password)
+        except Exception:
+            server.close()
+            raise
+        server.transport = transport.upper()
+        return server
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open a session, trying the transport that last worked first."""
+        error = None
+        for transport in list(self.transports):
+            try:
+                server = self._open(transport)
+            except smtplib.SMTPAuthenticationError:
+                raise
+            except Exception as e:
+                print(f"ℹ️ {transport.upper()} connect failed ({e}). Trying next transport...")
+                error = e
+                continue
+            if transport != self.transports[0]:
+                self.transports = [transport] + [t for t in self.transports if t != transport]
+            return server
+        raise error or smtplib.SMTPException("No SMTP transports configured")
+
+    def _build_message(self, to_email: str, subject: str, html_body: str, text_body: str = None) -> MIMEMultipart:
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = subject
+        msg["From"] = formataddr((self.hospital_name, self.sender_email))
+        msg["To"] = to_email
+        msg.add_header("Reply-To", self.reply_to)
+
+        plain_fallback = text_body or (
+            "This email contains rich formatting. "
+            "Please view it in an HTML-capable email client."
+        )
+        msg.attach(MIMEText(plain_fallback, "plain"))
+        msg.attach(MIMEText(html_body, "html"))
+        return msg
+
+    def deliver(self, to_email: str, subject: str, html_body: str, text_body: str = None) -> None:
+        """Send one message now over a pooled SMTP session. Raises on failure."""
+        error = self.send_many([(to_email, subject, html_body, text_body)])[0]
+        if error is not None:
+            raise error
+
+    def send_many(self, messages) -> list:
+        """Send ``(to, subject, html[, text])`` tuples over one pooled SMTP session.
+
+        Returns one entry per message: None when sent, otherwise the exception.
+        A dropped connection is reopened and the message retried once; a message
+        the server rejects does not affect the rest of the batch.
         """
+        if not self._configured():
+            # Report a failure per message so an outbox keeps them for retry rather than marking them sent
+            for message in messages:
+                print(f"⚠️ Email not configured. Skipping send to {message[0]}.")
+            return [smtplib.SMTPException("Email not configured (MAIL_SENDER / MAIL_APP_PASSWORD)")] * len(messages)
 
-    def _send(self, to_email: str, subject: str, html_body: str) -> bool:
-        """Send HTML email safely, with TLS and SSL fallback."""
+        results = []
+        session = None
         try:
-            if not self.sender_email or not self.sender_password:
-                print(f"⚠️ Email not configured. Skipping send to {to_email}.")
-                return True  
-
-             
-            msg = MIMEMultipart("alternative")
-            msg["Subject"] = subject
-            msg["From"] = formataddr((self.hospital_name, self.sender_email))
-            msg["To"] = to_email
-            msg.add_header("Reply-To", self.reply_to)
-
-            plain_fallback = (
-                "This email contains rich formatting. "
-                "Please view it in an HTML-capable email client."
-            )
-            msg.attach(MIMEText(plain_fallback, "plain"))
-            msg.attach(MIMEText(html_body, "html"))
-
-            
-            try:
-                with smtplib.SMTP(self.smtp_server, self.smtp_port_tls, timeout=20) as server:
-                    server.ehlo()
-                    server.starttls()
-                    server.ehlo()
-                    server.login(self.sender_email, self.sender_password)
-                    server.send_message(msg)
-                print(f"✅ Email sent (TLS) to {to_email}")
-                return True
-            except Exception as e_tls:
-                print(f"ℹ️ TLS send failed ({e_tls}). Trying SSL...")
-
-             
-            with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port_ssl, timeout=20) as server:
-                server.login(self.sender_email, self.sender_password)
-                server.send_message(msg)
-            print(f"✅ Email sent (SSL) to {to_email}")
+            for index, message in enumerate(messages):
+                msg = self._build_message(*message)
+                for attempt in (1, 2):
+                    if session is None:
+                        try:
+                            session = self._pool.acquire()
+                        except Exception as e:
+                            # No transport is reachable: fail the rest of the batch
+                            results.extend([e] * (len(messages) - index))
+                            return results
+                    try:
+                        session.send_message(msg)
+                        session.sent_count += 1
+                        results.append(None)
+                        print(f"✅ Email sent ({session.transport}) to {message[0]}")
+                        if session.sent_count >= self._pool.max_messages:
+                            self._pool.release(session)
+                            session = None
+                        break
+                    except smtplib.SMTPServerDisconnected as e:
+                        error = e
+                    except smtplib.SMTPException as e:
+                        # Rejected by the server; the session itself is still usable
+                        results.append(e)
+                        break
+                    except OSError as e:
+                        error = e
+                    self._pool.discard(session)
+                    session = None
+                    if attempt == 2:
+                        results.append(error)
+        finally:
+            if session is not None:
+                self._pool.release(session)
+        return results
+
+    def smtp_stats(self) -> dict:
+        return self._pool.stats()
+
+    def _send(self, to_email: str, subject: str, html_body: str, text_body: str = None) -> bool:
+        """Queue the message on the outbox if configured, otherwise send it inline."""
+        if self.outbox is not None:
+            self.outbox.enqueue(to_email, subject, html_body, text_body)
             return True
 
+        try:
+            self.deliver(to_email, subject, html_body, text_body)
+            return True
         except smtplib.SMTPAuthenticationError as e_auth:
             print("❌ SMTP authentication error. For Gmail, use a generated App Password.")
             print(f"   Details: {e_auth}")
@@ -109,68 +262,24 @@ class EmailService:
         return self._send(to_email, subject, body)
 
      
+    def send_template(self, to_email, template, **values):
+        email = self.templates.render(template, **values)
+        return self._send(to_email, email.subject, email.html, email.text)
+
+     
     def send_appointment_booking_notification(self, patient_email, patient_name, doctor_name, appointment_date, appointment_time):
-        subject = f"📅 Appointment Booked - {self.hospital_name}"
-        content = f"""
-            <p style="margin:0 0 12px 0;font-size:15px;color:#2c3e50;">
-                Dear <strong>{patient_name}</strong>,
-            </p>
-            <p style="margin:0 0 10px 0;font-size:15px;color:#2c3e50;">
-                Your appointment request has been received and is <strong>pending confirmation</strong> from
-                <strong>{doctor_name}</strong>.
-            </p>
-            <div style="margin:14px 0;padding:12px 14px;border-left:4px solid #3498db;background:#f1f8ff;border-radius:6px;color:#1f2d3d;">
-                <div><strong>Date:</strong> {appointment_date}</div>
-                <div><strong>Time:</strong> {appointment_time}</div>
-                <div><strong>Doctor:</strong> {doctor_name}</div>
-            </div>
-            <p style="margin:10px 0 0 0;font-size:14px;color:#2c3e50;">
-                We’ll notify you as soon as the doctor approves or suggests a new time.
-            </p>
-        """
-        html = self._frame_html("📅 Appointment Booked", "#3498db", content)
-        return self._send(patient_email, subject, html)
+        return self.send_template(
+            patient_email, 'appointment_booked', patient_name=patient_name, doctor_name=doctor_name,
+            appointment_date=appointment_date, appointment_time=appointment_time)
 
      
     def send_appointment_confirmation(self, patient_email, patient_name, doctor_name, appointment_date, appointment_time, specialization):
-        subject = f"✅ Appointment Confirmed - {self.hospital_name}"
-        content = f"""
-            <p style="margin:0 0 12px 0;font-size:15px;color:#2c3e50;">
-                Dear <strong>{patient_name}</strong>,
-            </p>
-            <p style="margin:0 0 10px 0;font-size:15px;color:#2c3e50;">
-                Your appointment has been <strong>confirmed</strong> with <strong>{doctor_name}</strong> ({specialization}).
-            </p>
-            <div style="margin:14px 0;padding:12px 14px;border-left:4px solid #27ae60;background:#eefaf2;border-radius:6px;color:#1f2d3d;">
-                <div><strong>Date:</strong> {appointment_date}</div>
-                <div><strong>Time:</strong> {appointment_time}</div>
-            </div>
-            <p style="margin:10px 0 0 0;font-size:14px;color:#2c3e50;">
-                Please arrive 15 minutes early and carry any previous reports.
-            </p>
-        """
-        html = self._frame_html("✅ Appointment Confirmed", "#27ae60", content)
-        return self._send(patient_email, subject, html)
+        return self.send_template(
+            patient_email, 'appointment_confirmed', patient_name=patient_name, doctor_name=doctor_name,
+            appointment_date=appointment_date, appointment_time=appointment_time, specialization=specialization)
 
      
     def send_appointment_rejection(self, patient_email, patient_name, doctor_name, appointment_date, appointment_time, reason=None):
-        subject = f"⚠️ Appointment Update - {self.hospital_name}"
-        reason_html = f"<div><strong>Reason:</strong> {reason}</div>" if reason else ""
-        content = f"""
-            <p style="margin:0 0 12px 0;font-size:15px;color:#2c3e50;">
-                Dear <strong>{patient_name}</strong>,
-            </p>
-            <p style="margin:0 0 10px 0;font-size:15px;color:#2c3e50;">
-                We regret to inform you that your appointment with <strong>{doctor_name}</strong> was <strong>declined</strong>.
-            </p>
-            <div style="margin:14px 0;padding:12px 14px;border-left:4px solid #e74c3c;background:#fff2f2;border-radius:6px;color:#1f2d3d;">
-                <div><strong>Date:</strong> {appointment_date}</div>
-                <div><strong>Time:</strong> {appointment_time}</div>
-                {reason_html}
-            </div>
-            <p style="margin:10px 0 0 0;font-size:14px;color:#2c3e50;">
-                You may book another slot or contact our support for assistance.
-            </p>
-        """
-        html = self._frame_html("⚠️ Appointment Rejected", "#e74c3c", content)
-        return self._send(patient_email, subject, html)
\ No newline at end of file
+        return self.send_template(
+            patient_email, 'appointment_rejected', patient_name=patient_name, doctor_name=doctor_name,
+            appointment_date=appointment_date, appointment_time=appointment_time, reason=reason)
@@ -0,0 +1,205 @@
+# backend/email_templates.py
+"""Email templates compiled once, rendered many times.
+
+Each template body is wrapped in the branded frame and the hospital details are
+filled in when the registry is built. The resulting source is split into literal
+chunks and ``{field}`` slots, so rendering is a single ``''.join``. Field values
+are HTML-escaped unless wrapped in ``Safe``. The plain-text alternative is
+derived from the same source by stripping the markup, so both parts of the
+email always carry the same content.
+"""
+import html
+import re
+from string import Formatter
+
+
+class Safe(str):
+    """A value that is already HTML and must not be escaped again."""
+
+
+class CompiledTemplate:
+    def __init__(self, source, escape=True):
+        # literals[i] precedes fields[i]; the last literal follows the last field
+        self.literals = ['']
+        self.fields = []
+        for literal, field, _, _ in Formatter().parse(source):
+            # '{{' and '}}' end a chunk without a field; keep its text in the same literal
+            self.literals[-1] += literal
+            if field is not None:
+                self.fields.append(field)
+                self.literals.append('')
+        self.escape = escape
+
+    def render(self, values):
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            value = values.get(field)
+            if value is None:
+                value = ''
+            elif self.escape and not isinstance(value, Safe):
+                value = html.escape(str(value))
+            parts.append(value if isinstance(value, str) else str(value))
+            parts.append(literal)
+        return ''.join(parts)
+
+
+# ---------------- HTML -> text ----------------
+_HEAD = re.compile(r'<head>.*?</head>', re.S | re.I)
+_BLOCK_END = re.compile(r'</(p|div|h\d|li|tr)>|<br\s*/?>', re.I)
+_TAG = re.compile(r'<[^>]+>')
+_SPACES = re.compile(r'[ \t]+')
+
+
+def html_to_text(source):
+    """Plain-text form of template markup; ``{field}`` slots pass through untouched."""
+    text = _HEAD.sub('', source)
+    text = _BLOCK_END.sub('\n', text)
+    text = html.unescape(_TAG.sub('', text))
+    lines = [_SPACES.sub(' ', line).strip() for line in text.splitlines()]
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+# ---------------- TEMPLATE SOURCES ----------------
+FRAME = """
+        <html>
+        <head>
+            <meta charset="utf-8" />
+            <meta name="viewport" content="width=device-width, initial-scale=1" />
+        </head>
+        <body style="margin:0;padding:0;background:#f6f8fb;font-family:Arial,Helvetica,sans-serif;">
+            <div style="max-width:640px;margin:0 auto;padding:16px;">
+                <div style="background:[[header_color]];color:#fff;padding:18px 20px;border-radius:12px 12px 0 0;text-align:center;">
+                    <div style="font-size:20px;font-weight:700;margin:0;">[[title]]</div>
+                </div>
+                <div style="background:#ffffff;padding:20px;border-radius:0 0 12px 12px;border:1px solid #eaecef;border-top:none;">
+                    [[content]]
+
+            <div style="text-align:center;color:#7f8c8d;font-size:13px;margin-top:20px;line-height:1.4">
+                <div>[[hospital_name]] • [[hospital_phone]]</div>
+                <div>[[hospital_address]]</div>
+            </div>
+
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+
+# name -> (subject, title, header colour, body). Subjects may use {hospital_name}.
+TEMPLATES = {
+    'appointment_booked': (
+        "📅 Appointment Booked - {hospital_name}", "📅 Appointment Booked", "#3498db", """
+            <p style="margin:0 0 12px 0;font-size:15px;color:#2c3e50;">
+                Dear <strong>{patient_name}</strong>,
+            </p>
+            <p style="margin:0 0 10px 0;font-size:15px;color:#2c3e50;">
+                Your appointment request has been received and is <strong>pending confirmation</strong> from
+                <strong>{doctor_name}</strong>.
+            </p>
+            <div style="margin:14px 0;padding:12px 14px;border-left:4px solid #3498db;background:#f1f8ff;border-radius:6px;color:#1f2d3d;">
+                <div><strong>Date:</strong> {appointment_date}</div>
+                <div><strong>Time:</strong> {appointment_time}</div>
+                <div><strong>Doctor:</strong> {doctor_name}</div>
+            </div>
+            <p style="margin:10px 0 0 0;font-size:14px;color:#2c3e50;">
+                We’ll notify you as soon as the doctor approves or suggests a new time.
+            </p>
+        """),
+    'appointment_confirmed': (
+        "✅ Appointment Confirmed - {hospital_name}", "✅ Appointment Confirmed", "#27ae60", """
+            <p style="margin:0 0 12px 0;font-size:15px;color:#2c3e50;">
+                Dear <strong>{patient_name}</strong>,
+            </p>
+            <p style="margin:0 0 10px 0;font-size:15px;color:#2c3e50;">
+                Your appointment has been <strong>confirmed</strong> with <strong>{doctor_name}</strong> ({specialization}).
+            </p>
+            <div style="margin:14px 0;padding:12px 14px;border-left:4px solid #27ae60;background:#eefaf2;border-radius:6px;color:#1f2d3d;">
+                <div><strong>Date:</strong> {appointment_date}</div>
+                <div><strong>Time:</strong> {appointment_time}</div>
+            </div>
+            <p style="margin:10px 0 0 0;font-size:14px;color:#2c3e50;">
+                Please arrive 15 minutes early and carry any previous reports.
+            </p>
+        """),
+    'appointment_rejected': (
+        "⚠️ Appointment Update - {hospital_name}", "⚠️ Appointment Rejected", "#e74c3c", """
+            <p style="margin:0 0 12px 0;font-size:15px;color:#2c3e50;">
+                Dear <strong>{patient_name}</strong>,
+            </p>
+            <p style="margin:0 0 10px 0;font-size:15px;color:#2c3e50;">
+                We regret to inform you that your appointment with <strong>{doctor_name}</strong> was <strong>declined</strong>.
+            </p>
+            <div style="margin:14px 0;padding:12px 14px;border-left:4px solid #e74c3c;background:#fff2f2;border-radius:6px;color:#1f2d3d;">
+                <div><strong>Date:</strong> {appointment_date}</div>
+                <div><strong>Time:</strong> {appointment_time}</div>
+                {reason_block}
+            </div>
+            <p style="margin:10px 0 0 0;font-size:14px;color:#2c3e50;">
+                You may book another slot or contact our support for assistance.
+            </p>
+        """),
+}
+
+# Optional fragments, rendered into a parent field only when their value is present
+FRAGMENTS = {
+    'reason_block': ('reason', '<div><strong>Reason:</strong> {reason}</div>'),
+}
+
+
+def _literal(value):
+    """Escape a constant for inlining into template source."""
+    return html.escape(value).replace('{', '{{').replace('}', '}}')
+
+
+class RenderedEmail:
+    __slots__ = ('subject', 'html', 'text')
+
+    def __init__(self, subject, html_body, text_body):
+        self.subject = subject
+        self.html = html_body
+        self.text = text_body
+
+
+class TemplateRegistry:
+    """Compiles TEMPLATES for one hospital identity."""
+
+    def __init__(self, hospital_name, hospital_phone, hospital_address):
+        branding = {
+            'hospital_name': _literal(hospital_name),
+            'hospital_phone': _literal(hospital_phone),
+            'hospital_address': _literal(hospital_address),
+        }
+        self.hospital_name = hospital_name
+        self._templates = {}
+        for name, (subject, title, color, body) in TEMPLATES.items():
+            source = FRAME
+            for key, value in dict(branding, title=_literal(title), header_color=color, content=body).items():
+                source = source.replace(f'[[{key}]]', value)
+            text_source = html_to_text(source)
+            for field in FRAGMENTS:
+                # Fragments carry their own line break so an absent one leaves no blank line
+                text_source = text_source.replace(f'{{{field}}}\n', f'{{{field}}}')
+            self._templates[name] = (
+                CompiledTemplate(subject, escape=False),
+                CompiledTemplate(source),
+                CompiledTemplate(text_source, escape=False),
+            )
+        self._fragments = {
+            field: (trigger, CompiledTemplate(source), CompiledTemplate(html_to_text(source), escape=False))
+            for field, (trigger, source) in FRAGMENTS.items()
+        }
+
+    def names(self):
+        return list(self._templates)
+
+    def render(self, name, **values):
+        subject, html_template, text_template = self._templates[name]
+        values['hospital_name'] = self.hospital_name
+        text_values = values
+        if self._fragments:
+            text_values = dict(values)
+            for field, (trigger, html_fragment, text_fragment) in self._fragments.items():
+                if values.get(trigger):
+                    values[field] = Safe(html_fragment.render(values))
+                    text_values[field] = text_fragment.render(values)
+        return RenderedEmail(subject.render(values), html_template.render(values), text_template.render(text_values))
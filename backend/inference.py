@@ -0,0 +1,541 @@
+# backend/inference.py
+import bisect
+import hashlib
+import logging
+import math
+import mmap
+import os
+import threading
+import time
+import numpy as np
+import joblib
+from sklearn.pipeline import make_pipeline
+
+from cache import TTLCache
+from model_artifact import ModelArtifactError, legacy_manifest, validate
+from tree_engine import compile_ensemble
+
+logger = logging.getLogger(__name__)
+
+DISEASES = ['diabetes', 'heart', 'liver', 'kidney']
+POSITIVE_CLASS = 1
+DEFAULT_THRESHOLD = 0.5
+# Beyond this many rows sklearn's Cython tree walk beats the NumPy level-by-level one
+COMPILED_MAX_ROWS = 128
+# Single-row results remembered per loaded model (resubmitted forms, retries)
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 4096))
+# Accepted spellings for 0/1 inputs on numeric fields
+BOOLEAN_WORDS = {'male': 1, 'm': 1, 'female': 0, 'f': 0, 'yes': 1, 'y': 1, 'true': 1, 'positive': 1,
+                 'no': 0, 'n': 0, 'false': 0, 'negative': 0}
+
+
+class InputError(ValueError):
+    """A request record cannot be turned into a feature row; ``fields`` maps column -> problem."""
+
+    def __init__(self, message, fields=None):
+        super().__init__(message)
+        self.fields = fields or {}
+
+
+class CategoryEncoder:
+    """Maps request values to the integer codes a LabelEncoder produced at training.
+
+    Labels match case-insensitively (or by unique prefix, e.g. 'm' for 'Male').
+    For encoders over numeric labels, such as kidney ``wc``/``rc``, numbers are
+    matched by value and an unseen number takes the code of the nearest seen
+    one. A bare integer code in range is accepted for non-numeric labels, which
+    is what the HTML forms send.
+    """
+
+    def __init__(self, classes):
+        self.n_codes = len(classes)
+        self.by_label = {str(label).strip().lower(): code for code, label in enumerate(classes)}
+        numeric = []
+        for code, label in enumerate(classes):
+            try:
+                value = float(label)
+            except ValueError:
+                continue
+            if not np.isnan(value):
+                numeric.append((value, code))
+        numeric.sort()
+        self.value_list = [v for v, _ in numeric]
+        self.values = np.array(self.value_list)
+        self.codes = [c for _, c in numeric]
+
+    def encode_numbers(self, values):
+        """Vectorized ``encode`` for a float array; raises ValueError if any value has no code."""
+        if len(self.values):
+            # Nearest seen value: compare each input with its neighbours in the sorted labels
+            right = np.clip(np.searchsorted(self.values, values), 1, len(self.values) - 1)
+            left = right - 1
+            nearest = np.where(np.abs(values - self.values[left]) <= np.abs(self.values[right] - values),
+                               left, right) if len(self.values) > 1 else np.zeros(len(values), dtype=int)
+            return np.asarray(self.codes, dtype=np.float64)[nearest]
+        if not ((values == np.floor(values)) & (values >= 0) & (values < self.n_codes)).all():
+            raise ValueError('value outside the known codes')
+        return values
+
+    def encode(self, value):
+        if isinstance(value, str):
+            label = value.strip().lower()
+            if label in self.by_label:
+                return self.by_label[label]
+            try:
+                value = float(label)
+            except ValueError:
+                matches = {code for key, code in self.by_label.items() if key.startswith(label)} if label else set()
+                if len(matches) == 1:
+                    return matches.pop()
+                raise InputError(f'unknown category {value!r}') from None
+        value = float(value)
+        if not math.isfinite(value):
+            raise InputError(f'expected a finite number, got {value!r}')
+        if self.value_list:
+            # Nearest seen value; ties go to the smaller one, as in encode_numbers
+            i = bisect.bisect_left(self.value_list, value)
+            if i == len(self.value_list) or (i > 0 and value - self.value_list[i - 1] <= self.value_list[i] - value):
+                i -= 1
+            return self.codes[i]
+        if value.is_integer() and 0 <= value < self.n_codes:
+            return int(value)
+        raise InputError(f'unknown category {value!r}')
+
+
+def to_float(value):
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            word = value.strip().lower()
+            if word in BOOLEAN_WORDS:
+                return float(BOOLEAN_WORDS[word])
+            raise InputError(f'could not convert string to float: {value!r}') from None
+    elif isinstance(value, (int, float, np.number)):
+        number = float(value)
+    else:
+        raise InputError(f'expected a number, got {value!r}')
+    if not math.isfinite(number):
+        raise InputError(f'expected a finite number, got {value!r}')
+    return number
+
+
+_MISSING = object()
+# Below this many records NumPy's per-call overhead outweighs the vectorized conversion
+VECTORIZE_MIN_ROWS = 16
+
+
+class FeatureSchema:
+    """Converts request records to a float64 feature matrix, one column at a time.
+
+    For batches, each column is first converted in a single
+    ``np.array(..., dtype=float64)`` call, which handles numbers and numeric
+    strings in C. Only a column that fails that (missing keys, words such as
+    'male', bad values) is walked value by value, and that walk is what
+    produces the per-field errors. Small inputs such as a single request take
+    the value-by-value path directly.
+    """
+
+    def __init__(self, feature_columns, encoders=None):
+        self.columns = list(feature_columns)
+        self.encoders = {col: CategoryEncoder(classes) for col, classes in (encoders or {}).items()}
+        self.converters = [(col, self.encoders[col].encode if col in self.encoders else to_float)
+                           for col in self.columns]
+
+    def to_array(self, records):
+        """Return ``(X, row_index, errors)``.
+
+        ``X`` is a C-contiguous (n_valid, n_features) float64 array of the valid
+        records, ``row_index`` their positions in ``records``, and ``errors`` a
+        list of ``{'row', 'error', 'fields'}`` for the rest.
+        """
+        n = len(records)
+        if n < VECTORIZE_MIN_ROWS:
+            return self._rows_to_array(records)
+        rows = [r if isinstance(r, dict) else {} for r in records]
+        problems = {i: {'_record': 'must be an object'} for i, r in enumerate(records) if not isinstance(r, dict)}
+
+        X = np.empty((n, len(self.columns)), dtype=np.float64)
+        for j, col in enumerate(self.columns):
+            values = [r.get(col, _MISSING) for r in rows]
+            for i, problem in self._convert_column(col, values, X[:, j]):
+                problems.setdefault(i, {})[col] = problem
+
+        if not problems:
+            return X, list(range(n)), []
+        row_index = [i for i in range(n) if i not in problems]
+        return np.ascontiguousarray(X[row_index]), row_index, self._errors(problems)
+
+    def _rows_to_array(self, records):
+        """Value-by-value conversion, cheaper than NumPy calls for a handful of records."""
+        rows, row_index, problems = [], [], {}
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                problems[i] = {'_record': 'must be an object'}
+                continue
+            row, fields = [], {}
+            for col, convert in self.converters:
+                value = record.get(col, _MISSING)
+                if value is _MISSING:
+                    fields[col] = 'missing'
+                    continue
+                try:
+                    row.append(convert(value))
+                except (InputError, TypeError, ValueError) as e:
+                    fields[col] = str(e)
+            if fields:
+                problems[i] = fields
+            else:
+                rows.append(row)
+                row_index.append(i)
+        X = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.columns))
+        return X, row_index, self._errors(problems)
+
+    def _errors(self, problems):
+        return [{'row': i, 'error': self.describe(problems[i]), 'fields': problems[i]} for i in sorted(problems)]
+
+    def _convert_column(self, col, values, out):
+        encoder = self.encoders.get(col)
+        try:
+            column = np.array(values, dtype=np.float64)
+            if column.shape != out.shape or not np.isfinite(column).all():
+                raise ValueError
+            out[:] = encoder.encode_numbers(column) if encoder else column
+            return []
+        except (TypeError, ValueError):
+            pass
+
+        problems = []
+        convert = encoder.encode if encoder else to_float
+        for i, value in enumerate(values):
+            if value is _MISSING:
+                problems.append((i, 'missing'))
+                continue
+            try:
+                out[i] = convert(value)
+            except (InputError, TypeError, ValueError) as e:
+                problems.append((i, str(e)))
+        return problems
+
+    @staticmethod
+    def describe(fields):
+        if '_record' in fields:
+            return 'Record must be an object'
+        missing = [col for col, problem in fields.items() if problem == 'missing']
+        invalid = [f'{col} ({problem})' for col, problem in fields.items() if problem != 'missing']
+        parts = []
+        if missing:
+            parts.append(f'Missing input fields: {", ".join(missing)}')
+        if invalid:
+            parts.append(f'Invalid numeric input: {", ".join(invalid)}')
+        return '; '.join(parts)
+
+
+class DiseaseModel:
+    """A loaded disease bundle that scores rows with a single predict_proba pass."""
+
+    def __init__(self, name, model, feature_columns=None, threshold=DEFAULT_THRESHOLD,
+                 engine='sklearn', compiled=None, manifest=None):
+        self.name = name
+        self.model = model
+        self.manifest = manifest or {}
+        if manifest:
+            feature_columns = manifest['feature_columns']
+            threshold = manifest.get('threshold')
+        self.feature_columns = feature_columns
+        self.threshold = DEFAULT_THRESHOLD if threshold is None else float(threshold)
+        self.schema = FeatureSchema(feature_columns or [], self.manifest.get('encoders'))
+
+        # ``estimator`` does the scoring: the sklearn model itself or its compiled form
+        self.engine = 'sklearn'
+        self.estimator = model
+        if engine == 'compiled':
+            try:
+                # Bundles written by model_trainer carry the arrays ready-made
+                self.estimator = compiled if compiled is not None else compile_ensemble(model)
+                self.engine = 'compiled'
+            except ValueError as e:
+                logger.warning(f"Compiled engine unavailable for {name}, using sklearn: {e}")
+
+        classes = list(getattr(model, 'classes_', []))
+        self.positive_index = classes.index(POSITIVE_CLASS) if POSITIVE_CLASS in classes else None
+
+        # Lives and dies with this model object, so a reloaded model starts with an empty cache
+        self.cache = TTLCache(f'predictions:{name}', ttl=math.inf, max_size=PREDICTION_CACHE_SIZE)
+
+    @staticmethod
+    def row_key(X):
+        """Hash of a normalized (1, n) feature row."""
+        return hashlib.blake2b(np.ascontiguousarray(X, dtype=np.float64).tobytes(), digest_size=16).digest()
+
+    def encode_record(self, record):
+        """(1, n_features) array for one request record; raises InputError."""
+        X, _, errors = self.schema.to_array([record])
+        if errors:
+            raise InputError(errors[0]['error'], errors[0]['fields'])
+        return X
+
+    def predict_one(self, X):
+        """(label, confidence) for a single encoded row, memoized on the row's bytes."""
+        key = self.row_key(X)
+        result = self.cache.get(key)
+        if result is None:
+            labels, confidences = self.predict(X)
+            result = (int(labels[0]), float(confidences[0]))
+            self.cache.set(key, result)
+        return result
+
+    def predict(self, X):
+        """Return (labels, confidences) for the rows of X.
+
+        Labels are 1 (positive) / 0 (negative). Probabilities are computed once;
+        a row is positive when P(positive) exceeds the bundle threshold, which at
+        0.5 matches sklearn's argmax ``predict``. Confidence is the probability
+        of the returned label.
+        """
+        X = np.asarray(X, dtype=np.float64)
+
+        estimator = self.estimator if len(X) <= COMPILED_MAX_ROWS else self.model
+
+        if not hasattr(estimator, 'predict_proba'):
+            labels = (np.asarray(estimator.predict(X)) == POSITIVE_CLASS).astype(int)
+            return labels, np.ones(len(labels))
+
+        proba = estimator.predict_proba(X)
+        if self.positive_index is None or proba.shape[1] != 2:
+            best = proba.argmax(axis=1)
+            labels = (estimator.classes_[best] == POSITIVE_CLASS).astype(int)
+            return labels, proba[np.arange(len(best)), best]
+
+        p_pos = proba[:, self.positive_index]
+        labels = (p_pos > self.threshold).astype(int)
+        return labels, np.where(labels == 1, p_pos, 1.0 - p_pos)
+
+
+def _shared_encoders(models_dir):
+    path = os.path.join(models_dir, 'label_encoders.pkl')
+    return joblib.load(path) if os.path.exists(path) else {}
+
+
+def fuse_scaler(model, scaler):
+    """Return ``(estimator, how)`` scoring raw features in one step.
+
+    Only older bundles carry a separate scaler; they are scored through a
+    scaler + estimator Pipeline ('pipeline'). ``how`` is None when there is no
+    scaler, as for every bundle model_trainer writes now.
+    """
+    if scaler is None:
+        return model, None
+    return make_pipeline(scaler, model), 'pipeline'
+
+
+def load_model_bundle(name, path, engine='sklearn', mmap_mode=None):
+    """Load and validate a ``{disease}_model.pkl`` bundle as a DiseaseModel.
+
+    ``engine`` is 'sklearn' or 'compiled' (flattened NumPy trees, see tree_engine).
+    With ``mmap_mode='r'`` the NumPy arrays of an uncompressed bundle are mapped
+    from the file rather than copied, so processes loading the same file share
+    them. That only holds for the compiled arrays: sklearn's ``Tree.__setstate__``
+    copies node and value arrays into private memory whatever the mmap mode.
+    Raises ModelArtifactError for bundles that fail validation.
+    """
+    obj = joblib.load(path, mmap_mode=mmap_mode)
+    if hasattr(obj, 'predict'):
+        obj = {'model': obj}
+    if not isinstance(obj, dict):
+        raise ModelArtifactError(f'{name}: unsupported model file format ({type(obj).__name__})')
+
+    manifest = obj.get('manifest')
+    if manifest is None:
+        manifest = legacy_manifest(name, obj, _shared_encoders(os.path.dirname(path)))
+    model = obj.get('model') or obj.get('estimator') or obj.get('clf')
+    validate(name, model, obj.get('scaler'), manifest)
+
+    compiled = obj.get('compiled')
+    # Bundles that still carry a separate scaler are scored through a Pipeline
+    model, fused = fuse_scaler(model, obj.get('scaler'))
+    if fused:
+        compiled = None
+    return DiseaseModel(name, model, engine=engine, compiled=compiled, manifest=manifest)
+
+
+# ---------------- MODEL REGISTRY ----------------
+def _is_mapped(arr):
+    while arr is not None:
+        if isinstance(arr, (np.memmap, mmap.mmap)):
+            return True
+        arr = getattr(arr, 'base', None)
+    return False
+
+
+def _array_bytes(arrays):
+    """(private, mapped) byte counts; memory-mapped arrays are shared between processes."""
+    private = mapped = 0
+    for arr in arrays:
+        if _is_mapped(arr):
+            mapped += arr.nbytes
+        else:
+            private += arr.nbytes
+    return private, mapped
+
+
+def _final_estimator(model):
+    """The estimator itself, or the last step of a (scaler + estimator) Pipeline."""
+    steps = getattr(model, 'steps', None)
+    return steps[-1][1] if steps else model
+
+
+def model_footprint(model):
+    """Approximate in-memory size of a DiseaseModel's tree arrays as (private, mapped) bytes.
+
+    sklearn trees are always private (their arrays are copies, see
+    load_model_bundle); only a compiled estimator's arrays can be mapped.
+    """
+    arrays = []
+    estimators = np.ravel(getattr(_final_estimator(model.model), 'estimators_', []))
+    for est in estimators:
+        tree = getattr(est, 'tree_', None)
+        if tree is not None:
+            state = tree.__getstate__()
+            arrays.extend([state['nodes'], state['values']])
+    if model.estimator is not model.model:
+        arrays.extend(v for v in vars(model.estimator).values() if isinstance(v, np.ndarray))
+    return _array_bytes(arrays)
+
+
+class ModelRegistry:
+    """Disease models loaded on first use and hot-swapped when their file changes.
+
+    Bundles are loaded with ``mmap_mode='r'``: with the compiled engine, worker
+    processes share the pages of the tree arrays; the sklearn engine keeps a
+    private copy per process (see ``private_bytes``/``mapped_bytes`` in
+    ``status()``). A daemon thread polls the files of loaded models every
+    ``watch_interval`` seconds; a changed file is loaded in full before it
+    replaces the old model, so requests only ever see a complete model. Writers
+    must replace files atomically (write a temporary file, then ``os.replace``),
+    as model_trainer does: rewriting a mapped file in place would change the
+    arrays under a live model.
+    """
+
+    def __init__(self, models_dir, engine='sklearn', watch_interval=5.0, mmap_mode='r'):
+        self.models_dir = models_dir
+        self.engine = engine
+        self.watch_interval = watch_interval
+        self.mmap_mode = mmap_mode
+        self._models = {}         # name -> DiseaseModel
+        self._info = {}           # name -> load metadata
+        self._failed = {}         # name -> file signature that failed to load
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in DISEASES}
+        self._watcher = None
+        self._pid = None
+
+    def path(self, name):
+        return os.path.join(self.models_dir, f'{name}_model.pkl')
+
+    def _signature(self, name):
+        try:
+            st = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get(self, name):
+        """Return the DiseaseModel for ``name``, loading it on first use (None if unavailable)."""
+        self._ensure_watcher()
+        model = self._models.get(name)
+        if model is not None or name not in self._load_locks:
+            return model
+        with self._load_locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                model = self._load(name)
+        return model
+
+    def _load(self, name):
+        signature = self._signature(name)
+        if signature is None:
+            logger.warning(f"⚠️ Model not found for: {name}")
+            return None
+        if self._failed.get(name) == signature:
+            return None
+
+        start = time.perf_counter()
+        try:
+            model = load_model_bundle(name, self.path(name), engine=self.engine, mmap_mode=self.mmap_mode)
+        except Exception as e:
+            logger.error(f"Failed to load model {name}: {e}")
+            model = None
+        if model is None:
+            self._failed[name] = signature
+            return None
+        elapsed = time.perf_counter() - start
+
+        private, mapped = model_footprint(model)
+        info = {
+            'engine': model.engine,
+            'format_version': model.manifest.get('format_version'),
+            'metrics': model.manifest.get('metrics', {}),
+            'load_ms': round(elapsed * 1000, 1),
+            'private_bytes': private,
+            'mapped_bytes': mapped,
+            'file_bytes': signature[2],
+            'loaded_at': time.time(),
+            'signature': signature,
+        }
+        with self._lock:
+            # Single reference swap: readers see either the old or the new model
+            self._models[name] = model
+            self._info[name] = info
+        self._failed.pop(name, None)
+        logger.info(f"✅ Loaded model: {name} ({model.engine}, {info['load_ms']} ms)")
+        return model
+
+    def reload_changed(self):
+        """Reload every loaded model whose file changed; returns the reloaded names."""
+        reloaded = []
+        for name in list(self._models):
+            signature = self._signature(name)
+            if signature is None or signature == self._info[name]['signature'] or signature == self._failed.get(name):
+                continue
+            with self._load_locks[name]:
+                if self._load(name) is not None:
+                    reloaded.append(name)
+        return reloaded
+
+    def _ensure_watcher(self):
+        if not self.watch_interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive fork(); each worker process runs its own watcher
+            self._pid = os.getpid()
+            self._watcher = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                self.reload_changed()
+            except Exception as e:
+                logger.error(f"Model watcher error: {e}")
+
+    def available(self):
+        """Names with a model file on disk (loaded or not)."""
+        return [name for name in DISEASES if self._signature(name) is not None]
+
+    def cache_stats(self):
+        with self._lock:
+            loaded = list(self._models.items())
+        return {name: model.cache.stats() for name, model in loaded}
+
+    def status(self):
+        with self._lock:
+            info = {name: {k: v for k, v in meta.items() if k != 'signature'}
+                    for name, meta in self._info.items()}
+        for name in self.available():
+            info.setdefault(name, {'loaded': False})
+            info[name].setdefault('loaded', True)
+        return info
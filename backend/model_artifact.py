@@ -0,0 +1,140 @@
+# backend/model_artifact.py
+"""Versioned model bundle format.
+
+A bundle written by model_trainer is a dict::
+
+    {'format_version': 2, 'model': ..., 'scaler': None, 'compiled': ..., 'manifest': {...}}
+
+The manifest records everything the server needs to score a request without
+guessing: feature order and dtypes, categorical encoder mappings, the decision
+threshold, and provenance (training data hash, metrics, library versions).
+The model scores raw features: the trees are trained without a scaler, so
+``scaler`` is None. Bundles that still carry a fitted scaler, including
+pre-manifest ones (``model``/``scaler``/``features`` plus a shared
+``label_encoders.pkl``, read through ``legacy_manifest``), are wrapped into a
+scaler + estimator Pipeline at load.
+"""
+import hashlib
+import platform
+from datetime import datetime
+
+import numpy as np
+import sklearn
+
+FORMAT_VERSION = 2
+SUPPORTED_FORMATS = (1, 2)
+
+
+class ModelArtifactError(Exception):
+    """A model bundle is malformed or inconsistent with its manifest."""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encoder_classes(encoder):
+    """Labels of a fitted LabelEncoder in code order (code i <-> classes[i])."""
+    return [str(c) for c in encoder.classes_]
+
+
+def build_manifest(name, model, feature_columns, encoders=None, threshold=0.5,
+                   dataset_path=None, dataset_rows=None, metrics=None, scaler=None,
+                   dataset_sha256=None, params=None, search=None):
+    """``scaler`` records how feature scaling was fused into the estimator
+    ('pipeline'), or None if the model was trained on raw features.
+    ``params`` are the training settings model_trainer compares to decide
+    whether a bundle is up to date; ``search`` is its hyperparameter search
+    record (accuracy/latency Pareto front and the selected point), if any."""
+    encoders = encoders or {}
+    return {
+        'format_version': FORMAT_VERSION,
+        'name': name,
+        'estimator': type(model).__name__,
+        'classes': [int(c) if isinstance(c, (int, np.integer)) else str(c) for c in model.classes_],
+        'feature_columns': list(feature_columns),
+        'dtypes': {col: 'category' if col in encoders else 'float64' for col in feature_columns},
+        'encoders': {col: encoder_classes(enc) for col, enc in encoders.items()},
+        'threshold': float(threshold),
+        'scaler': scaler,
+        'training_data': {
+            'path': dataset_path,
+            'sha256': dataset_sha256 or (file_sha256(dataset_path) if dataset_path else None),
+            'rows': dataset_rows,
+        },
+        'metrics': dict(metrics or {}),
+        'params': dict(params or {}),
+        'search': search,
+        'versions': {
+            'sklearn': sklearn.__version__,
+            'numpy': np.__version__,
+            'python': platform.python_version(),
+        },
+        'trained_at': datetime.utcnow().isoformat(),
+    }
+
+
+def legacy_manifest(name, bundle, shared_encoders=None):
+    """Manifest for a pre-manifest bundle; encoders come from label_encoders.pkl
+    entries named ``{disease}_{column}``."""
+    model = bundle.get('model') or bundle.get('estimator') or bundle.get('clf')
+    features = bundle.get('feature_columns') or bundle.get('features') or bundle.get('columns')
+    if features is None and hasattr(model, 'feature_names_in_'):
+        features = list(model.feature_names_in_)
+    if model is None or not features:
+        raise ModelArtifactError(f'{name}: legacy bundle has no model or no feature list')
+
+    # Keys are "{disease}_{column}"; liver's was saved lower-cased as liver_gender
+    by_key = {f'{name}_{col}'.lower(): col for col in features}
+    encoders = {by_key[key.lower()]: encoder_classes(enc)
+                for key, enc in (shared_encoders or {}).items() if key.lower() in by_key}
+
+    return {
+        'format_version': 1,
+        'name': name,
+        'estimator': type(model).__name__,
+        'classes': [c.item() if hasattr(c, 'item') else c for c in getattr(model, 'classes_', [])],
+        'feature_columns': list(features),
+        'dtypes': {col: 'category' if col in encoders else 'float64' for col in features},
+        'encoders': encoders,
+        'threshold': bundle.get('threshold'),
+        'training_data': {},
+        'metrics': {},
+        'versions': {},
+    }
+
+
+def validate(name, model, scaler, manifest):
+    """Check a bundle against its manifest; raises ModelArtifactError."""
+    version = manifest.get('format_version')
+    if version not in SUPPORTED_FORMATS:
+        raise ModelArtifactError(f'{name}: unsupported bundle format {version}')
+    if model is None or not hasattr(model, 'predict'):
+        raise ModelArtifactError(f'{name}: bundle has no estimator')
+
+    features = manifest.get('feature_columns') or []
+    if not features:
+        raise ModelArtifactError(f'{name}: manifest has no feature list')
+    n_model = getattr(model, 'n_features_in_', len(features))
+    if n_model != len(features):
+        raise ModelArtifactError(f'{name}: model expects {n_model} features, manifest lists {len(features)}')
+    if scaler is not None and getattr(scaler, 'n_features_in_', len(features)) != len(features):
+        raise ModelArtifactError(f'{name}: scaler expects {scaler.n_features_in_} features, '
+                                 f'manifest lists {len(features)}')
+    unknown = set(manifest.get('encoders', {})) - set(features)
+    if unknown:
+        raise ModelArtifactError(f'{name}: encoders for unknown features: {", ".join(sorted(unknown))}')
+    for col, dtype in manifest.get('dtypes', {}).items():
+        if dtype not in ('float64', 'category'):
+            raise ModelArtifactError(f'{name}: unsupported dtype {dtype!r} for {col}')
+
+    trained_with = manifest.get('versions', {}).get('sklearn')
+    if trained_with and trained_with.split('.')[:2] != sklearn.__version__.split('.')[:2]:
+        # Pickled estimators are only guaranteed to load on the same minor release
+        raise ModelArtifactError(f'{name}: trained with scikit-learn {trained_with}, '
+                                 f'running {sklearn.__version__}')
+    return manifest
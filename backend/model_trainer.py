@@ -1,214 +1,553 @@
+import argparse
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 import numpy as np
 import joblib
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+import sklearn
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401  (enables HalvingRandomSearchCV)
+from sklearn.model_selection import HalvingRandomSearchCV, StratifiedKFold, cross_val_score, train_test_split
+from sklearn.preprocessing import LabelEncoder
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.metrics import accuracy_score
 
+from inference import DEFAULT_THRESHOLD
+from model_artifact import build_manifest, file_sha256
+from tree_engine import compile_ensemble
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASETS_DIR = os.path.join(BASE_DIR, 'datasets')
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+# Parsed, encoded datasets keyed by CSV hash; safe to delete
+CACHE_DIR = os.path.join(DATASETS_DIR, '.cache')
+
+TEST_SIZE = 0.2
+SPLIT_SEED = 42
+
+ESTIMATORS = {
+    'random_forest': RandomForestClassifier,
+    'gradient_boosting': GradientBoostingClassifier,
+}
+
+DISEASE_SPECS = {
+    'diabetes': {
+        'title': 'Diabetes',
+        'dataset': 'diabetes.csv',
+        'features': ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness',
+                     'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age'],
+        'target': 'Outcome',
+        'estimator': 'random_forest',
+        'params': {'n_estimators': 100, 'random_state': 42},
+    },
+    'heart': {
+        'title': 'Heart Disease',
+        'dataset': 'heart.csv',
+        'features': ['age', 'sex', 'cp', 'trtbps', 'chol', 'fbs', 'restecg',
+                     'thalachh', 'exng', 'oldpeak', 'slp', 'caa', 'thall'],
+        'target': 'output',
+        'estimator': 'gradient_boosting',
+        'params': {'n_estimators': 120, 'random_state': 42},
+    },
+    'liver': {
+        'title': 'Liver Disease',
+        'dataset': 'liver.csv',
+        'features': ['Age', 'Gender', 'Total_Bilirubin', 'Direct_Bilirubin',
+                     'Alkaline_Phosphotase', 'Alamine_Aminotransferase',
+                     'Aspartate_Aminotransferase', 'Total_Protiens', 'Albumin',
+                     'Albumin_and_Globulin_Ratio'],
+        'target': 'Dataset',
+        'estimator': 'random_forest',
+        'params': {'n_estimators': 120, 'random_state': 42},
+    },
+    'kidney': {
+        'title': 'Kidney Disease',
+        'dataset': 'kidney.csv',
+        'features': ['age', 'bp', 'sg', 'al', 'su', 'bgr', 'bu', 'sc',
+                     'sod', 'pot', 'hemo', 'pcv', 'wc', 'rc'],
+        'target': 'classification',
+        'estimator': 'random_forest',
+        'params': {'n_estimators': 120, 'random_state': 42},
+    },
+}
+
+
+# Search mode: successive-halving random search over these grids, then the best
+# candidates are refitted and timed so accuracy can be traded against latency
+SEARCH_SPACES = {
+    'random_forest': {
+        'n_estimators': [25, 50, 100, 150, 200],
+        'max_depth': [None, 6, 10, 16],
+        'min_samples_leaf': [1, 2, 4, 8],
+        'max_features': ['sqrt', 0.5],
+    },
+    'gradient_boosting': {
+        'n_estimators': [30, 60, 120, 200],
+        'max_depth': [2, 3, 4],
+        'learning_rate': [0.05, 0.1, 0.2],
+        'min_samples_leaf': [1, 5],
+    },
+}
+SEARCH = {
+    'cv_folds': 5,
+    'candidates': 48,      # sampled configurations in the first halving round
+    'factor': 3,           # each round keeps 1/factor of them on factor x the samples
+    'finalists': 8,        # survivors refitted on the full training split and timed
+    'tolerance': 0.01,     # accept up to this much CV accuracy for a faster model
+    'seed': 42,
+}
+
+
+def atomic_dump(obj, path):
+    """joblib.dump (uncompressed, so it can be memory-mapped) via a temp file and
+    os.replace, so a running server never reads a half-written bundle."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        joblib.dump(obj, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def training_params(disease, search=False):
+    """Everything besides the data that determines a disease's model."""
+    spec = DISEASE_SPECS[disease]
+    params = {
+        'estimator': spec['estimator'],
+        'params': spec['params'],
+        'features': spec['features'],
+        'target': spec['target'],
+        'test_size': TEST_SIZE,
+        'split_seed': SPLIT_SEED,
+    }
+    if search:
+        params['search'] = dict(SEARCH, space=SEARCH_SPACES[spec['estimator']])
+    return params
+
+
+# ---------------------- SEARCH HELPERS ----------------------
+def model_shape(model):
+    """Tree count, deepest tree and total leaves: what single-row latency scales with."""
+    trees = [est.tree_ for est in np.ravel(model.estimators_)]
+    return {
+        'trees': len(trees),
+        'max_depth': int(max(tree.max_depth for tree in trees)),
+        'leaves': int(sum(tree.n_leaves for tree in trees)),
+    }
+
+
+def measure_latency(predict, row, repeat=50):
+    """Median milliseconds of ``predict(row)`` for a single row."""
+    predict(row)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predict(row)
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples) * 1000)
+
+
+def pareto_front(points):
+    """Points no other point beats on both CV accuracy and latency, fastest first."""
+    front = []
+    for point in sorted(points, key=lambda p: (p['latency_ms'], -p['cv_accuracy'])):
+        if not front or point['cv_accuracy'] > front[-1]['cv_accuracy']:
+            front.append(point)
+    return front
+
+
+# ---------------------- DATASETS ----------------------
+def _label_encoder(classes):
+    enc = LabelEncoder()
+    enc.classes_ = classes.astype(object)
+    return enc
+
+
+def _parse_dataset(disease, path):
+    """Feature matrix, target and fitted LabelEncoders (keyed "{disease}_{column}")."""
+    spec = DISEASE_SPECS[disease]
+    df = pd.read_csv(path)
+    X = df[spec['features']].copy()
+    y = df[spec['target']]
+
+    encoders = {}
+    for col in X.columns:
+        if X[col].dtype == 'object':
+            enc = LabelEncoder()
+            X[col] = enc.fit_transform(X[col].astype(str))
+            # Lower-cased, which is how liver's was always saved (liver_gender)
+            encoders[f'{disease}_{col}'.lower()] = enc
+
+    if y.dtype == 'object':
+        enc = LabelEncoder()
+        y = enc.fit_transform(y.astype(str))
+        encoders[f'{disease}_target'] = enc
+
+    X = X.fillna(X.mean())
+    return X.to_numpy(dtype=np.float64), np.asarray(y), encoders
+
+
+def load_dataset(disease, datasets_dir=DATASETS_DIR, cache_dir=CACHE_DIR):
+    """Return ``(X, y, encoders, sha256, cached)`` for a disease.
+
+    The parsed arrays are cached as ``.npz`` under a key derived from the CSV's
+    hash and the feature/target columns, so re-runs skip pandas entirely.
+    """
+    spec = DISEASE_SPECS[disease]
+    path = os.path.join(datasets_dir, spec['dataset'])
+    digest = file_sha256(path)
+    key = hashlib.sha256(json.dumps([digest, spec['features'], spec['target']]).encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f'{disease}-{key}.npz') if cache_dir else None
+
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as data:
+            encoders = {name[len('enc__'):]: _label_encoder(data[name])
+                        for name in data.files if name.startswith('enc__')}
+            return data['X'], data['y'], encoders, digest, True
+
+    X, y, encoders = _parse_dataset(disease, path)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.startswith(f'{disease}-') and name.endswith('.npz'):
+                os.remove(os.path.join(cache_dir, name))
+        tmp_path = f'{cache_path}.tmp{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, X=X, y=y, **{f'enc__{name}': enc.classes_.astype(str) for name, enc in encoders.items()})
+        os.replace(tmp_path, cache_path)
+    return X, y, encoders, digest, False
+
+
 class MultiDiseasePredictor:
-    def __init__(self):
+    def __init__(self, thresholds=None, datasets_dir=DATASETS_DIR, models_dir=MODELS_DIR,
+                 cache_dir=CACHE_DIR, n_jobs=None):
         self.models = {}
         self.label_encoders = {}
-
-    # ---------------------- DIABETES MODEL ----------------------
-    def train_diabetes_model(self):
-        print("\n🔧 Training Diabetes Model...")
+        # Per-disease decision threshold on P(positive), saved into each bundle
+        self.thresholds = thresholds or {}
+        self.datasets_dir = datasets_dir
+        self.models_dir = models_dir
+        self.cache_dir = cache_dir
+        self.n_jobs = n_jobs
+
+    def _feature_encoders(self, disease, feature_columns):
+        """LabelEncoders fitted on this disease's input columns, keyed by column."""
+        # Keys are "{disease}_{column}", with the column lower-cased for liver_gender
+        by_key = {f"{disease}_{col}".lower(): col for col in feature_columns}
+        return {by_key[key.lower()]: enc for key, enc in self.label_encoders.items() if key.lower() in by_key}
+
+    # ---------------------- TRAINING ----------------------
+    def _fit(self, model, X, y):
+        parallel = 'n_jobs' in model.get_params()
+        if parallel:
+            model.set_params(n_jobs=self.n_jobs)
+        model.fit(X, y)
+        if parallel:
+            # The server scores a few rows per call, where a worker pool only adds overhead
+            model.set_params(n_jobs=None)
+        return model
+
+    def train(self, disease, search=False):
+        spec = DISEASE_SPECS[disease]
+        print(f"\n🔧 Training {spec['title']} Model{' (search)' if search else ''}...")
         try:
-            df = pd.read_csv('datasets/diabetes.csv')
-            feature_columns = [
-                'Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness',
-                'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age'
-            ]
-            target_column = 'Outcome'
-
-            X = df[feature_columns].fillna(df[feature_columns].mean())
-            y = df[target_column]
+            started = time.perf_counter()
+            X, y, encoders, digest, cached = load_dataset(disease, self.datasets_dir, self.cache_dir)
+            self.label_encoders.update(encoders)
+            loaded = time.perf_counter()
 
+            # Tree ensembles only compare features against thresholds, so they are
+            # trained on raw features and need no scaler at inference
             X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42)
+                X, y, test_size=TEST_SIZE, random_state=SPLIT_SEED)
 
-            scaler = StandardScaler()
-            X_train = scaler.fit_transform(X_train)
-            X_test = scaler.transform(X_test)
-
-            model = RandomForestClassifier(n_estimators=100, random_state=42)
-            model.fit(X_train, y_train)
+            search_record = None
+            if search:
+                model, search_record = self.search(disease, X_train, y_train, X_test, y_test)
+            else:
+                model = self._fit(ESTIMATORS[spec['estimator']](**spec['params']), X_train, y_train)
 
             acc = accuracy_score(y_test, model.predict(X_test))
-            print(f"✅ Diabetes Accuracy: {acc * 100:.2f}%")
+            print(f"✅ {spec['title']} Accuracy: {acc * 100:.2f}%")
 
-            self.models['diabetes'] = {
+            metrics = {'accuracy': float(acc)}
+            if search_record:
+                metrics['cv_accuracy'] = search_record['selected']['cv_accuracy']
+            self.models[disease] = {
                 'model': model,
-                'scaler': scaler,
-                'features': feature_columns
+                'features': spec['features'],
+                'encoders': self._feature_encoders(disease, spec['features']),
+                'dataset': os.path.relpath(os.path.join(self.datasets_dir, spec['dataset']), BASE_DIR),
+                'dataset_sha256': digest,
+                'rows': len(X),
+                'params': training_params(disease, search),
+                'metrics': metrics,
+                'search': search_record,
+                'timings': {'load': loaded - started, 'fit': time.perf_counter() - loaded, 'cached': cached},
             }
             return True
         except Exception as e:
-            print("❌ Diabetes Model Failed:", e)
+            print(f"❌ {spec['title']} Model Failed:", e)
             return False
 
-    # ---------------------- HEART MODEL ----------------------
-    def train_heart_model(self):
-        print("\n🔧 Training Heart Disease Model...")
-        try:
-            df = pd.read_csv('datasets/heart.csv')
-            feature_columns = [
-                'age', 'sex', 'cp', 'trtbps', 'chol', 'fbs', 'restecg',
-                'thalachh', 'exng', 'oldpeak', 'slp', 'caa', 'thall'
-            ]
-            target_column = 'output'
+    def search(self, disease, X_train, y_train, X_test, y_test):
+        """Pick hyperparameters by CV accuracy and measured single-row latency.
+
+        Successive halving (HalvingRandomSearchCV) screens SEARCH['candidates']
+        random configurations on growing subsets of the training split. The
+        survivors, plus the fixed configuration from DISEASE_SPECS as a
+        baseline, get a full cross-validation score and are refitted and
+        timed. Returns the fastest model on the accuracy/latency Pareto front
+        whose CV accuracy is within SEARCH['tolerance'] of the best, and a
+        record of the front for the manifest.
+        """
+        spec = DISEASE_SPECS[disease]
+        estimator = ESTIMATORS[spec['estimator']]
+        seed = SEARCH['seed']
+        cv = StratifiedKFold(SEARCH['cv_folds'], shuffle=True, random_state=seed)
+
+        halving = HalvingRandomSearchCV(
+            estimator(random_state=seed), SEARCH_SPACES[spec['estimator']],
+            n_candidates=SEARCH['candidates'], factor=SEARCH['factor'], cv=cv,
+            scoring='accuracy', refit=False, random_state=seed, n_jobs=self.n_jobs)
+        halving.fit(X_train, y_train)
+
+        # Later rounds saw more data, so rank by (round reached, score)
+        results = halving.cv_results_
+        ranked = sorted(range(len(results['params'])),
+                        key=lambda i: (results['iter'][i], results['mean_test_score'][i]), reverse=True)
+        finalists = [dict(spec['params'])]
+        for i in ranked:
+            if len(finalists) > SEARCH['finalists']:
+                break
+            params = dict(results['params'][i], random_state=seed)
+            if params not in finalists:
+                finalists.append(params)
+
+        row = X_test[:1]
+        points = []
+        for params in finalists:
+            cv_scores = cross_val_score(estimator(**params), X_train, y_train, cv=cv,
+                                        scoring='accuracy', n_jobs=self.n_jobs)
+            model = self._fit(estimator(**params), X_train, y_train)
+            compiled = compile_ensemble(model)
+            points.append({
+                'params': params,
+                'cv_accuracy': round(float(cv_scores.mean()), 4),
+                'test_accuracy': round(float(accuracy_score(y_test, model.predict(X_test))), 4),
+                'latency_ms': round(measure_latency(model.predict_proba, row), 3),
+                'compiled_latency_ms': round(measure_latency(compiled.predict_proba, row), 3),
+                **model_shape(model),
+                'model': model,
+            })
+
+        front = pareto_front(points)
+        best = max(p['cv_accuracy'] for p in points)
+        selected = next(p for p in front if p['cv_accuracy'] >= best - SEARCH['tolerance'])
+
+        print(f"🔎 {spec['title']}: {len(results['params'])} fits over {halving.n_iterations_} halving rounds, "
+              f"{len(front)} of {len(points)} finalists on the Pareto front")
+        for point in front:
+            mark = '→' if point is selected else ' '
+            print(f"   {mark} cv {point['cv_accuracy']:.3f}  {point['latency_ms']:7.3f} ms  "
+                  f"{point['trees']:>3} trees, depth {point['max_depth']:>2}, {point['leaves']:>6} leaves")
+
+        def describe(point):
+            return {k: v for k, v in point.items() if k != 'model'}
+
+        record = {
+            'method': 'halving_random_search',
+            'fits': len(results['params']),
+            'rounds': int(halving.n_iterations_),
+            'tolerance': SEARCH['tolerance'],
+            'baseline': describe(points[0]),
+            'front': [describe(p) for p in front],
+            'selected': describe(selected),
+        }
+        return selected['model'], record
 
-            X = df[feature_columns].fillna(df[feature_columns].mean())
-            y = df[target_column]
+    def train_diabetes_model(self):
+        return self.train('diabetes')
 
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42)
+    def train_heart_model(self):
+        return self.train('heart')
 
-            scaler = StandardScaler()
-            X_train = scaler.fit_transform(X_train)
-            X_test = scaler.transform(X_test)
+    def train_liver_model(self):
+        return self.train('liver')
 
-            model = GradientBoostingClassifier(n_estimators=120, random_state=42)
-            model.fit(X_train, y_train)
+    def train_kidney_model(self):
+        return self.train('kidney')
 
-            acc = accuracy_score(y_test, model.predict(X_test))
-            print(f"✅ Heart Model Accuracy: {acc * 100:.2f}%")
+    def is_up_to_date(self, disease, search=False):
+        """True when the saved bundle was trained on the current data and settings.
 
-            self.models['heart'] = {
-                'model': model,
-                'scaler': scaler,
-                'features': feature_columns
-            }
-            return True
-        except Exception as e:
-            print("❌ Heart Model Failed:", e)
+        A bundle from a ``search`` run also satisfies a plain run, so the
+        searched hyperparameters are only replaced with ``force``.
+        """
+        path = os.path.join(self.models_dir, f'{disease}_model.pkl')
+        if not os.path.exists(path):
             return False
-
-    # ---------------------- LIVER MODEL ----------------------
-    def train_liver_model(self):
-        print("\n🔧 Training Liver Disease Model...")
         try:
-            df = pd.read_csv('datasets/liver.csv')
-            feature_columns = [
-                'Age', 'Gender', 'Total_Bilirubin', 'Direct_Bilirubin',
-                'Alkaline_Phosphotase', 'Alamine_Aminotransferase',
-                'Aspartate_Aminotransferase', 'Total_Protiens', 'Albumin',
-                'Albumin_and_Globulin_Ratio'
-            ]
-            target_column = 'Dataset'
-
-            X = df[feature_columns].copy()
-            y = df[target_column]
-
-            if 'Gender' in X.columns:
-                enc = LabelEncoder()
-                X['Gender'] = enc.fit_transform(X['Gender'])
-                self.label_encoders['liver_gender'] = enc
-
-            X = X.fillna(X.mean())
-
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42)
-
-            scaler = StandardScaler()
-            X_train = scaler.fit_transform(X_train)
-            X_test = scaler.transform(X_test)
-
-            model = RandomForestClassifier(n_estimators=120, random_state=42)
-            model.fit(X_train, y_train)
-
-            acc = accuracy_score(y_test, model.predict(X_test))
-            print(f"✅ Liver Model Accuracy: {acc * 100:.2f}%")
-
-            self.models['liver'] = {
-                'model': model,
-                'scaler': scaler,
-                'features': feature_columns
-            }
-            return True
-        except Exception as e:
-            print("❌ Liver Model Failed:", e)
+            bundle = joblib.load(path, mmap_mode='r')
+        except Exception:
             return False
-
-    # ---------------------- KIDNEY MODEL ----------------------
-    def train_kidney_model(self):
-        print("\n🔧 Training Kidney Disease Model...")
+        manifest = bundle.get('manifest') if isinstance(bundle, dict) else None
+        if not manifest:
+            return False
+        dataset = os.path.join(self.datasets_dir, DISEASE_SPECS[disease]['dataset'])
+        accepted = [training_params(disease, search)] + ([] if search else [training_params(disease, True)])
+        return (manifest.get('params') in accepted
+                and manifest.get('scaler') is None        # older bundles were trained on scaled features
+                and manifest.get('training_data', {}).get('sha256') == file_sha256(dataset)
+                and manifest.get('threshold') == float(self.thresholds.get(disease, DEFAULT_THRESHOLD))
+                and manifest.get('versions', {}).get('sklearn') == sklearn.__version__)
+
+    def has_search(self, disease):
+        """True when the saved bundle's hyperparameters came from a search run."""
         try:
-            df = pd.read_csv('datasets/kidney.csv')
-            feature_columns = [
-                'age', 'bp', 'sg', 'al', 'su', 'bgr', 'bu', 'sc',
-                'sod', 'pot', 'hemo', 'pcv', 'wc', 'rc'
-            ]
-            target_column = 'classification'
-
-            X = df[feature_columns].copy()
-            y = df[target_column]
-
-            for col in X.columns:
-                if X[col].dtype == 'object':
-                    enc = LabelEncoder()
-                    X[col] = enc.fit_transform(X[col].astype(str))
-                    self.label_encoders[f'kidney_{col}'] = enc
-
-            if y.dtype == 'object':
-                enc_t = LabelEncoder()
-                y = enc_t.fit_transform(y)
-                self.label_encoders['kidney_target'] = enc_t
-
-            X = X.fillna(X.mean())
-
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42)
-
-            scaler = StandardScaler()
-            X_train = scaler.fit_transform(X_train)
-            X_test = scaler.transform(X_test)
-
-            model = RandomForestClassifier(n_estimators=120, random_state=42)
-            model.fit(X_train, y_train)
-
-            acc = accuracy_score(y_test, model.predict(X_test))
-            print(f"✅ Kidney Model Accuracy: {acc * 100:.2f}%")
-
-            self.models['kidney'] = {
-                'model': model,
-                'scaler': scaler,
-                'features': feature_columns
-            }
-            return True
-        except Exception as e:
-            print("❌ Kidney Model Failed:", e)
+            bundle = joblib.load(os.path.join(self.models_dir, f'{disease}_model.pkl'), mmap_mode='r')
+        except Exception:
             return False
+        manifest = bundle.get('manifest') if isinstance(bundle, dict) else None
+        return bool(manifest and manifest.get('search'))
 
-     
+    # ---------------------- SAVING ----------------------
     def save_models(self):
-        os.makedirs("models", exist_ok=True)
+        os.makedirs(self.models_dir, exist_ok=True)
         for name, model_data in self.models.items():
-            joblib.dump(model_data, f"models/{name}_model.pkl")
+            started = time.perf_counter()
+            model = model_data['model']
+            manifest = build_manifest(
+                name, model, model_data['features'],
+                encoders=model_data.get('encoders'),
+                threshold=self.thresholds.get(name, DEFAULT_THRESHOLD),
+                dataset_path=model_data.get('dataset'),
+                dataset_sha256=model_data.get('dataset_sha256'),
+                dataset_rows=model_data.get('rows'),
+                metrics=model_data.get('metrics'),
+                params=model_data.get('params'),
+                search=model_data.get('search'),
+            )
+            bundle = {
+                'format_version': manifest['format_version'],
+                'manifest': manifest,
+                'model': model,
+                'scaler': None,
+            }
+            try:
+                # Flat arrays for the compiled engine; memory-mapped by the server
+                bundle['compiled'] = compile_ensemble(model)
+            except ValueError:
+                pass
+            atomic_dump(bundle, os.path.join(self.models_dir, f"{name}_model.pkl"))
+            model_data.setdefault('timings', {})['save'] = time.perf_counter() - started
             print(f"📌 Saved {name} model")
 
         if self.label_encoders:
-            joblib.dump(self.label_encoders, "models/label_encoders.pkl")
+            # Keep the encoders of diseases that were not retrained this run
+            path = os.path.join(self.models_dir, "label_encoders.pkl")
+            encoders = joblib.load(path) if os.path.exists(path) else {}
+            encoders.update(self.label_encoders)
+            atomic_dump(encoders, path)
             print("📌 Saved label encoders")
 
-def main():
-    trainer = MultiDiseasePredictor()
-    results = {
-        "Diabetes": trainer.train_diabetes_model(),
-        "Heart": trainer.train_heart_model(),
-        "Liver": trainer.train_liver_model(),
-        "Kidney": trainer.train_kidney_model(),
-    }
+
+def _train_job(disease, datasets_dir, cache_dir, n_jobs, search=False):
+    """Process-pool entry point: train one disease, return its model data and encoders."""
+    trainer = MultiDiseasePredictor(datasets_dir=datasets_dir, cache_dir=cache_dir, n_jobs=n_jobs)
+    ok = trainer.train(disease, search)
+    return ok, trainer.models.get(disease), trainer.label_encoders
+
+
+def train_all(diseases=None, workers=None, n_jobs=None, force=False, use_cache=True, thresholds=None,
+              search=False):
+    """Train the given diseases (default: all) in parallel and save their bundles.
+
+    Diseases whose saved bundle matches the current data and settings are
+    skipped unless ``force``. Each worker process gets ``n_jobs`` cores for its
+    forest (default: an even share of the CPUs). With ``search`` the
+    hyperparameters are chosen by ``MultiDiseasePredictor.search``; diseases
+    then run one at a time by default so the latency timings do not compete
+    for CPU. Returns {disease: status}.
+    """
+    trainer = MultiDiseasePredictor(thresholds=thresholds, cache_dir=CACHE_DIR if use_cache else None)
+    diseases = diseases or list(DISEASE_SPECS)
+    started = time.perf_counter()
+
+    results = {}
+    todo = []
+    for disease in diseases:
+        if not force and trainer.is_up_to_date(disease, search):
+            results[disease] = 'skipped'
+            if not search and trainer.has_search(disease):
+                print(f"ℹ️ {disease}: keeping the model from the last --search run (use --force to retrain with defaults)")
+        else:
+            todo.append(disease)
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(len(todo), workers or (1 if search else cpus)))
+    n_jobs = n_jobs or max(1, cpus // workers)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_train_job, disease, trainer.datasets_dir, trainer.cache_dir, n_jobs,
+                                   search): disease
+                       for disease in todo}
+            for future in as_completed(futures):
+                disease = futures[future]
+                ok, model_data, encoders = future.result()
+                results[disease] = 'trained' if ok else 'failed'
+                if ok:
+                    trainer.models[disease] = model_data
+                    trainer.label_encoders.update(encoders)
+    else:
+        trainer.n_jobs = n_jobs
+        for disease in todo:
+            results[disease] = 'trained' if trainer.train(disease, search) else 'failed'
 
     trainer.save_models()
+    total = time.perf_counter() - started
 
     print("\n================ TRAINING SUMMARY ================")
-    for disease, status in results.items():
-        print(f"{disease}: {'✅ SUCCESS' if status else '❌ FAILED'}")
+    for disease in diseases:
+        title = DISEASE_SPECS[disease]['title']
+        status = results[disease]
+        if status == 'skipped':
+            print(f"{title}: ⏭️  UP TO DATE (data and settings unchanged)")
+        elif status == 'failed':
+            print(f"{title}: ❌ FAILED")
+        else:
+            t = trainer.models[disease]['timings']
+            print(f"{title}: ✅ SUCCESS  load {t['load']:.2f}s{' (cached)' if t['cached'] else ''}, "
+                  f"fit {t['fit']:.2f}s, save {t.get('save', 0.0):.2f}s")
+    print(f"⏱  Total wall time: {total:.2f}s ({workers} worker{'s' if workers > 1 else ''}, n_jobs={n_jobs})")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the disease models into backend/models.")
+    parser.add_argument('diseases', nargs='*', help=f"any of {', '.join(DISEASE_SPECS)} (default: all)")
+    parser.add_argument('--workers', type=int, help="parallel training processes (default: one per disease)")
+    parser.add_argument('--n-jobs', type=int, help="cores per random forest (default: CPUs / workers)")
+    parser.add_argument('--force', action='store_true', help="retrain even if data and settings are unchanged (or the saved model came from --search)")
+    parser.add_argument('--no-cache', action='store_true', help="always re-parse the CSV datasets")
+    parser.add_argument('--search', action='store_true',
+                        help="choose hyperparameters by CV accuracy and measured latency")
+    args = parser.parse_args(argv)
+    unknown = set(args.diseases) - set(DISEASE_SPECS)
+    if unknown:
+        parser.error(f"unknown disease(s): {', '.join(sorted(unknown))}")
+
+    results = train_all(args.diseases, workers=args.workers, n_jobs=args.n_jobs,
+                        force=args.force, use_cache=not args.no_cache, search=args.search)
+    if 'failed' not in results.values():
+        print(f"\n✅ ALL DONE! Models saved in {MODELS_DIR}.\n")
+    return 1 if 'failed' in results.values() else 0
 
-    print("\n✅ ALL DONE! Models saved in /models directory.\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
@@ -0,0 +1,170 @@
+# backend/password_hasher.py
+"""Bounded bcrypt worker pool.
+
+bcrypt is deliberately slow, so hashing runs on a small dedicated thread pool
+(bcrypt releases the GIL) instead of directly on request threads. At most
+``max_workers + max_queue`` operations are admitted at once; beyond that
+callers get ``HashingQueueFull`` straight away and the API answers 429 with a
+Retry-After hint rather than letting a login storm pile up.
+
+Successful verifications are remembered for a short TTL under an HMAC of
+(username, stored hash, password) with a per-process random key, so a client
+retrying or re-logging in does not pay for bcrypt again and no password-
+equivalent value is kept in memory. A password change alters the stored hash
+and therefore misses the cache.
+"""
+import hashlib
+import hmac
+import math
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+HASH_MAX_WORKERS = int(os.environ.get('HASH_MAX_WORKERS', min(4, os.cpu_count() or 1)))
+HASH_MAX_QUEUE = int(os.environ.get('HASH_MAX_QUEUE', 32))
+LOGIN_CACHE_TTL = float(os.environ.get('LOGIN_CACHE_TTL', 300))
+LOGIN_CACHE_SIZE = int(os.environ.get('LOGIN_CACHE_SIZE', 10000))
+
+
+class HashingQueueFull(Exception):
+    """Raised when the hashing pool is saturated; ``retry_after`` is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Password hashing queue is full, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(self, rounds=BCRYPT_ROUNDS, max_workers=HASH_MAX_WORKERS, max_queue=HASH_MAX_QUEUE,
+                 cache_ttl=LOGIN_CACHE_TTL, cache_size=LOGIN_CACHE_SIZE):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()       # hmac digest -> expiry (monotonic)
+        self._cache_key = secrets.token_bytes(32)
+
+        self._stats = {'hashes': 0, 'verifies': 0, 'rejected': 0, 'cache_hits': 0,
+                       'hash_time': 0.0, 'max_hash_time': 0.0, 'queue_wait': 0.0, 'max_queue_wait': 0.0}
+        self._in_flight = 0
+
+    # ---------------- Public API ----------------
+    def hash(self, password):
+        """Return a bcrypt hash (bytes) of ``password`` at the configured cost."""
+        return self._run('hashes', lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds)))
+
+    def verify(self, password, stored_hash, username=''):
+        if not password or not stored_hash:
+            return False
+        if isinstance(stored_hash, str):
+            stored_hash = stored_hash.encode('utf-8')
+
+        key = None
+        if self.cache_ttl > 0:
+            key = hmac.new(self._cache_key, b'\0'.join([username.encode('utf-8'), stored_hash,
+                                                        password.encode('utf-8')]), hashlib.sha256).digest()
+            if self._cache_hit(key):
+                return True
+
+        ok = self._run('verifies', lambda: bcrypt.checkpw(password.encode('utf-8'), stored_hash))
+        if ok and key is not None:
+            with self._lock:
+                self._cache[key] = time.monotonic() + self.cache_ttl
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return ok
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            done = s['hashes'] + s['verifies']
+            return {
+                'rounds': self.rounds,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'hashes': s['hashes'],
+                'verifies': s['verifies'],
+                'rejected': s['rejected'],
+                'cache_hits': s['cache_hits'],
+                'cache_size': len(self._cache),
+                'avg_hash_ms': round(s['hash_time'] / done * 1000, 1) if done else 0.0,
+                'max_hash_ms': round(s['max_hash_time'] * 1000, 1),
+                'avg_queue_wait_ms': round(s['queue_wait'] / done * 1000, 1) if done else 0.0,
+                'max_queue_wait_ms': round(s['max_queue_wait'] * 1000, 1),
+            }
+
+    # ---------------- Internals ----------------
+    def _cache_hit(self, key):
+        with self._lock:
+            expires = self._cache.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._cache[key]
+                return False
+            self._cache.move_to_end(key)
+            self._stats['cache_hits'] += 1
+            return True
+
+    def _pool(self):
+        # Worker threads do not survive fork(); pre-fork servers get a fresh pool per process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='bcrypt')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _retry_after(self):
+        with self._lock:
+            done = self._stats['hashes'] + self._stats['verifies']
+            avg = self._stats['hash_time'] / done if done else 0.25
+            backlog = self._in_flight
+        return max(1, math.ceil(avg * backlog / self.max_workers))
+
+    def _run(self, kind, fn):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingQueueFull(self._retry_after())
+
+        with self._lock:
+            self._in_flight += 1
+        submitted = time.perf_counter()
+        timing = {}
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                timing['wait'] = started - submitted
+                timing['run'] = time.perf_counter() - started
+
+        try:
+            return self._pool().submit(task).result()
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                if timing:
+                    s = self._stats
+                    s[kind] += 1
+                    s['queue_wait'] += timing['wait']
+                    s['max_queue_wait'] = max(s['max_queue_wait'], timing['wait'])
+                    s['hash_time'] += timing['run']
+                    s['max_hash_time'] = max(s['max_hash_time'], timing['run'])
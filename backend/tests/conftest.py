@@ -0,0 +1,5 @@
+import os
+import sys
+
+# backend/ modules import each other by bare name (``from tree_engine import ...``)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
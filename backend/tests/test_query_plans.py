@@ -0,0 +1,9 @@
+from database import SCHEMA_MIGRATIONS, Database
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    db = Database(str(tmp_path / 'medical_app.db'), pool_size=1)
+    with db.connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_MIGRATIONS[-1][0]
+    assert db.explain_hot_queries()
+    assert db.check_query_plans() == {}
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+
+from inference import DISEASES, load_model_bundle
+from model_trainer import load_dataset
+from tree_engine import _dataset_matrix, compile_ensemble
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS_DIR = os.path.join(BACKEND_DIR, 'datasets')
+MODELS_DIR = os.path.join(BACKEND_DIR, 'models')
+
+
+def assert_parity(model, X):
+    expected = model.predict_proba(X)
+    actual = compile_ensemble(model).predict_proba(X)
+    # Forests average the same leaf values; boosting sums the stages in another order
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-12)
+    assert (actual.argmax(axis=1) == expected.argmax(axis=1)).all()
+
+
+@pytest.mark.parametrize('disease', DISEASES)
+def test_bundled_models_match_sklearn(disease):
+    path = os.path.join(MODELS_DIR, f'{disease}_model.pkl')
+    if not os.path.exists(path):
+        pytest.skip(f'no {disease} model bundle')
+    bundle = load_model_bundle(disease, path)
+    assert_parity(bundle.model, _dataset_matrix(disease, bundle.feature_columns, DATASETS_DIR))
+
+
+@pytest.mark.parametrize('estimator', [
+    RandomForestClassifier(n_estimators=25, random_state=0),
+    GradientBoostingClassifier(n_estimators=25, random_state=0),
+], ids=['forest', 'boosting'])
+@pytest.mark.parametrize('disease', DISEASES)
+def test_fitted_ensembles_match_sklearn(disease, estimator):
+    X, y = load_dataset(disease, DATASETS_DIR, cache_dir=None)[:2]
+    assert_parity(estimator.fit(X, y), np.asarray(X, dtype=np.float64))
@@ -0,0 +1,187 @@
+# backend/tree_engine.py
+"""Flattened tree-ensemble inference.
+
+Fitted RandomForest / GradientBoosting classifiers are converted once into flat
+NumPy arrays (feature, threshold, children, leaf values) covering every node of
+every tree. Scoring then walks all trees for all rows at once, one tree level
+per step, with no per-call estimator validation.
+
+A StandardScaler in front of the ensemble (a two-step Pipeline, as older
+bundles are loaded) is applied inside the compiled form exactly as
+``StandardScaler.transform`` does it.
+
+Parity with sklearn on the bundled datasets is tested in
+tests/test_tree_engine.py; ``python tree_engine.py`` from backend/ prints the
+same check for the models in backend/models.
+"""
+import os
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+TREE_LEAF = -1
+
+
+class CompiledEnsemble:
+    """Array form of a tree ensemble with a sklearn-like ``predict_proba``."""
+
+    def __init__(self, kind, classes, n_features, roots, feature, threshold, left, right,
+                 value, depth, learning_rate=1.0, init_raw=0.0, mean=None, scale=None):
+        self.kind = kind                  # 'forest' or 'boosting'
+        self.classes_ = classes
+        self.n_features_in_ = n_features
+        self.roots = roots                # (n_trees,) global index of each root
+        self.feature = feature            # (n_nodes,) split feature, 0 at leaves
+        self.threshold = threshold        # (n_nodes,) split threshold
+        self.left = left                  # (n_nodes,) leaves point to themselves
+        self.right = right
+        self.children = np.column_stack([left, right]).ravel()   # [left0, right0, left1, ...]
+        self.value = value                # forest: (n_nodes, n_classes) probas, boosting: (n_nodes,)
+        self.depth = depth
+        self.learning_rate = learning_rate
+        self.init_raw = init_raw
+        self.mean = mean                  # StandardScaler applied first, or None
+        self.scale = scale
+
+    def apply(self, X):
+        """Return the global leaf index reached by every (row, tree) pair."""
+        if self.mean is not None:
+            # Same float64 arithmetic as StandardScaler.transform, before the float32 cast
+            X = (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+        # sklearn compares float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        n_rows = X.shape[0]
+        flat_X = X.ravel()
+        row_offset = (np.arange(n_rows) * X.shape[1])[:, None]
+
+        nodes = np.broadcast_to(self.roots, (n_rows, len(self.roots))).copy()
+        for _ in range(self.depth):
+            # ~(x <= t) rather than x > t so NaN goes right, as in sklearn
+            go_right = ~(flat_X.take(row_offset + self.feature.take(nodes)) <= self.threshold.take(nodes))
+            nodes = self.children.take(2 * nodes + go_right)
+        return nodes
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        if self.kind == 'forest':
+            return self.value[leaves].mean(axis=1)
+
+        raw = self.init_raw + self.learning_rate * self.value[leaves].sum(axis=1)
+        p_pos = 1.0 / (1.0 + np.exp(-raw))
+        return np.column_stack([1.0 - p_pos, p_pos])
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def _flatten(trees, leaf_values):
+    """Concatenate sklearn ``Tree`` objects into global node arrays."""
+    roots, feature, threshold, left, right, value = [], [], [], [], [], []
+    offset, depth = 0, 0
+    for tree, leaf_value in zip(trees, leaf_values):
+        n = tree.node_count
+        idx = np.arange(n, dtype=np.intp)
+        is_leaf = tree.children_left == TREE_LEAF
+
+        roots.append(offset)
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(is_leaf, idx, tree.children_left) + offset)
+        right.append(np.where(is_leaf, idx, tree.children_right) + offset)
+        value.append(leaf_value)
+        offset += n
+        depth = max(depth, tree.max_depth)
+
+    return (np.asarray(roots, dtype=np.intp), np.concatenate(feature).astype(np.intp),
+            np.concatenate(threshold).astype(np.float64),
+            np.concatenate(left), np.concatenate(right),
+            np.concatenate(value), depth)
+
+
+def compile_ensemble(model):
+    """Convert a fitted RandomForestClassifier / binary GradientBoostingClassifier,
+    optionally as a Pipeline behind a StandardScaler."""
+    if isinstance(model, Pipeline):
+        if len(model.steps) != 2 or not isinstance(model.steps[0][1], StandardScaler):
+            raise ValueError('Only a StandardScaler + ensemble Pipeline is supported')
+        scaler = model.steps[0][1]
+        compiled = compile_ensemble(model.steps[-1][1])
+        n = compiled.n_features_in_
+        compiled.mean = np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(n), dtype=np.float64)
+        compiled.scale = np.asarray(scaler.scale_ if scaler.with_std else np.ones(n), dtype=np.float64)
+        return compiled
+
+    if isinstance(model, RandomForestClassifier):
+        if model.n_outputs_ != 1:
+            raise ValueError('Multi-output forests are not supported')
+        trees = [est.tree_ for est in model.estimators_]
+        leaf_values = []
+        for tree in trees:
+            counts = tree.value[:, 0, :]
+            totals = counts.sum(axis=1, keepdims=True)
+            totals[totals == 0.0] = 1.0
+            leaf_values.append(counts / totals)
+        roots, feature, threshold, left, right, value, depth = _flatten(trees, leaf_values)
+        return CompiledEnsemble('forest', model.classes_, model.n_features_in_, roots, feature,
+                                threshold, left, right, value, depth)
+
+    if isinstance(model, GradientBoostingClassifier):
+        if model.estimators_.shape[1] != 1:
+            raise ValueError('Only binary GradientBoostingClassifier is supported')
+        estimators = model.estimators_[:, 0]
+        trees = [est.tree_ for est in estimators]
+        roots, feature, threshold, left, right, value, depth = _flatten(
+            trees, [tree.value[:, 0, 0] for tree in trees])
+
+        # The init estimator's raw score is constant; recover it from one row.
+        x0 = np.zeros((1, model.n_features_in_))
+        stages = sum(est.predict(x0)[0] for est in estimators)
+        init_raw = float(model.decision_function(x0)[0] - model.learning_rate * stages)
+        return CompiledEnsemble('boosting', model.classes_, model.n_features_in_, roots, feature,
+                                threshold, left, right, value, depth,
+                                learning_rate=model.learning_rate, init_raw=init_raw)
+
+    raise ValueError(f'Unsupported estimator type: {type(model).__name__}')
+
+
+# ---------------- PARITY CHECK ----------------
+def _dataset_matrix(disease, features, datasets_dir):
+    """Feature matrix from the bundled CSV, encoded the way model_trainer does it."""
+    import pandas as pd
+
+    df = pd.read_csv(os.path.join(datasets_dir, f'{disease}.csv'))
+    X = df[features].copy()
+    for col in X.columns:
+        if X[col].dtype == 'object':
+            X[col] = X[col].astype('category').cat.codes
+    return X.fillna(X.mean()).to_numpy(dtype=np.float64)
+
+
+def check_parity(models_dir='models', datasets_dir='datasets'):
+    from inference import DISEASES, load_model_bundle
+
+    ok = True
+    for disease in DISEASES:
+        path = os.path.join(models_dir, f'{disease}_model.pkl')
+        if not os.path.exists(path):
+            continue
+        bundle = load_model_bundle(disease, path)
+        X = _dataset_matrix(disease, bundle.feature_columns, datasets_dir)
+
+        expected = bundle.model.predict_proba(X)
+        actual = compile_ensemble(bundle.model).predict_proba(X)
+        max_diff = float(np.abs(expected - actual).max())
+        same_labels = bool((expected.argmax(axis=1) == actual.argmax(axis=1)).all())
+        passed = max_diff < 1e-9 and same_labels
+        ok &= passed
+        print(f"{'✅' if passed else '❌'} {disease}: {len(X)} rows, max |Δp| = {max_diff:.2e}, "
+              f"labels {'match' if same_labels else 'DIFFER'}")
+    return ok
+
+
+if __name__ == '__main__':
+    import sys
+    import warnings
+    warnings.filterwarnings('ignore')
+    sys.exit(0 if check_parity() else 1)